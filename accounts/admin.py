@@ -1,13 +1,17 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser
+from django.utils import timezone
+from jobs.admin import BackgroundDeletionMixin
+from .deletion import start_user_deletion
+from .models import CustomUser, OutboxEmail
 
 
 @admin.register(CustomUser)
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(BackgroundDeletionMixin, UserAdmin):
     model = CustomUser
     list_display = ('id', 'email', 'phone', 'name', 'role', 'subscription_plan', 'is_active', 'date_joined')
     list_filter = ('role', 'subscription_plan', 'is_active', 'is_staff', 'is_superuser', 'date_joined')
+    list_select_related = ('subscription_plan',)
     search_fields = ('email', 'phone', 'name')
     ordering = ('-date_joined',)
     
@@ -26,3 +30,32 @@ class CustomUserAdmin(UserAdmin):
             'fields': ('email', 'phone', 'name', 'password1', 'password2', 'role', 'subscription_plan'),
         }),
     )
+    
+    # Deactivates the user, then deletes their subscriptions and usage in chunks
+    deletion_job = staticmethod(start_user_deletion)
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    """Admin interface for the email outbox"""
+    
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('subject', 'to', 'last_error')
+    readonly_fields = [field.name for field in OutboxEmail._meta.fields]
+    
+    actions = ['retry_emails']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def recipients(self, obj):
+        return ', '.join(obj.to)
+    
+    def retry_emails(self, request, queryset):
+        """Admin action to send failed emails again"""
+        updated = queryset.filter(status=OutboxEmail.FAILED).update(
+            status=OutboxEmail.PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f'{updated} email(s) queued again.')
+    retry_emails.short_description = "Retry selected failed emails"
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        # In lean mode drf_spectacular is imported when the schema is generated
+        if not getattr(settings, 'LEAN_STARTUP', False):
+            from . import schema  # noqa: F401
@@ -0,0 +1,55 @@
+import copy
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from invalidation.bus import track
+from medhashaala.resilience import UNAVAILABLE, DatabaseUnavailable, database_breaker
+from subscriptions.entitlements import get_entitlement_setting
+
+User = get_user_model()
+
+_lock = threading.Lock()
+# str(user id) -> (user, monotonic load time) of the users this worker authenticated
+_known_users = {}
+
+
+class ResilientJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that keeps authenticating recently seen users from
+    memory while the database is unreachable, for up to
+    ``ENTITLEMENTS['MAX_STALE']`` seconds (see medhashaala.resilience).
+    """
+    
+    def get_user(self, validated_token):
+        try:
+            with database_breaker.guard():
+                user = super().get_user(validated_token)
+        except UNAVAILABLE:
+            snapshot = _known_users.get(str(validated_token.get(api_settings.USER_ID_CLAIM)))
+            if snapshot is None or time.monotonic() - snapshot[1] > get_entitlement_setting('MAX_STALE'):
+                raise DatabaseUnavailable()
+            # Shared between requests: hand out copies
+            return copy.copy(snapshot[0])
+        with _lock:
+            if len(_known_users) >= get_entitlement_setting('MAX_ENTRIES'):
+                _known_users.clear()
+            _known_users[str(user.pk)] = (user, time.monotonic())
+        return user
+
+
+def forget_user(user_id=None):
+    """Drop a remembered user, or all of them"""
+    with _lock:
+        if user_id is None:
+            _known_users.clear()
+        else:
+            _known_users.pop(str(user_id), None)
+
+
+# A deactivated or changed user must not be authenticated from memory; saves
+# of other fields only, such as last_login on every login, publish nothing
+track(User, forget_user, fields=['is_active', 'password', 'role', 'subscription_plan'])
@@ -0,0 +1,57 @@
+"""
+Background deletion of users.
+
+Deleting a user cascades to their subscriptions, archived subscriptions,
+subscription history and usage records. ``start_user_deletion``
+deactivates the user, which stops them from logging in and makes their
+tokens fail authentication, and enqueues ``delete_user``. That job deletes
+the dependents in chunks (see ``jobs.chunks``) and then the user, whose
+remaining relations (admin log entries, groups) are small.
+"""
+
+from django.contrib.auth import get_user_model
+from django.db import router, transaction
+
+from invalidation.bus import publish_rows
+from jobs.chunks import first_chunk, raw_delete, run_in_chunks
+from jobs.queue import enqueue
+
+
+def start_user_deletion(user):
+    """Deactivate ``user`` and enqueue their deletion; return the job"""
+    with transaction.atomic():
+        if user.is_active:
+            user.is_active = False
+            user.save(update_fields=['is_active'])
+        return enqueue(delete_user, [str(user.pk)], key=f'delete-user:{user.pk}')
+
+
+def delete_user(user_id):
+    """Delete the dependents of a user chunk by chunk, then the user; return the progress"""
+    from subscriptions.models import ArchivedSubscription, SubscriptionInterval, UsageRecord, UserSubscription
+
+    user = get_user_model().objects.filter(pk=user_id).first()
+    if user is None:
+        return {'step': 'finished', 'done': {}}
+    using = router.db_for_write(UserSubscription)
+
+    def deleting(model, publish=False):
+        def step(size):
+            with transaction.atomic(using=using):
+                pks = first_chunk(model.objects.filter(user=user_id), size)
+                if publish:
+                    publish_rows(model.objects.filter(pk__in=pks), 'user_id')
+                raw_delete(model, pks, using)
+            return len(pks)
+        return step
+
+    return run_in_chunks(
+        [
+            # Their history goes with them, so the deletions are not recorded
+            ('subscriptions', deleting(UserSubscription, publish=True)),
+            ('archived_subscriptions', deleting(ArchivedSubscription)),
+            ('history', deleting(SubscriptionInterval)),
+            ('usage', deleting(UsageRecord)),
+        ],
+        finish=user.delete,
+    )
@@ -3,8 +3,10 @@ from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseU
 from django.db import models
 from django.utils import timezone
 
+from medhashaala.identity_map import IdentityMapQuerySet, cached, remember_instance
 
-class CustomUserManager(BaseUserManager):
+
+class CustomUserManager(BaseUserManager.from_queryset(IdentityMapQuerySet)):
     def create_user(self, email=None, phone=None, password=None, **extra_fields):
         if not email and not phone:
             raise ValueError('Either email or phone must be provided')
@@ -64,6 +66,10 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name']
 
+    class Meta:
+        # Foreign keys to users go through the request's identity map too
+        base_manager_name = 'objects'
+
     def __str__(self):
         return self.name or self.email or self.phone
 
@@ -79,8 +85,16 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     @property
     def current_subscription(self):
         """Get the current active subscription for this user"""
+        # Use prefetched subscriptions (see CustomUserViewSet) when available
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('subscriptions')
+        if prefetched is not None:
+            return next((subscription for subscription in prefetched if subscription.status == 'active'), None)
         try:
-            return self.subscriptions.filter(status='active').first()
+            # Loaded once per request (see medhashaala.identity_map)
+            return cached(
+                self.subscriptions.model, ('active', self.pk),
+                lambda: remember_instance(self.subscriptions.filter(status='active').first()),
+            )
         except:
             return None
 
@@ -97,3 +111,53 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         if self.subscription_plan:
             return self.subscription_plan.features
         return []
+
+
+class OutboxEmail(models.Model):
+    """An email waiting in the outbox for background delivery (see accounts.outbox)"""
+    
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+    
+    subject = models.CharField(max_length=998)
+    body = models.TextField(blank=True)
+    content_subtype = models.CharField(max_length=20, default='plain', help_text="'html' for an HTML body")
+    from_email = models.CharField(max_length=320)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    reply_to = models.JSONField(default=list, blank=True)
+    headers = models.JSONField(default=dict, blank=True)
+    # [content, mimetype] pairs, e.g. the HTML version
+    alternatives = models.JSONField(default=list, blank=True)
+    # [filename, base64 content, mimetype] triples
+    attachments = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    claimed_by = models.CharField(max_length=32, blank=True, help_text="Token of the delivery run sending it")
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Outbox Email"
+        verbose_name_plural = "Outbox Emails"
+        indexes = [
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='pending'), name='outbox_pending_idx'),
+            models.Index(fields=['status', 'claimed_at'], name='outbox_status_claimed_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
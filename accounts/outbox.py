@@ -0,0 +1,224 @@
+"""
+Email outbox.
+
+With ``EMAIL_BACKEND = 'accounts.outbox.OutboxBackend'`` sending an email
+(Djoser's password/username change confirmations, password resets,
+renewal reminders, ...) only writes it to the ``OutboxEmail`` table, in the
+caller's transaction, and returns. ``deliver_outbox`` runs as a background
+job: it claims pending emails in batches of ``OUTBOX['BATCH_SIZE']`` and
+sends each batch over one connection of ``OUTBOX['BACKEND']`` (SMTP in
+production). A failed email is retried with an exponential backoff, up to
+``OUTBOX['MAX_ATTEMPTS']`` attempts.
+
+Sending an email schedules one delivery job per ``OUTBOX['WINDOW']``
+seconds, at the end of the window, so a burst of emails is delivered
+together; ``JOBS['PERIODIC']`` sweeps up retries.
+"""
+
+import base64
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from jobs.queue import enqueue
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+    'BATCH_SIZE': 50,
+    'WINDOW': 5,
+    'QUEUE': 'default',
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 60,
+    'MAX_BACKOFF': 3600,
+    'LEASE': 300,
+}
+
+
+def get_outbox_setting(name):
+    """Return an OUTBOX setting, falling back to the default value"""
+    return getattr(settings, 'OUTBOX', {}).get(name, DEFAULTS[name])
+
+
+def to_outbox(message):
+    """Return an unsaved OutboxEmail holding an EmailMessage"""
+    attachments = []
+    for attachment in message.attachments:
+        if not isinstance(attachment, tuple):
+            raise ValueError('MIMEBase attachments cannot be stored in the outbox')
+        filename, content, mimetype = attachment
+        if isinstance(content, str):
+            content = content.encode()
+        attachments.append([filename, base64.b64encode(content).decode('ascii'), mimetype])
+    return OutboxEmail(
+        subject=message.subject,
+        body=message.body,
+        content_subtype=message.content_subtype,
+        from_email=message.from_email,
+        to=message.to,
+        cc=message.cc,
+        bcc=message.bcc,
+        reply_to=message.reply_to,
+        headers=message.extra_headers,
+        alternatives=[list(alternative) for alternative in getattr(message, 'alternatives', [])],
+        attachments=attachments,
+    )
+
+
+def to_message(email):
+    """Rebuild the EmailMessage stored in an OutboxEmail"""
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        cc=email.cc,
+        bcc=email.bcc,
+        reply_to=email.reply_to,
+        headers=email.headers,
+        alternatives=[tuple(alternative) for alternative in email.alternatives],
+    )
+    message.content_subtype = email.content_subtype
+    for filename, content, mimetype in email.attachments:
+        message.attach(filename, base64.b64decode(content), mimetype)
+    return message
+
+
+class OutboxBackend(BaseEmailBackend):
+    """Email backend that stores messages in the outbox instead of sending them"""
+
+    def send_messages(self, email_messages):
+        emails = []
+        for message in email_messages:
+            if not message.recipients():
+                continue
+            try:
+                emails.append(to_outbox(message))
+            except ValueError:
+                if not self.fail_silently:
+                    raise
+        if not emails:
+            return 0
+        OutboxEmail.objects.bulk_create(emails)
+        schedule_delivery()
+        return len(emails)
+
+
+def schedule_delivery(now=None):
+    """Enqueue the delivery job of the current window (once per window)"""
+    now = now or timezone.now()
+    window = get_outbox_setting('WINDOW')
+    slot = int(now.timestamp() // window) + 1
+    return enqueue(
+        deliver_outbox,
+        queue=get_outbox_setting('QUEUE'),
+        run_at=datetime.fromtimestamp(slot * window, dt_timezone.utc),
+        key=f'outbox:{window}:{slot}',
+    )
+
+
+def claim_batch(size, now=None):
+    """Mark up to ``size`` due emails as sending and return them"""
+    now = now or timezone.now()
+    token = uuid.uuid4().hex
+    due = OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now).order_by('next_attempt_at', 'pk')
+    claim = {'status': OutboxEmail.SENDING, 'claimed_at': now, 'claimed_by': token}
+    if connections[router.db_for_write(OutboxEmail)].features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:size])
+            OutboxEmail.objects.filter(pk__in=ids).update(**claim)
+    else:
+        # SQLite: no row locks; concurrent runs split the rows between them
+        ids = list(due.values_list('pk', flat=True)[:size])
+        OutboxEmail.objects.filter(pk__in=ids, status=OutboxEmail.PENDING).update(**claim)
+    return list(OutboxEmail.objects.filter(claimed_by=token, status=OutboxEmail.SENDING).order_by('pk'))
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next delivery attempt"""
+    return min(get_outbox_setting('BACKOFF') * 2 ** (attempts - 1), get_outbox_setting('MAX_BACKOFF'))
+
+
+def _failed(email, exc, now):
+    attempts = email.attempts + 1
+    error = f'{type(exc).__name__}: {exc}'
+    if attempts < get_outbox_setting('MAX_ATTEMPTS'):
+        updates = {'status': OutboxEmail.PENDING, 'next_attempt_at': now + timedelta(seconds=retry_delay(attempts))}
+    else:
+        logger.error('Giving up on email %s after %s attempts: %s', email.pk, attempts, error)
+        updates = {'status': OutboxEmail.FAILED}
+    OutboxEmail.objects.filter(pk=email.pk).update(attempts=attempts, last_error=error, claimed_by='', **updates)
+
+
+def send_batch(emails):
+    """Send claimed emails over one connection; return (sent, failed)"""
+    now = timezone.now()
+    connection = get_connection(get_outbox_setting('BACKEND'))
+    try:
+        connection.open()
+    except Exception as exc:
+        logger.warning('Could not connect to send %s email(s): %s', len(emails), exc)
+        for email in emails:
+            _failed(email, exc, now)
+        return 0, len(emails)
+
+    sent = []
+    failed = 0
+    try:
+        for email in emails:
+            try:
+                connection.send_messages([to_message(email)])
+            except Exception as exc:
+                logger.warning('Could not send email %s: %s', email.pk, exc)
+                _failed(email, exc, now)
+                failed += 1
+                # The connection may be broken; start the rest of the batch on a new one
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    pass
+            else:
+                sent.append(email.pk)
+    finally:
+        connection.close()
+    OutboxEmail.objects.filter(pk__in=sent).update(
+        status=OutboxEmail.SENT, sent_at=timezone.now(), attempts=F('attempts') + 1, claimed_by='', last_error=''
+    )
+    return len(sent), failed
+
+
+def recover_stale(now=None):
+    """Return emails claimed by a delivery run that died to the pending state"""
+    now = now or timezone.now()
+    return OutboxEmail.objects.filter(
+        status=OutboxEmail.SENDING, claimed_at__lt=now - timedelta(seconds=get_outbox_setting('LEASE'))
+    ).update(status=OutboxEmail.PENDING, claimed_by='')
+
+
+def deliver_outbox(batch_size=None):
+    """Send every due email, a batch per connection; return the counts"""
+    batch_size = batch_size or get_outbox_setting('BATCH_SIZE')
+    recover_stale()
+    totals = {'sent': 0, 'failed': 0, 'batches': 0}
+    while True:
+        emails = claim_batch(batch_size)
+        if not emails:
+            break
+        sent, failed = send_batch(emails)
+        totals['sent'] += sent
+        totals['failed'] += failed
+        totals['batches'] += 1
+        if len(emails) < batch_size or not sent:
+            # Done, or the server is failing: leave the rest to the next run
+            break
+    return totals
@@ -0,0 +1,19 @@
+"""
+Precompiled hot queries of the accounts app (see medhashaala.prepared).
+"""
+
+from django.contrib.auth import get_user_model
+
+from medhashaala.prepared import PreparedQuery
+
+User = get_user_model()
+
+# Login lookups; email and phone are unique
+USER_BY_EMAIL = PreparedQuery(
+    lambda email: User.objects.filter(email=email)[:1],
+    email=User._meta.get_field('email'),
+)
+USER_BY_PHONE = PreparedQuery(
+    lambda phone: User.objects.filter(phone=phone)[:1],
+    phone=User._meta.get_field('phone'),
+)
@@ -0,0 +1,7 @@
+"""OpenAPI description of the accounts authentication classes"""
+
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+
+
+class ResilientJWTScheme(SimpleJWTScheme):
+    target_class = 'accounts.authentication.ResilientJWTAuthentication'
@@ -4,10 +4,13 @@ from django.core.exceptions import ValidationError
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from medhashaala.metrics import TimedSerializerMixin
+from subscriptions.sparse import SparseFieldsMixin
 from .models import CustomUser
+from .queries import USER_BY_EMAIL, USER_BY_PHONE
 
 
-class SubscriptionPlanSerializer(serializers.ModelSerializer):
+class SubscriptionPlanSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for subscription plan details"""
     
     class Meta:
@@ -21,7 +24,7 @@ class SubscriptionPlanSerializer(serializers.ModelSerializer):
         self.Meta.model = SubscriptionPlan
 
 
-class CustomUserCreateSerializer(UserCreateSerializer):
+class CustomUserCreateSerializer(TimedSerializerMixin, UserCreateSerializer):
     """Custom serializer for user registration that accepts email OR phone"""
     
     class Meta(UserCreateSerializer.Meta):
@@ -68,7 +71,7 @@ class CustomUserCreateSerializer(UserCreateSerializer):
         return user
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedSerializerMixin, SparseFieldsMixin, UserSerializer):
     """Custom serializer for user profile"""
     
     subscription_plan = SubscriptionPlanSerializer(read_only=True)
@@ -79,6 +82,18 @@ class CustomUserSerializer(UserSerializer):
         model = CustomUser
         fields = ('id', 'email', 'phone', 'name', 'role', 'subscription_plan', 
                  'subscription_plan_name', 'current_subscription', 'enabled_features', 'date_joined')
+        # Columns read by fields that are not model fields (?fields=);
+        # current_subscription uses the prefetched subscriptions
+        sparse_sources = {
+            'subscription_plan_name': ['subscription_plan__name'],
+            'current_subscription': [],
+        }
+        # ?expand=subscriptions adds the whole subscription history
+        expandable_fields = {
+            'subscriptions': (
+                'subscriptions.serializers.UserSubscriptionReadSerializer', {'many': True, 'read_only': True}
+            ),
+        }
     
     def get_current_subscription(self, obj):
         """Get current active subscription details"""
@@ -116,19 +131,12 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
             )
         
         # Try to find user by email or phone
-        user = None
         if '@' in login_field:
             # Assume it's an email
-            try:
-                user = CustomUser.objects.get(email=login_field)
-            except CustomUser.DoesNotExist:
-                pass
+            user = USER_BY_EMAIL.first(email=login_field)
         else:
             # Assume it's a phone number
-            try:
-                user = CustomUser.objects.get(phone=login_field)
-            except CustomUser.DoesNotExist:
-                pass
+            user = USER_BY_PHONE.first(phone=login_field)
         
         if not user:
             raise serializers.ValidationError(
@@ -1,3 +1,213 @@
-from django.test import TestCase
+import socketserver
+import threading
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.test import Client, TestCase, override_settings
+from .models import OutboxEmail
+
+User = get_user_model()
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """Local SMTP stand-in recording connections and received messages"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, fail_for=()):
+        super().__init__(('127.0.0.1', 0), FakeSMTPHandler)
+        self.connections = 0
+        self.messages = []
+        # Recipients refused with a temporary error
+        self.fail_for = set(fail_for)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ready')
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode().rstrip('\r\n')
+            if not line:
+                return
+            command = line.split(' ', 1)[0].upper()
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif command == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                address = line.split(':', 1)[1].strip(' <>')
+                if address in self.server.fail_for:
+                    self.reply('451 Try again later')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while (line := self.rfile.readline().decode()) not in ('.\r\n', ''):
+                    data.append(line)
+                self.server.messages.append((recipients, ''.join(data)))
+                self.reply('250 OK')
+            elif command == 'RSET':
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Not implemented')
+
+
+@override_settings(
+    EMAIL_BACKEND='accounts.outbox.OutboxBackend',
+    OUTBOX={'BACKEND': 'django.core.mail.backends.smtp.EmailBackend', 'BATCH_SIZE': 3, 'BACKOFF': 60},
+    EMAIL_HOST='127.0.0.1',
+    JOBS={},
+)
+class EmailOutboxTest(TestCase):
+    """Test cases for the email outbox and its batched delivery"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(email='user@example.com', name='User', password='Old-pass-123')
+
+    def send(self, count, html=False):
+        for index in range(count):
+            message = mail.EmailMultiAlternatives(f'Hello {index}', 'Plain body', 'noreply@example.com', [f'to{index}@example.com'])
+            if html:
+                message.attach_alternative('<p>HTML body</p>', 'text/html')
+            message.attach('note.txt', 'attached', 'text/plain')
+            message.send()
+
+    def test_djoser_email_goes_to_outbox(self):
+        """Test that a password change confirmation is stored, not sent, during the request"""
+        from jobs.models import Job
+
+        client = Client()
+        client.force_login(self.user)
+        with FakeSMTPServer() as server, self.settings(EMAIL_PORT=server.server_address[1]):
+            response = client.post('/api/auth/users/set_password/', {
+                'current_password': 'Old-pass-123', 'new_password': 'New-pass-456', 're_new_password': 'New-pass-456',
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 204)
+            self.assertEqual(server.connections, 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.to, ['user@example.com'])
+        self.assertEqual(email.status, OutboxEmail.PENDING)
+        self.assertTrue(Job.objects.filter(task='accounts.outbox.deliver_outbox').exists())
+
+    def test_batched_delivery(self):
+        """Test that emails are delivered in batches, one connection per batch"""
+        from accounts.outbox import deliver_outbox
+
+        self.send(7, html=True)
+        with FakeSMTPServer() as server, self.settings(EMAIL_PORT=server.server_address[1]):
+            result = deliver_outbox()
+        self.assertEqual(result, {'sent': 7, 'failed': 0, 'batches': 3})
+        self.assertEqual(server.connections, 3)
+        self.assertEqual(len(server.messages), 7)
+        recipients, data = server.messages[0]
+        self.assertEqual(recipients, ['to0@example.com'])
+        self.assertIn('text/html', data)
+        self.assertIn('note.txt', data)
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.SENT).count(), 7)
+
+    def test_retry(self):
+        """Test that failed emails are retried later and the rest of the batch is sent"""
+        from datetime import timedelta
+        from unittest import mock
+        from django.utils import timezone
+        from accounts.outbox import deliver_outbox
+
+        self.send(3)
+        with FakeSMTPServer(fail_for={'to1@example.com'}) as server, self.settings(EMAIL_PORT=server.server_address[1]):
+            with self.assertLogs('accounts.outbox', 'WARNING'):
+                self.assertEqual(deliver_outbox(), {'sent': 2, 'failed': 1, 'batches': 1})
+            failed = OutboxEmail.objects.get(to=['to1@example.com'])
+            self.assertEqual(failed.status, OutboxEmail.PENDING)
+            self.assertEqual(failed.attempts, 1)
+            self.assertIn('451', failed.last_error)
+            # Not due yet
+            self.assertEqual(deliver_outbox()['sent'], 0)
+
+            server.fail_for.clear()
+            later = timezone.now() + timedelta(seconds=61)
+            with mock.patch('django.utils.timezone.now', return_value=later):
+                self.assertEqual(deliver_outbox()['sent'], 1)
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.SENT).count(), 3)
+
+    def test_server_down(self):
+        """Test that emails stay in the outbox while the server is unreachable"""
+        from accounts.outbox import deliver_outbox
+
+        self.send(2)
+        with FakeSMTPServer() as server:
+            port = server.server_address[1]
+        with self.settings(EMAIL_PORT=port), self.assertLogs('accounts.outbox', 'WARNING'):
+            self.assertEqual(deliver_outbox(), {'sent': 0, 'failed': 2, 'batches': 1})
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.PENDING, attempts=1).count(), 2)
+
+
+@override_settings(JOBS={'CHUNK_SIZE': 2, 'CHUNK_PAUSE': 0})
+class UserDeletionTest(TestCase):
+    """Test cases for deleting users in the background"""
+
+    def setUp(self):
+        """Set up test data"""
+        from decimal import Decimal
+        from subscriptions.models import SubscriptionPlan, UsageRecord, UserSubscription
+
+        plan = SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('9.99'))
+        self.user = User.objects.create_user(email='user@example.com', name='User', password='Old-pass-123')
+        for status in ('active', 'expired', 'cancelled'):
+            UserSubscription.objects.create(user=self.user, plan=plan, status=status)
+        UsageRecord.objects.create(user=self.user, metric='api_calls', period='2026-10-01', count=3)
+
+    def test_delete_me_deactivates_then_deletes_in_background(self):
+        """Test that DELETE /users/me/ answers 202, deactivates the user and leaves the cascade to a job"""
+        from jobs.models import Job
+        from jobs.queue import Worker
+        from subscriptions.models import SubscriptionInterval, UsageRecord, UserSubscription
+
+        client = Client()
+        client.force_login(self.user)
+        response = client.delete(
+            '/api/auth/users/me/', {'current_password': 'Old-pass-123'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 202)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(UserSubscription.objects.filter(user=self.user).count(), 3)
+
+        Worker(name='w', poll_interval=0).run(burst=True)
+        job = Job.objects.get(pk=response.json()['job'])
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.progress['done'], {'subscriptions': 3, 'archived_subscriptions': 0, 'history': 3, 'usage': 1})
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(UserSubscription.objects.exists())
+        self.assertFalse(SubscriptionInterval.objects.exists())
+        self.assertFalse(UsageRecord.objects.exists())
+
+    def test_wrong_password_keeps_user(self):
+        """Test that the current password is still required"""
+        client = Client()
+        client.force_login(self.user)
+        response = client.delete('/api/auth/users/me/', {'current_password': 'wrong'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
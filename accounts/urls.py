@@ -1,8 +1,13 @@
 from django.urls import path
-from .views import CustomTokenObtainPairView
+from rest_framework.routers import SimpleRouter
+from .views import CustomTokenObtainPairView, CustomUserViewSet
+
+# Takes precedence over the users routes registered by djoser.urls
+router = SimpleRouter()
+router.register('users', CustomUserViewSet)
 
 urlpatterns = [
     path('jwt/create/', CustomTokenObtainPairView.as_view(), name='jwt-create'),
-]
+] + router.urls
 
 
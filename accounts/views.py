@@ -5,7 +5,14 @@ from rest_framework.permissions import AllowAny
 from rest_framework.request import Request
 from rest_framework.serializers import Serializer, CharField, ValidationError
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch, prefetch_related_objects
+from djoser import utils as djoser_utils
+from djoser.views import UserViewSet
+from jobs.views import accepted
 from rest_framework_simplejwt.tokens import RefreshToken
+from subscriptions.sparse import SparseFieldsMixin, SparseQuerysetMixin, sparse_params
+from .deletion import start_user_deletion
+from .queries import USER_BY_EMAIL, USER_BY_PHONE
 
 User = get_user_model()
 
@@ -23,12 +30,11 @@ class EmailOrPhoneLoginSerializer(Serializer):
         if not email and not phone:
             raise ValidationError('Either email or phone must be provided')
 
-        try:
-            if email:
-                user = User.objects.get(email=email)
-            else:
-                user = User.objects.get(phone=phone)
-        except User.DoesNotExist:
+        if email:
+            user = USER_BY_EMAIL.first(email=email)
+        else:
+            user = USER_BY_PHONE.first(phone=phone)
+        if user is None:
             raise ValidationError('Invalid credentials')
 
         if not user.check_password(password):
@@ -70,4 +76,45 @@ class CustomTokenObtainPairView(APIView):
         }
         return Response(data, status=status.HTTP_200_OK)
 
-# Create your views here.
+class CustomUserViewSet(SparseQuerysetMixin, UserViewSet):
+    """Djoser user endpoints with the relations CustomUserSerializer needs preloaded"""
+
+    # Fields rendered from the user's subscriptions
+    SUBSCRIPTION_FIELDS = ('current_subscription', 'subscriptions')
+
+    def subscriptions_prefetch(self):
+        from subscriptions.models import UserSubscription
+
+        return Prefetch('subscriptions', queryset=UserSubscription.objects.select_related('plan'))
+
+    def get_queryset(self):
+        queryset = super().get_queryset().order_by('date_joined')
+        if sparse_params(self.request) == ('', ''):
+            return queryset.select_related('subscription_plan').prefetch_related(self.subscriptions_prefetch())
+
+        # ?fields= / ?expand=: load only what the remaining fields render
+        serializer = self.get_serializer()
+        if not isinstance(serializer, SparseFieldsMixin):
+            return queryset
+        queryset = self.sparse_queryset(queryset, serializer)
+        if any(name in serializer.fields for name in self.SUBSCRIPTION_FIELDS):
+            queryset = queryset.prefetch_related(self.subscriptions_prefetch())
+        return queryset
+
+    def destroy(self, request, *args, **kwargs):
+        """As djoser's, but the user is deactivated now and deleted by a job, in chunks (202)"""
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        if instance == request.user:
+            djoser_utils.logout_user(self.request)
+        return accepted(request, start_user_deletion(instance))
+
+    def get_instance(self):
+        user = super().get_instance()
+        expand = sparse_params(self.request)[1]
+        if 'subscriptions' in (name.strip() for name in expand.split(',')):
+            # /users/me/?expand=subscriptions: one query for the history and its plans
+            prefetch_related_objects([user], self.subscriptions_prefetch())
+        return user
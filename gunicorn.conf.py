@@ -0,0 +1,46 @@
+"""
+Gunicorn configuration for medhashaala.
+
+Gunicorn loads ``gunicorn.conf.py`` from the working directory
+automatically, so ``gunicorn medhashaala.wsgi`` picks these hooks up.
+"""
+
+import os
+import shutil
+import tempfile
+
+
+def on_starting(server):
+    """Give the workers a fresh directory to publish their metrics in"""
+    directory = os.environ.get('METRICS_MULTIPROCESS_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+    else:
+        directory = tempfile.mkdtemp(prefix='medhashaala-metrics-')
+    os.makedirs(directory, exist_ok=True)
+    os.environ['METRICS_MULTIPROCESS_DIR'] = directory
+
+
+def post_worker_init(worker):
+    """Warm the worker up (routes, serializers, database, plan catalog) before it accepts requests"""
+    from django.conf import settings
+    from invalidation.bus import start_listener
+    from medhashaala.warmup import warm_up
+    from subscriptions.metering import start_flusher
+
+    # Evict cached plans and allowances when other workers change them
+    start_listener()
+    # Write usage counters behind even while the worker is idle
+    start_flusher()
+    if not settings.WARMUP['ENABLED']:
+        return
+    ready = warm_up()
+    worker.log.info('Worker warm-up %s', 'finished' if ready else 'failed; /readyz will retry')
+
+
+def worker_exit(server, worker):
+    """Write the worker's unflushed usage counters before it exits"""
+    from subscriptions.metering import flush, stop_flusher
+
+    stop_flusher()
+    flush()
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.utils.module_loading import import_module
+
+
+class InvalidationConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'invalidation'
+
+    def ready(self):
+        from .bus import get_invalidation_setting
+
+        # Subscribers register their models with bus.track() on import
+        for module in get_invalidation_setting('SUBSCRIBERS'):
+            import_module(module)
@@ -0,0 +1,300 @@
+"""
+Cross-worker cache invalidation bus.
+
+Per-process caches (the plan catalog, metering allowances, ...) register
+the models they depend on with ``track``. Saving or deleting an instance
+then publishes a compact event (model label, key, version) in the writer's
+transaction: a row of ``InvalidationEvent``, whose id is the version, and
+on PostgreSQL a ``NOTIFY`` that the server only delivers once the
+transaction commits. The writing process evicts its own entries right away
+and again on commit.
+
+Every worker runs a ``Listener`` thread (started by gunicorn's
+``post_worker_init`` and by ``run_jobs``). On PostgreSQL with psycopg 3 it
+``LISTEN``s on a dedicated connection, which must not go through a
+transaction-mode pooler (see ``INVALIDATION['LISTEN_OPTIONS']``); elsewhere
+it polls the event table every ``POLL_INTERVAL`` seconds. Each event is
+handled once per process. Delivery lag (from publishing to eviction) is
+exported at ``/metrics``.
+"""
+
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .models import InvalidationEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SUBSCRIBERS': [],
+    'CHANNEL': 'cache_invalidation',
+    'LISTEN_OPTIONS': {},
+    'POLL_INTERVAL': 1.0,
+    'POLL_OVERLAP': 60,
+    'RECONNECT_DELAY': 5,
+    'KEEP_HOURS': 24,
+}
+
+_lock = threading.Lock()
+# model label -> handlers called with the changed key (None for every key)
+_handlers = {}
+# version -> monotonic time it was handled
+_seen = {}
+_stats = {'received': 0, 'lag_sum': 0.0, 'lag_max': 0.0, 'last_lag': 0.0, 'mode': 'off'}
+_listener = None
+
+
+def get_invalidation_setting(name):
+    """Return an INVALIDATION setting, falling back to the default value"""
+    return getattr(settings, 'INVALIDATION', {}).get(name, DEFAULTS[name])
+
+
+def subscribe(label, handler):
+    """Call ``handler(key)`` whenever an event for the model ``label`` arrives"""
+    with _lock:
+        _handlers.setdefault(label, []).append(handler)
+
+
+def track(model, handler, key=None, fields=None):
+    """
+    Publish an event whenever an instance of ``model`` is saved or deleted,
+    and evict with ``handler``. ``key(instance)`` picks the key the event
+    carries (the primary key by default); one key function per model. With
+    ``fields``, saves whose ``update_fields`` include none of them publish
+    nothing.
+    """
+    label = model._meta.label_lower
+    subscribe(label, handler)
+    get_key = key or (lambda instance: instance.pk)
+    watched = None
+    if fields is not None:
+        watched = set()
+        for name in fields:
+            field = model._meta.get_field(name)
+            watched.update((field.name, field.attname))
+
+    def changed(sender, instance, using=None, update_fields=None, **kwargs):
+        if watched is not None and update_fields is not None and watched.isdisjoint(update_fields):
+            return
+        publish(label, get_key(instance), using=using)
+
+    post_save.connect(changed, sender=model, weak=False, dispatch_uid=f'invalidation.{label}.save')
+    post_delete.connect(changed, sender=model, weak=False, dispatch_uid=f'invalidation.{label}.delete')
+
+
+def publish(label, key=None, using=None):
+    """Publish an invalidation event in the current transaction; return its version"""
+    if not get_invalidation_setting('ENABLED'):
+        return None
+    using = using or router.db_for_write(InvalidationEvent)
+    key = '' if key is None else str(key)
+    event = InvalidationEvent.objects.using(using).create(model=label, key=key)
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        payload = json.dumps({'m': label, 'k': key, 'v': event.pk, 't': time.time()})
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [get_invalidation_setting('CHANNEL'), payload])
+    _evict(label, key)
+    # Again once committed, in case another thread reloaded the old rows meanwhile
+    transaction.on_commit(lambda: deliver(label, key, event.pk), using=using)
+    return event.pk
+
+
+def publish_rows(queryset, field='pk'):
+    """
+    Publish an event per distinct ``field`` value of ``queryset``; for bulk
+    ``update()`` and ``delete()``, which send no signals. Call it before
+    them, in the same transaction. Return the number of events.
+    """
+    label = queryset.model._meta.label_lower
+    keys = set(queryset.values_list(field, flat=True))
+    for key in keys:
+        publish(label, key, using=queryset.db)
+    return len(keys)
+
+
+def _evict(label, key):
+    for handler in _handlers.get(label, ()):
+        try:
+            handler(key or None)
+        except Exception:
+            logger.exception('Invalidation handler %r failed for %s:%s', handler, label, key)
+
+
+def deliver(label, key, version, published_at=None):
+    """Evict the entries of an event unless this process handled it already; return True if it did"""
+    now = time.monotonic()
+    with _lock:
+        if version in _seen:
+            return False
+        _seen[version] = now
+        if published_at is not None:
+            lag = max(0.0, time.time() - published_at)
+            _stats['received'] += 1
+            _stats['lag_sum'] += lag
+            _stats['lag_max'] = max(_stats['lag_max'], lag)
+            _stats['last_lag'] = lag
+    _evict(label, key)
+    return True
+
+
+def _forget_seen():
+    horizon = time.monotonic() - 2 * get_invalidation_setting('POLL_OVERLAP')
+    with _lock:
+        for version in [version for version, handled in _seen.items() if handled < horizon]:
+            del _seen[version]
+
+
+def _recent_events():
+    since = timezone.now() - timedelta(seconds=get_invalidation_setting('POLL_OVERLAP'))
+    return InvalidationEvent.objects.filter(created_at__gte=since).values_list('pk', 'model', 'key', 'created_at')
+
+
+def poll_once():
+    """
+    Handle the events of the last ``POLL_OVERLAP`` seconds not seen yet;
+    return how many there were. The overlap catches events of transactions
+    that committed after a later one.
+    """
+    handled = 0
+    for version, label, key, created_at in _recent_events():
+        if deliver(label, key, version, created_at.timestamp()):
+            handled += 1
+    _forget_seen()
+    return handled
+
+
+def mark_seen():
+    """Skip the recent events: a process that is only starting has nothing stale to evict"""
+    now = time.monotonic()
+    versions = [version for version, *_ in _recent_events()]
+    with _lock:
+        for version in versions:
+            _seen.setdefault(version, now)
+
+
+def handle_notification(payload):
+    """Handle a NOTIFY payload; return True if it evicted anything"""
+    try:
+        event = json.loads(payload)
+        return deliver(event['m'], event['k'], event['v'], event['t'])
+    except (ValueError, KeyError, TypeError):
+        logger.warning('Ignoring malformed invalidation event %r', payload)
+        return False
+
+
+def can_listen():
+    """Return True if events can be received with LISTEN instead of polling"""
+    connection = connections[router.db_for_write(InvalidationEvent)]
+    if connection.vendor != 'postgresql':
+        return False
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+    return is_psycopg3
+
+
+class Listener(threading.Thread):
+    """Receive invalidation events in the background until stopped"""
+
+    def __init__(self):
+        super().__init__(name='invalidation-listener', daemon=True)
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        try:
+            try:
+                mark_seen()
+            except Exception:
+                logger.exception('Could not read the recent invalidation events')
+            while not self.stopping.is_set():
+                try:
+                    if can_listen():
+                        self.listen()
+                    else:
+                        self.poll()
+                except Exception:
+                    logger.exception('Invalidation listener failed; reconnecting')
+                    _stats['mode'] = 'off'
+                    close_old_connections()
+                    self.stopping.wait(get_invalidation_setting('RECONNECT_DELAY'))
+        finally:
+            connections.close_all()
+
+    def poll(self):
+        _stats['mode'] = 'poll'
+        while not self.stopping.is_set():
+            poll_once()
+            close_old_connections()
+            self.stopping.wait(get_invalidation_setting('POLL_INTERVAL'))
+
+    def listen(self):
+        import psycopg
+        from psycopg import sql
+
+        params = connections[router.db_for_write(InvalidationEvent)].get_connection_params()
+        params.update(get_invalidation_setting('LISTEN_OPTIONS'))
+        with psycopg.connect(**params, autocommit=True) as listen_connection:
+            listen_connection.execute(sql.SQL('LISTEN {}').format(sql.Identifier(get_invalidation_setting('CHANNEL'))))
+            _stats['mode'] = 'listen'
+            # Catch up on events published while not listening
+            poll_once()
+            close_old_connections()
+            while not self.stopping.is_set():
+                for notification in listen_connection.notifies(timeout=get_invalidation_setting('POLL_INTERVAL')):
+                    handle_notification(notification.payload)
+                _forget_seen()
+
+
+def start_listener():
+    """Start this process's listener thread (once); return it, or None if the bus is disabled"""
+    global _listener
+    if not get_invalidation_setting('ENABLED'):
+        return None
+    with _lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = Listener()
+            _listener.start()
+        return _listener
+
+
+def stop_listener():
+    """Stop this process's listener thread"""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        listener.join(timeout=5)
+    _stats['mode'] = 'off'
+
+
+def invalidation_stats():
+    """Return the delivery statistics of this process"""
+    with _lock:
+        return dict(_stats)
+
+
+def reset():
+    """Forget the handled events and statistics of this process"""
+    with _lock:
+        _seen.clear()
+        _stats.update(received=0, lag_sum=0.0, lag_max=0.0, last_lag=0.0)
+
+
+def purge_events(hours=None):
+    """Delete events older than ``INVALIDATION['KEEP_HOURS']``; return how many"""
+    hours = get_invalidation_setting('KEEP_HOURS') if hours is None else hours
+    cutoff = timezone.now() - timedelta(hours=hours)
+    return InvalidationEvent.objects.filter(created_at__lt=cutoff).delete()[0]
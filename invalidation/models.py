@@ -0,0 +1,16 @@
+from django.db import models
+from django.utils import timezone
+
+
+class InvalidationEvent(models.Model):
+    """A change that per-process caches must evict (see invalidation.bus)"""
+    
+    model = models.CharField(max_length=100, help_text="Label of the changed model, e.g. subscriptions.subscriptionplan")
+    key = models.CharField(max_length=255, blank=True, help_text="Changed key; empty for every entry of the model")
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        ordering = ['id']
+    
+    def __str__(self):
+        return f'{self.model}:{self.key or "*"} (v{self.pk})'
@@ -0,0 +1,135 @@
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from subscriptions import catalog, metering
+from subscriptions.models import SubscriptionPlan, UserSubscription
+from . import bus
+from .models import InvalidationEvent
+
+User = get_user_model()
+
+
+class InvalidationBusTest(TestCase):
+    """Test cases for publishing and receiving cache invalidations"""
+
+    def setUp(self):
+        """Set up test data"""
+        bus.reset()
+        self.plan = SubscriptionPlan.objects.create(name='Basic', features=['limited_queries'], price=Decimal('0.00'))
+        self.user = User.objects.create_user(email='user@example.com', name='User', password='testpass123')
+        # As a worker starting now: the events above are not news
+        bus.mark_seen()
+
+    def test_publish_on_save(self):
+        """Test that saving a tracked model publishes an event and evicts locally on commit"""
+        catalog.load_plan_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plan.is_active = False
+            self.plan.save()
+            event = InvalidationEvent.objects.latest('pk')
+            self.assertEqual((event.model, event.key), ('subscriptions.subscriptionplan', str(self.plan.pk)))
+            self.assertIsNone(catalog._catalog)
+            # Another thread reloads the old rows before the commit
+            catalog.load_plan_catalog()
+        self.assertIsNone(catalog._catalog)
+        # Our own event is not handled again by the poller
+        self.assertEqual(bus.poll_once(), 0)
+
+    def test_untracked_field_saves_publish_nothing(self):
+        """Test that saving only fields the caches do not depend on publishes no event"""
+        from django.contrib.auth.models import update_last_login
+
+        InvalidationEvent.objects.all().delete()
+        update_last_login(None, self.user)
+        self.assertFalse(InvalidationEvent.objects.filter(model='accounts.customuser').exists())
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.user.subscription_plan_id = self.plan.pk
+        self.user.save(update_fields=['subscription_plan_id'])
+        self.user.save()
+        self.assertEqual(InvalidationEvent.objects.filter(model='accounts.customuser').count(), 3)
+
+    def test_poll_events_of_other_workers(self):
+        """Test that polling evicts once per event and records the delivery lag"""
+        catalog.load_plan_catalog()
+        InvalidationEvent.objects.create(
+            model='subscriptions.subscriptionplan', key=str(self.plan.pk),
+            created_at=timezone.now() - timedelta(seconds=2),
+        )
+        self.assertEqual(bus.poll_once(), 1)
+        self.assertIsNone(catalog._catalog)
+        catalog.load_plan_catalog()
+        self.assertEqual(bus.poll_once(), 0)
+        self.assertIsNotNone(catalog._catalog)
+
+        stats = bus.invalidation_stats()
+        self.assertEqual(stats['received'], 1)
+        self.assertGreaterEqual(stats['lag_max'], 2)
+
+    def test_notification_payload(self):
+        """Test that NOTIFY payloads evict the entries of their key"""
+        metering._allowances[(self.user.pk, 'queries', metering.current_period())] = (3, 0, 0, time.monotonic())
+        payload = json.dumps({'m': 'subscriptions.usersubscription', 'k': str(self.user.pk), 'v': 10 ** 9, 't': time.time()})
+        self.assertTrue(bus.handle_notification(payload))
+        self.assertEqual(metering._allowances, {})
+        self.assertFalse(bus.handle_notification(payload))
+        with self.assertLogs('invalidation.bus', 'WARNING'):
+            self.assertFalse(bus.handle_notification('not json'))
+
+    def test_bulk_updates_publish(self):
+        """Test that bulk status changes publish one event per user"""
+        from subscriptions.jobs import expire_subscriptions
+
+        UserSubscription.objects.create(user=self.user, plan=self.plan, end_date=timezone.now() - timedelta(days=1))
+        InvalidationEvent.objects.all().delete()
+        self.assertEqual(expire_subscriptions(), 1)
+        self.assertEqual(
+            list(InvalidationEvent.objects.values_list('model', 'key')),
+            [('subscriptions.usersubscription', str(self.user.pk))],
+        )
+
+    def test_metrics(self):
+        """Test that the delivery lag is exported"""
+        from medhashaala.metrics import render_prometheus
+
+        text = render_prometheus({})
+        self.assertIn('medhashaala_invalidation_events_total{', text)
+        self.assertIn('medhashaala_invalidation_lag_seconds_count{', text)
+
+    def test_purge_events(self):
+        """Test that old events are deleted"""
+        InvalidationEvent.objects.create(model='x', created_at=timezone.now() - timedelta(hours=25))
+        InvalidationEvent.objects.create(model='x')
+        self.assertEqual(bus.purge_events(), 1)
+
+
+@override_settings(INVALIDATION={'POLL_INTERVAL': 0.05})
+class ListenerTest(TransactionTestCase):
+    """Test cases for the background listener thread"""
+
+    def setUp(self):
+        """Set up test data"""
+        bus.reset()
+        self.plan = SubscriptionPlan.objects.create(name='Basic', features=[], price=Decimal('0.00'))
+
+    def tearDown(self):
+        bus.stop_listener()
+
+    def test_listener_evicts(self):
+        """Test that a running listener evicts the catalog after another process changes a plan"""
+        listener = bus.start_listener()
+        deadline = time.monotonic() + 5
+        while bus.invalidation_stats()['mode'] != 'poll' and time.monotonic() < deadline:
+            time.sleep(0.02)
+        # Published by another worker: this process has not handled it
+        InvalidationEvent.objects.create(model='subscriptions.subscriptionplan', key=str(self.plan.pk))
+        catalog.load_plan_catalog()
+        while catalog._catalog is not None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertIsNone(catalog._catalog)
+        self.assertIs(bus.start_listener(), listener)
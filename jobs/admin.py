@@ -0,0 +1,57 @@
+from django.contrib import admin
+from django.http import HttpResponseRedirect
+from django.urls import reverse
+from django.utils import timezone
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Admin interface for inspecting and retrying background jobs"""
+    
+    list_display = ['id', 'task', 'queue', 'status', 'attempts', 'run_at', 'locked_by', 'finished_at']
+    list_filter = ['status', 'queue', 'task']
+    search_fields = ['task', 'key', 'last_error']
+    readonly_fields = [field.name for field in Job._meta.fields]
+    
+    actions = ['retry_jobs']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def retry_jobs(self, request, queryset):
+        """Admin action to run failed jobs again"""
+        updated = queryset.filter(status=Job.FAILED).update(
+            status=Job.QUEUED, attempts=0, run_at=timezone.now(), finished_at=None
+        )
+        self.message_user(request, f'{updated} job(s) queued again.')
+    retry_jobs.short_description = "Retry selected failed jobs"
+
+
+class BackgroundDeletionMixin:
+    """
+    ModelAdmin mixin for models deleted by a background job: deleting an
+    object (or the "delete selected" action) calls ``deletion_job(obj)``,
+    which deactivates it and enqueues its deletion, instead of cascading in
+    the request, and the confirmation page lists the objects without
+    walking their relations.
+    """
+    
+    deletion_job = None
+    
+    def get_deleted_objects(self, objs, request):
+        perms_needed = set() if self.has_delete_permission(request) else {self.opts.verbose_name}
+        objs = list(objs)
+        return [str(obj) for obj in objs], {self.opts.verbose_name_plural: len(objs)}, perms_needed, []
+    
+    def delete_model(self, request, obj):
+        self.deletion_job(obj)
+    
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            self.deletion_job(obj)
+        self.message_user(request, 'The selected objects were deactivated and are being deleted in the background.')
+    
+    def response_delete(self, request, obj_display, obj_id):
+        self.message_user(request, f'“{obj_display}” was deactivated and is being deleted in the background.')
+        return HttpResponseRedirect(reverse(f'admin:{self.opts.app_label}_{self.opts.model_name}_changelist'))
@@ -0,0 +1,66 @@
+"""
+Bounded-chunk processing for long background jobs.
+
+A job that deletes or rewrites an unbounded number of rows would hold its
+locks, and the worker's lease, for as long as that takes. ``run_in_chunks``
+runs it as a list of steps instead: each call of a step handles at most
+``JOBS['CHUNK_SIZE']`` rows in its own transaction and returns how many it
+handled, and is called again until it handles less than a full chunk.
+
+After ``JOBS['MAX_CHUNKS']`` chunks the job raises ``Requeue`` and carries
+on in its next run. Steps must therefore work on "the rows still left"
+(e.g. delete the first chunk of what remains), never on offsets. The
+progress (the current step and the rows handled per step, across runs) is
+saved on the job after every chunk, where the job status endpoint shows it.
+"""
+
+import time
+
+from .queue import Requeue, current_job, get_jobs_setting, report_progress
+
+
+def first_chunk(queryset, size):
+    """Return the primary keys of the first ``size`` rows of ``queryset``"""
+    return list(queryset.order_by('pk').values_list('pk', flat=True)[:size])
+
+
+def raw_delete(model, pks, using):
+    """
+    Delete rows with a single DELETE, without collecting related objects or
+    sending signals; only for models no other model references.
+    """
+    model._base_manager.using(using).filter(pk__in=pks)._raw_delete(using)
+
+
+def run_in_chunks(steps, finish=None):
+    """
+    Run ``steps``, ``(name, function(size))`` pairs, chunk by chunk and in
+    order, then ``finish()``; return the progress. Outside a job every step
+    runs to the end.
+    """
+    job = current_job()
+    progress = dict(job.progress or {}) if job is not None else {}
+    done = progress['done'] = dict(progress.get('done', {}))
+    size = get_jobs_setting('CHUNK_SIZE')
+    budget = get_jobs_setting('MAX_CHUNKS') if job is not None else None
+    chunks = 0
+    for name, step in steps:
+        done.setdefault(name, 0)
+        progress['step'] = name
+        while True:
+            if budget is not None and chunks >= budget:
+                report_progress(progress)
+                raise Requeue()
+            if chunks:
+                time.sleep(get_jobs_setting('CHUNK_PAUSE'))
+            handled = step(size)
+            chunks += 1
+            done[name] += handled
+            report_progress(progress)
+            if handled < size:
+                break
+    if finish is not None:
+        finish()
+    progress['step'] = 'finished'
+    report_progress(progress)
+    return progress
@@ -0,0 +1,36 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invalidation.bus import start_listener, stop_listener
+from jobs.queue import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs; start several processes to run jobs concurrently'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', dest='queues',
+                            help="Queue to work on; repeat for several (default: JOBS['QUEUES'])")
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is ready')
+        parser.add_argument('--max-jobs', type=int, help='Exit after running this many jobs')
+        parser.add_argument('--poll-interval', type=float, help="Seconds between polls when idle (default: JOBS['POLL_INTERVAL'])")
+        parser.add_argument('--name', help='Worker name recorded on claimed jobs (default: host:pid)')
+
+    def handle(self, *args, **options):
+        if options['max_jobs'] is not None and options['max_jobs'] < 1:
+            raise CommandError('--max-jobs must be positive')
+
+        worker = Worker(queues=options['queues'], name=options['name'], poll_interval=options['poll_interval'])
+        # Finish the current job on SIGTERM / Ctrl-C
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+
+        self.stdout.write(f"Worker {worker.name} on {', '.join(worker.queues)}")
+        # Jobs read the same per-process caches as requests
+        start_listener()
+        try:
+            processed = worker.run(burst=options['burst'], max_jobs=options['max_jobs'])
+        finally:
+            stop_listener()
+        self.stdout.write(f'{processed} job(s) run, {worker.failed} failed')
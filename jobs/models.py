@@ -0,0 +1,57 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """A background job, run by the ``run_jobs`` workers (see jobs.queue)"""
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    
+    task = models.CharField(max_length=200, help_text="Dotted path of the function to call")
+    args = models.JSONField(default=list, blank=True, encoder=DjangoJSONEncoder)
+    kwargs = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    queue = models.CharField(max_length=50, default='default')
+    priority = models.SmallIntegerField(default=0, help_text="Lower values run first")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now, help_text="Not run before this time")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    key = models.CharField(
+        max_length=200, null=True, blank=True, unique=True,
+        help_text="Deduplication key; a job with the same key is only enqueued once"
+    )
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    progress = models.JSONField(
+        null=True, blank=True, encoder=DjangoJSONEncoder, help_text="Reported by the task while it runs"
+    )
+    last_error = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=100, blank=True, help_text="Worker running the job")
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Job"
+        verbose_name_plural = "Jobs"
+        indexes = [
+            # The claim query: queued jobs of a queue in priority / run_at order
+            models.Index(fields=['queue', 'priority', 'run_at'], condition=Q(status='queued'), name='jobs_ready_idx'),
+            # Lease recovery and purging
+            models.Index(fields=['status', 'locked_at'], name='jobs_status_locked_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
@@ -0,0 +1,304 @@
+"""
+Database-backed job queue.
+
+Jobs are rows of ``jobs.Job``; ``enqueue`` adds one, in the caller's
+transaction, so a job enqueued by a request that rolls back never runs.
+Workers (``manage.py run_jobs``) claim the next ready job with
+``SELECT ... FOR UPDATE SKIP LOCKED``, so any number of worker processes
+share a queue without a broker and without blocking each other. SQLite has
+no row locks; there a conditional UPDATE decides which worker won, and the
+loser moves on to the next job.
+
+A failing job is retried after an exponential backoff until it has run
+``max_attempts`` times. A worker that dies mid-job leaves it ``running``;
+it is queued again once its lease (``JOBS['LEASE']`` seconds) has expired,
+so the lease must be longer than the slowest job.
+
+Periodic jobs (``JOBS['PERIODIC']``) are enqueued once per period with a
+deduplication key, however many workers are running.
+
+A long task reports its progress with ``report_progress`` and, to stay
+within the lease, raises ``Requeue`` to be queued again and continue in a
+later run of the same job (see ``jobs.chunks``).
+"""
+
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'QUEUES': ['default'],
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 30,
+    'MAX_BACKOFF': 3600,
+    'LEASE': 600,
+    'KEEP_DAYS': 14,
+    'PERIODIC': {},
+    'CHUNK_SIZE': 500,
+    'MAX_CHUNKS': 50,
+    'CHUNK_PAUSE': 0.05,
+}
+
+# The job the current thread is running
+_local = threading.local()
+
+
+def get_jobs_setting(name):
+    """Return a JOBS setting, falling back to the default value"""
+    return getattr(settings, 'JOBS', {}).get(name, DEFAULTS[name])
+
+
+class Requeue(Exception):
+    """
+    Raised by a task that stopped part way to keep within the lease: the job
+    is queued again to run after ``delay`` seconds, without using up an attempt.
+    """
+
+    def __init__(self, delay=0):
+        super().__init__(f'Requeued to run again in {delay}s')
+        self.delay = delay
+
+
+def current_job():
+    """Return the job the current thread is running, or None"""
+    return getattr(_local, 'job', None)
+
+
+def report_progress(progress):
+    """Save the progress (JSON serializable) of the running job; does nothing outside a job"""
+    job = current_job()
+    if job is None:
+        return
+    job.progress = progress
+    Job.objects.filter(pk=job.pk).update(progress=progress)
+
+
+def task_path(task):
+    """Return the dotted path of a task given as a function or a path"""
+    if isinstance(task, str):
+        return task
+    return f'{task.__module__}.{task.__qualname__}'
+
+
+def enqueue(task, args=(), kwargs=None, *, queue='default', priority=0, run_at=None, delay=None,
+            max_attempts=None, key=None):
+    """
+    Add a job and return it.
+
+    ``task`` is a function or its dotted path; ``args`` and ``kwargs`` must be
+    JSON serializable. The job runs at ``run_at``, after ``delay`` seconds, or
+    as soon as a worker is free. With a ``key``, nothing is added if a job with
+    that key already exists, and the existing job is returned instead, unless
+    it failed for good: a failed job is replaced, so the work can be retried.
+    """
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    fields = {
+        'task': task_path(task),
+        'args': list(args),
+        'kwargs': kwargs or {},
+        'queue': queue,
+        'priority': priority,
+        'run_at': run_at,
+        'max_attempts': max_attempts or get_jobs_setting('MAX_ATTEMPTS'),
+    }
+    if key is None:
+        return Job.objects.create(**fields)
+    with transaction.atomic():
+        Job.objects.filter(key=key, status=Job.FAILED).delete()
+        return Job.objects.get_or_create(key=key, defaults=fields)[0]
+
+
+def claim(queues, worker, now=None):
+    """Lock the next ready job of ``queues`` for ``worker``; return it, or None"""
+    now = now or timezone.now()
+    ready = Job.objects.filter(status=Job.QUEUED, queue__in=queues, run_at__lte=now).order_by('priority', 'run_at', 'pk')
+    if connections[router.db_for_write(Job)].features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = ready.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.RUNNING, attempts=F('attempts') + 1, locked_by=worker, locked_at=now
+            )
+    else:
+        # SQLite: no row locks, and a read-then-write transaction fails when
+        # another worker writes first. The conditional UPDATE decides who wins.
+        while True:
+            job = ready.first()
+            if job is None:
+                return None
+            claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, attempts=F('attempts') + 1, locked_by=worker, locked_at=now
+            )
+            if claimed:
+                break
+    job.status = Job.RUNNING
+    job.attempts += 1
+    job.locked_by = worker
+    job.locked_at = now
+    return job
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt: exponential backoff with 10% jitter"""
+    delay = min(get_jobs_setting('BACKOFF') * 2 ** (attempts - 1), get_jobs_setting('MAX_BACKOFF'))
+    return delay * random.uniform(0.9, 1.1)
+
+
+def _json_result(result):
+    try:
+        json.dumps(result, cls=DjangoJSONEncoder)
+    except (TypeError, ValueError):
+        return repr(result)
+    return result
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome; return False if it failed"""
+    _local.job = job
+    try:
+        result = import_string(job.task)(*job.args, **job.kwargs)
+    except Requeue as requeue:
+        updates = {
+            'status': Job.QUEUED, 'run_at': timezone.now() + timedelta(seconds=requeue.delay),
+            'attempts': job.attempts - 1, 'locked_by': '', 'locked_at': None,
+        }
+        succeeded = True
+    except Exception as exc:
+        now = timezone.now()
+        error = f'{type(exc).__name__}: {exc}'
+        if job.attempts < job.max_attempts:
+            logger.warning('Job %s failed (attempt %s of %s), retrying: %s', job, job.attempts, job.max_attempts, error)
+            updates = {'status': Job.QUEUED, 'run_at': now + timedelta(seconds=retry_delay(job.attempts))}
+        else:
+            logger.exception('Job %s failed for good after %s attempts', job, job.attempts)
+            updates = {'status': Job.FAILED, 'finished_at': now}
+        updates.update(last_error=error, locked_by='', locked_at=None)
+        succeeded = False
+    else:
+        updates = {
+            'status': Job.SUCCEEDED, 'result': _json_result(result), 'finished_at': timezone.now(),
+            'locked_by': '', 'locked_at': None,
+        }
+        succeeded = True
+    finally:
+        _local.job = None
+    # Unless the lease expired and the job was handed to another worker meanwhile
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by).update(**updates)
+    for name, value in updates.items():
+        setattr(job, name, value)
+    return succeeded
+
+
+def recover_stale(now=None):
+    """Queue again (or fail) jobs whose worker has held them longer than the lease"""
+    now = now or timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=get_jobs_setting('LEASE')))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished_at=now, last_error='Lease expired', locked_by='', locked_at=None
+    )
+    requeued = stale.update(status=Job.QUEUED, run_at=now, last_error='Lease expired', locked_by='', locked_at=None)
+    return requeued + failed
+
+
+def schedule_periodic(now=None):
+    """
+    Enqueue the current run of every ``JOBS['PERIODIC']`` job.
+
+    A job that runs every N seconds gets one run per N-second slot, keyed by
+    the slot, so concurrent workers enqueue it only once. Return the next time
+    a slot starts.
+    """
+    now = now or timezone.now()
+    timestamp = now.timestamp()
+    next_slot = None
+    for name, options in get_jobs_setting('PERIODIC').items():
+        every = options['every']
+        slot = int(timestamp // every)
+        enqueue(
+            options['task'], options.get('args', ()), options.get('kwargs'),
+            queue=options.get('queue', 'default'),
+            priority=options.get('priority', 0),
+            run_at=datetime.fromtimestamp(slot * every, dt_timezone.utc),
+            key=f'periodic:{name}:{slot}',
+        )
+        starts = datetime.fromtimestamp((slot + 1) * every, dt_timezone.utc)
+        next_slot = starts if next_slot is None else min(next_slot, starts)
+    return next_slot
+
+
+def purge_finished(days=None):
+    """Delete succeeded jobs older than ``JOBS['KEEP_DAYS']``; failed ones are kept"""
+    days = get_jobs_setting('KEEP_DAYS') if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    return Job.objects.filter(status=Job.SUCCEEDED, finished_at__lt=cutoff).delete()[0]
+
+
+class Worker:
+    """Claim and run jobs from ``queues`` until stopped"""
+
+    def __init__(self, queues=None, name=None, poll_interval=None):
+        self.queues = list(queues or get_jobs_setting('QUEUES'))
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.poll_interval = get_jobs_setting('POLL_INTERVAL') if poll_interval is None else poll_interval
+        self.stopping = False
+        self.processed = 0
+        self.failed = 0
+        self._next_periodic = None
+        self._next_recovery = None
+
+    def stop(self, *args):
+        """Finish the current job, then exit (usable as a signal handler)"""
+        self.stopping = True
+
+    def housekeeping(self):
+        now = timezone.now()
+        if self._next_periodic is None or now >= self._next_periodic:
+            self._next_periodic = schedule_periodic(now)
+        if self._next_recovery is None or now >= self._next_recovery:
+            recovered = recover_stale(now)
+            if recovered:
+                logger.warning('Recovered %s job(s) with an expired lease', recovered)
+            self._next_recovery = now + timedelta(seconds=get_jobs_setting('LEASE') / 2)
+
+    def run_once(self):
+        """Run one ready job; return False if there was none"""
+        close_old_connections()
+        self.housekeeping()
+        job = claim(self.queues, self.name)
+        if job is None:
+            return False
+        if not run_job(job):
+            self.failed += 1
+        self.processed += 1
+        close_old_connections()
+        return True
+
+    def run(self, burst=False, max_jobs=None):
+        """Work until stopped, or until no job is ready (``burst``) or ``max_jobs`` ran"""
+        while not self.stopping:
+            if max_jobs is not None and self.processed >= max_jobs:
+                break
+            if not self.run_once():
+                if burst:
+                    break
+                time.sleep(self.poll_interval)
+        return self.processed
@@ -0,0 +1,15 @@
+from rest_framework import serializers
+from medhashaala.metrics import TimedSerializerMixin
+from .models import Job
+
+
+class JobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Status of a background job"""
+    
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'task', 'status', 'progress', 'result', 'last_error',
+            'attempts', 'max_attempts', 'run_at', 'created_at', 'finished_at'
+        ]
+        read_only_fields = fields
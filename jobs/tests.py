@@ -0,0 +1,237 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from subscriptions.models import SubscriptionPlan, UserSubscription
+from .models import Job
+from .queue import Worker, claim, enqueue, recover_stale, run_job, schedule_periodic
+
+User = get_user_model()
+
+CALLS = []
+ITEMS = []
+
+
+def record_call(*args, **kwargs):
+    """Job used by the tests"""
+    CALLS.append((args, kwargs))
+    return {'args': list(args)}
+
+
+def failing_job():
+    """Job that always fails"""
+    raise RuntimeError('boom')
+
+
+def chunked_job():
+    """Job removing the entries of ITEMS a chunk at a time, through run_in_chunks"""
+    from .chunks import run_in_chunks
+
+    def take(size):
+        taken = ITEMS[:size]
+        del ITEMS[:size]
+        return len(taken)
+
+    return run_in_chunks([('items', take)])
+
+
+@override_settings(JOBS={})
+class JobQueueTest(TestCase):
+    """Test cases for the database-backed job queue"""
+
+    def setUp(self):
+        """Set up test data"""
+        CALLS.clear()
+
+    def test_enqueue_and_run(self):
+        """Test that a claimed job runs once and stores its result"""
+        job = enqueue(record_call, [1, 2], {'flag': True})
+        self.assertEqual(job.task, 'jobs.tests.record_call')
+
+        claimed = claim(['default'], 'worker-1')
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertIsNone(claim(['default'], 'worker-2'))
+
+        self.assertTrue(run_job(claimed))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, {'args': [1, 2]})
+        self.assertEqual(CALLS, [((1, 2), {'flag': True})])
+
+    def test_claim_order(self):
+        """Test that jobs run by priority, then run_at, and not before run_at"""
+        later = enqueue(record_call, ['later'], delay=60)
+        low = enqueue(record_call, ['low'], priority=5)
+        high = enqueue(record_call, ['high'], priority=-5)
+        other = enqueue(record_call, ['other'], queue='emails')
+
+        self.assertEqual(claim(['default'], 'w').pk, high.pk)
+        self.assertEqual(claim(['default'], 'w').pk, low.pk)
+        self.assertIsNone(claim(['default'], 'w'))
+        self.assertEqual(claim(['default'], 'w', now=timezone.now() + timedelta(seconds=61)).pk, later.pk)
+        self.assertEqual(claim(['emails'], 'w').pk, other.pk)
+
+    @override_settings(JOBS={'BACKOFF': 10, 'MAX_BACKOFF': 100})
+    def test_retry_with_backoff(self):
+        """Test that failures are retried with growing delays, then marked failed"""
+        job = enqueue(failing_job, max_attempts=3)
+        delays = []
+        for attempt in range(3):
+            claimed = claim(['default'], 'w', now=job.run_at)
+            started = timezone.now()
+            with self.assertLogs('jobs.queue', 'WARNING'):
+                self.assertFalse(run_job(claimed))
+            job.refresh_from_db()
+            delays.append((job.run_at - started).total_seconds())
+
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 3)
+        self.assertEqual(job.last_error, 'RuntimeError: boom')
+        self.assertTrue(9 <= delays[0] <= 11 and 18 <= delays[1] <= 22, delays)
+
+    def test_key_deduplicates(self):
+        """Test that a key is only enqueued once"""
+        first = enqueue(record_call, key='once')
+        second = enqueue(record_call, ['ignored'], key='once')
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_key_replaces_failed_job(self):
+        """Test that a key whose job failed for good can be enqueued again"""
+        failed = enqueue(record_call, key='retry')
+        Job.objects.filter(pk=failed.pk).update(status=Job.FAILED, attempts=3)
+        job = enqueue(record_call, ['again'], key='retry')
+        self.assertNotEqual(job.pk, failed.pk)
+        self.assertEqual((job.status, job.attempts, job.args), (Job.QUEUED, 0, ['again']))
+        self.assertEqual(Job.objects.count(), 1)
+
+    @override_settings(JOBS={'PERIODIC': {'tick': {'task': 'jobs.tests.record_call', 'every': 60}}})
+    def test_periodic_once_per_slot(self):
+        """Test that several workers enqueue a periodic job once per period"""
+        now = timezone.now()
+        next_slot = schedule_periodic(now)
+        schedule_periodic(now)
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertLessEqual(Job.objects.get().run_at, now)
+        self.assertTrue(now < next_slot <= now + timedelta(seconds=60))
+        schedule_periodic(next_slot)
+        self.assertEqual(Job.objects.count(), 2)
+
+    @override_settings(JOBS={'LEASE': 60})
+    def test_recover_stale(self):
+        """Test that jobs of dead workers are queued again after the lease"""
+        started = timezone.now() - timedelta(seconds=120)
+        job = enqueue(record_call, run_at=started)
+        stale = claim(['default'], 'dead-worker', now=started)
+        self.assertEqual(recover_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.locked_by, '')
+        # The dead worker finishing late does not overwrite the new state
+        run_job(stale)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+    def test_workers_share_queue(self):
+        """Test that interleaved workers run every job exactly once"""
+        for index in range(10):
+            enqueue(record_call, [index])
+        workers = [Worker(name='a', poll_interval=0), Worker(name='b', poll_interval=0)]
+        while any([worker.run_once() for worker in workers]):
+            pass
+        self.assertEqual(sorted(args[0] for args, kwargs in CALLS), list(range(10)))
+        self.assertEqual(sum(worker.processed for worker in workers), 10)
+        self.assertEqual(Job.objects.filter(status=Job.SUCCEEDED).count(), 10)
+
+    @override_settings(JOBS={'CHUNK_SIZE': 2, 'MAX_CHUNKS': 2, 'CHUNK_PAUSE': 0})
+    def test_chunked_job_requeues_with_progress(self):
+        """Test that a chunked job stops after MAX_CHUNKS chunks, keeps its progress and finishes in later runs"""
+        ITEMS[:] = range(7)
+        job = enqueue(chunked_job)
+
+        self.assertTrue(run_job(claim(['default'], 'w')))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.attempts, 0)
+        self.assertEqual(job.progress, {'step': 'items', 'done': {'items': 4}})
+        self.assertEqual(len(ITEMS), 3)
+
+        self.assertTrue(run_job(claim(['default'], 'w')))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, {'step': 'finished', 'done': {'items': 7}})
+        self.assertEqual(job.progress, job.result)
+
+    def test_run_jobs_command(self):
+        """Test the worker command in burst mode"""
+        enqueue(record_call, ['x'])
+        out = StringIO()
+        call_command('run_jobs', '--burst', stdout=out)
+        self.assertIn('1 job(s) run, 0 failed', out.getvalue())
+        self.assertEqual(CALLS, [(('x',), {})])
+
+
+@override_settings(JOBS={})
+class SubscriptionJobsTest(TestCase):
+    """Test cases for the subscription lifecycle jobs"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.plan = SubscriptionPlan.objects.create(
+            name='Basic', features=['basic_access'], price=Decimal('9.99'), is_active=True
+        )
+        self.now = timezone.now()
+        self.users = [
+            User.objects.create_user(email=f'user{index}@example.com', name=f'User {index}', password='testpass123')
+            for index in range(3)
+        ]
+
+    def test_expire_subscriptions(self):
+        """Test that lapsed subscriptions are expired"""
+        from subscriptions.jobs import expire_subscriptions
+
+        lapsed = UserSubscription.objects.create(user=self.users[0], plan=self.plan, end_date=self.now - timedelta(days=1))
+        current = UserSubscription.objects.create(user=self.users[1], plan=self.plan, end_date=self.now + timedelta(days=1))
+        self.assertEqual(expire_subscriptions(), 1)
+        lapsed.refresh_from_db()
+        current.refresh_from_db()
+        self.assertEqual(lapsed.status, 'expired')
+        self.assertEqual(current.status, 'active')
+
+    def test_renewal_reminders(self):
+        """Test that expiring subscriptions get one reminder per term"""
+        from subscriptions.jobs import send_renewal_reminders
+
+        UserSubscription.objects.create(user=self.users[0], plan=self.plan, end_date=self.now + timedelta(days=3))
+        UserSubscription.objects.create(user=self.users[1], plan=self.plan, end_date=self.now + timedelta(days=30))
+        UserSubscription.objects.create(user=self.users[2], plan=self.plan)
+
+        self.assertEqual(send_renewal_reminders(days=7), 1)
+        self.assertEqual(send_renewal_reminders(days=7), 1)
+        Worker(poll_interval=0).run(burst=True)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['user0@example.com'])
+
+
+@override_settings(JOBS={})
+class JobStatusTest(TestCase):
+    """Test cases for the job status endpoint"""
+
+    def test_job_status_endpoint(self):
+        """Test that admins can follow a job, and other users cannot"""
+        from django.test import Client
+
+        job = enqueue(record_call)
+        client = Client()
+        client.force_login(User.objects.create_user(email='admin@example.com', name='Admin', password='x', is_staff=True))
+        response = client.get(f'/api/admin/jobs/{job.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['task'], response.json()['status']), ('jobs.tests.record_call', 'queued'))
+        client.force_login(User.objects.create_user(email='user@example.com', name='User', password='x'))
+        self.assertEqual(client.get(f'/api/admin/jobs/{job.pk}/').status_code, 403)
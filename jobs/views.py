@@ -0,0 +1,35 @@
+from django.urls import reverse
+from rest_framework import status, viewsets
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from .models import Job
+from .serializers import JobSerializer
+
+
+def accepted(request, job):
+    """202 response for work handed to a background job, pointing at its status"""
+    url = request.build_absolute_uri(reverse('job-detail', args=[job.pk]))
+    return Response(
+        {'job': job.pk, 'status': job.status, 'status_url': url},
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Location': url},
+    )
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Background jobs and their progress (admin only).
+    
+    - GET /api/admin/jobs/?status=&task= - List jobs, newest first
+    - GET /api/admin/jobs/{id}/ - Status, progress and result of a job
+    """
+    
+    serializer_class = JobSerializer
+    permission_classes = [IsAdminUser]
+    
+    def get_queryset(self):
+        queryset = Job.objects.all()
+        for name in ('status', 'task'):
+            if self.request.query_params.get(name):
+                queryset = queryset.filter(**{name: self.request.query_params[name]})
+        return queryset
@@ -0,0 +1,13 @@
+"""
+Admin URLconf, included lazily from ``medhashaala.urls``.
+
+With ``LEAN_STARTUP`` the admin app does not autodiscover ``admin.py``
+modules when the app registry is ready, so that happens here, the first
+time an admin URL is resolved or reversed.
+"""
+
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns = admin.site.get_urls()
@@ -0,0 +1,288 @@
+"""
+API benchmark that replays the request flows of ``api.http``.
+
+The same flows run either in-process through Django's test client (against
+a throw-away test database) or over HTTP against a running server. Every
+endpoint is driven by ``concurrency`` threads for ``requests`` requests and
+reported as throughput plus p50/p95/p99 latency.
+"""
+
+import http.client
+import json
+import math
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+BENCHMARK_PASSWORD = 'benchmark-password-123'
+
+
+def percentile(sorted_values, pct):
+    """Return the pct-th percentile of an already sorted list (nearest rank)"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class InProcessTransport:
+    """Send requests through Django's test client, without a network hop"""
+
+    def __init__(self):
+        from django.test import Client
+
+        # Server errors come back as 500 responses, counted as errors of
+        # their phase, instead of aborting the run
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method, path, body=None, token=None):
+        extra = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        response = self.client.generic(
+            method, path,
+            data=json.dumps(body) if body is not None else '',
+            content_type='application/json',
+            **extra
+        )
+        try:
+            data = json.loads(response.content) if response.content else None
+        except ValueError:
+            data = None
+        return response.status_code, data
+
+
+class HttpTransport:
+    """Send requests to a running server over a keep-alive HTTP connection"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=30)
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnect on the next request
+            self.connection.close()
+            raise
+        try:
+            data = json.loads(content) if content else None
+        except ValueError:
+            data = None
+        return response.status, data
+
+
+class BenchmarkRunner:
+    """
+    Run the api.http flows and collect latencies per endpoint.
+
+    ``transport_factory`` is called once per worker thread. The admin
+    credentials are used to subscribe the benchmark users to a plan.
+    """
+
+    def __init__(self, transport_factory, admin_email, admin_password, concurrency=4, requests=50):
+        self.transport_factory = transport_factory
+        self.admin_email = admin_email
+        self.admin_password = admin_password
+        self.concurrency = concurrency
+        self.requests = requests
+        self.run_id = uuid.uuid4().hex[:8]
+        self._local = threading.local()
+        self.users = []
+        self.tokens = []
+        self.results = {}
+
+    def transport(self):
+        transport = getattr(self._local, 'transport', None)
+        if transport is None:
+            transport = self._local.transport = self.transport_factory()
+        return transport
+
+    def phase(self, name, call, expected=(200,), count=None):
+        """Run ``call(index)`` ``count`` times across the worker threads"""
+        count = count or self.requests
+        latencies = []
+        errors = 0
+        outputs = [None] * count
+        lock = threading.Lock()
+
+        def task(index):
+            nonlocal errors
+            method, path, body, token = call(index)
+            started = time.perf_counter()
+            try:
+                status, data = self.transport().request(method, path, body, token)
+            except (OSError, http.client.HTTPException):
+                status, data = None, None
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status not in expected:
+                    errors += 1
+            outputs[index] = data
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(task, range(count)))
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        self.results[name] = {
+            'count': count,
+            'errors': errors,
+            'throughput_rps': round(count / wall, 2) if wall else None,
+            'mean_ms': round(sum(latencies) / count * 1000, 3),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        }
+        return outputs
+
+    def run(self):
+        """Run every flow in api.http order and return the per-endpoint results"""
+        status, data = self.transport().request(
+            'POST', '/api/auth/jwt/create/', {'email': self.admin_email, 'password': self.admin_password}
+        )
+        if status != 200:
+            raise RuntimeError(f'Admin login failed with status {status}')
+        admin_token = data['access']
+
+        status, data = self.transport().request('GET', '/api/plans/', token=admin_token)
+        plans = (data or {}).get('results') or []
+        if status != 200 or not plans:
+            raise RuntimeError('The benchmark needs at least one subscription plan')
+        plan_id = plans[0]['id']
+
+        def register(index):
+            email = f'bench-{self.run_id}-{index}@example.com'
+            return 'POST', '/api/auth/users/', {
+                'name': f'Benchmark User {index}',
+                'email': email,
+                'password': BENCHMARK_PASSWORD,
+                're_password': BENCHMARK_PASSWORD,
+                'role': 'user',
+            }, None
+
+        created = self.phase('register', register, expected=(201,))
+        self.users = [user for user in created if user and 'id' in user]
+        if not self.users:
+            raise RuntimeError('No benchmark user could be registered')
+
+        def login(index):
+            user = self.users[index % len(self.users)]
+            return 'POST', '/api/auth/jwt/create/', {'email': user['email'], 'password': BENCHMARK_PASSWORD}, None
+
+        tokens = self.phase('jwt-create', login)
+        self.tokens = [data for data in tokens if data and 'access' in data]
+        if not self.tokens:
+            raise RuntimeError('No benchmark user could log in')
+
+        def subscribe(index):
+            user = self.users[index]
+            return 'POST', '/api/admin/subscriptions/', {'user': user['id'], 'plan_id': plan_id}, admin_token
+
+        self.phase('admin-subscription-create', subscribe, expected=(201,), count=len(self.users))
+
+        def authenticated_get(path):
+            def call(index):
+                return 'GET', path, None, self.tokens[index % len(self.tokens)]['access']
+            return call
+
+        self.phase('user-me', authenticated_get('/api/auth/users/me/'))
+        self.phase('plan-list', authenticated_get('/api/plans/'))
+        self.phase('user-subscription-my-subscription', authenticated_get('/api/user-subscriptions/my_subscription/'))
+        self.phase(
+            'admin-subscription-list',
+            lambda index: ('GET', '/api/admin/subscriptions/', None, admin_token)
+        )
+        self.phase(
+            'jwt-refresh',
+            lambda index: ('POST', '/api/auth/jwt/refresh/',
+                           {'refresh': self.tokens[index % len(self.tokens)]['refresh']}, None)
+        )
+        self.phase(
+            'jwt-verify',
+            lambda index: ('POST', '/api/auth/jwt/verify/',
+                           {'token': self.tokens[index % len(self.tokens)]['access']}, None)
+        )
+        return self.results
+
+
+@contextmanager
+def temporary_database():
+    """Run the enclosed block against a throw-away test database"""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def current_commit():
+    """Return the short hash of the checked out commit, if any"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def build_report(results, mode, concurrency, requests):
+    """Wrap endpoint results with the metadata needed to compare runs"""
+    import django
+
+    return {
+        'meta': {
+            'commit': current_commit(),
+            'mode': mode,
+            'concurrency': concurrency,
+            'requests': requests,
+            'django': django.get_version(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        },
+        'endpoints': results,
+    }
+
+
+def find_regressions(report, baseline, threshold):
+    """
+    Compare a report with a baseline report.
+
+    An endpoint regresses when its p95 latency grows, or its throughput
+    drops, by more than ``threshold`` (a fraction, e.g. 0.2 for 20%).
+    """
+    regressions = []
+    for name, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        if previous.get('p95_ms') and current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(
+                f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms"
+            )
+        if previous.get('throughput_rps') and current['throughput_rps'] < previous['throughput_rps'] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s"
+            )
+    return regressions
@@ -0,0 +1,184 @@
+"""
+Single-flight loading of per-worker caches.
+
+When a hot entry (the plan catalog, a popular user's entitlements) is
+missing, every request that needs it would query the database at the same
+time. ``single_flight(key, loader)`` runs one loader per key at a time in
+the process; callers that arrive while it runs wait for it and share its
+result, or its exception.
+
+With ``shared=True`` the workers also coordinate through the
+``SINGLE_FLIGHT['CACHE']`` cache (Redis in production, see ``CACHES``): the
+first one takes a lock for up to ``LOCK_TIMEOUT`` seconds, loads, and
+leaves the result there for ``RESULT_TTL`` seconds; the others wait up to
+``LOCK_WAIT`` seconds for it and load themselves only if it does not come.
+A shared result can be up to ``RESULT_TTL`` seconds older than the read
+that produced it. When the shared cache fails, workers just load.
+
+``forget(key)`` is called when an entry is invalidated: callers arriving
+afterwards start a new load instead of joining one that may have read the
+old rows, and its result is not shared.
+"""
+
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'LOCK_TIMEOUT': 5,
+    'LOCK_WAIT': 2,
+    'RESULT_TTL': 2,
+    'POLL_INTERVAL': 0.02,
+}
+
+# Marks a missing shared result (None is a valid one)
+_MISSING = object()
+
+_lock = threading.Lock()
+# key -> _Call of the load in flight
+_calls = {}
+_stats = {'loads': 0, 'coalesced': 0, 'shared': 0}
+
+
+def get_single_flight_setting(name):
+    """Return a SINGLE_FLIGHT setting, falling back to the default value"""
+    return getattr(settings, 'SINGLE_FLIGHT', {}).get(name, DEFAULTS[name])
+
+
+class _Call:
+    """A load in flight and the callers waiting for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.forgotten = False
+
+
+def single_flight(key, loader, shared=False):
+    """
+    Return ``loader()``, sharing one call per ``key`` between the threads
+    (and with ``shared``, the workers) that ask for it at the same time.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+        else:
+            _stats['coalesced'] += 1
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+    try:
+        call.result = _load_shared(key, loader, call) if shared else _run(loader)
+    except BaseException as exc:
+        call.error = exc
+        raise
+    finally:
+        with _lock:
+            if _calls.get(key) is call:
+                del _calls[key]
+        call.done.set()
+    return call.result
+
+
+def _run(loader):
+    with _lock:
+        _stats['loads'] += 1
+    return loader()
+
+
+def _load_shared(key, loader, call):
+    cache = caches[get_single_flight_setting('CACHE')]
+    result_key = f'sf:{key}:result'
+    lock_key = f'sf:{key}:lock'
+    token = uuid.uuid4().hex
+    try:
+        result = cache.get(result_key, _MISSING)
+        locked = result is _MISSING and cache.add(lock_key, token, get_single_flight_setting('LOCK_TIMEOUT'))
+    except Exception:
+        logger.warning('Single-flight cache unavailable; loading %s without the lock', key, exc_info=True)
+        return _run(loader)
+    if result is not _MISSING:
+        return _shared_result(result)
+    if not locked:
+        result = _wait_for_result(cache, result_key, lock_key)
+        if result is not _MISSING:
+            return _shared_result(result)
+        return _run(loader)
+    try:
+        result = _run(loader)
+        if not call.forgotten:
+            cache.set(result_key, result, get_single_flight_setting('RESULT_TTL'))
+        return result
+    finally:
+        try:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+        except Exception:
+            logger.warning('Could not release the single-flight lock of %s', key, exc_info=True)
+
+
+def _shared_result(result):
+    with _lock:
+        _stats['shared'] += 1
+    return result
+
+
+def _wait_for_result(cache, result_key, lock_key):
+    """Wait for the worker holding the lock; return its result, or _MISSING if it did not share one"""
+    deadline = time.monotonic() + get_single_flight_setting('LOCK_WAIT')
+    interval = get_single_flight_setting('POLL_INTERVAL')
+    try:
+        while time.monotonic() < deadline:
+            time.sleep(interval)
+            result = cache.get(result_key, _MISSING)
+            if result is not _MISSING:
+                return result
+            if cache.get(lock_key) is None:
+                # Released without a result: the load failed or was forgotten
+                return _MISSING
+    except Exception:
+        logger.warning('Single-flight cache unavailable while waiting', exc_info=True)
+    return _MISSING
+
+
+def forget(key=None, prefix=''):
+    """
+    Detach the load in flight for ``key`` (every key starting with
+    ``prefix`` if None) and drop its shared result: later callers load again.
+    """
+    with _lock:
+        keys = [name for name in _calls if name.startswith(prefix)] if key is None else [key]
+        for name in keys:
+            call = _calls.pop(name, None)
+            if call is not None:
+                call.forgotten = True
+    if key is not None:
+        try:
+            caches[get_single_flight_setting('CACHE')].delete(f'sf:{key}:result')
+        except Exception:
+            logger.warning('Could not drop the shared result of %s', key, exc_info=True)
+
+
+def single_flight_stats():
+    """Return how many loads ran, how many callers joined one and how many took a shared result"""
+    with _lock:
+        return dict(_stats)
+
+
+def reset():
+    """Forget the loads in flight and statistics of this process"""
+    with _lock:
+        _calls.clear()
+        _stats.update(loads=0, coalesced=0, shared=0)
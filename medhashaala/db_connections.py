@@ -0,0 +1,112 @@
+"""
+Database connection management.
+
+Connections to Neon are expensive to open (TLS plus channel binding to a
+remote pooler, and a possible serverless wake-up), so each worker keeps
+them around: in a bounded psycopg pool when ``psycopg_pool`` is installed,
+or as persistent connections (``CONN_MAX_AGE``) otherwise.
+
+``warm_up_connections`` opens them at worker boot with retry and
+exponential backoff, and ``connection_stats`` reports what each worker
+is holding.
+"""
+
+import logging
+import random
+import time
+
+from django.db import DatabaseError, connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+# alias -> counters for this worker process
+_stats = {}
+
+
+def _alias_stats(alias):
+    return _stats.setdefault(alias, {
+        'connections_opened': 0,
+        'warmup_attempts': 0,
+        'warmup_failures': 0,
+        'warmup_seconds': None,
+    })
+
+
+def _count_connection(sender, connection, **kwargs):
+    _alias_stats(connection.alias)['connections_opened'] += 1
+
+
+connection_created.connect(_count_connection, dispatch_uid='medhashaala.db_connections')
+
+
+def get_pool(alias):
+    """Return the psycopg connection pool of an alias, or None if it is not pooled"""
+    return getattr(connections[alias], 'pool', None)
+
+
+def warm_up_connections(aliases=None, attempts=5, backoff=0.5, max_backoff=8.0, timeout=30.0):
+    """
+    Open database connections before the worker serves its first request.
+
+    Each alias is retried up to ``attempts`` times with exponential backoff
+    and jitter, which covers a serverless database that is still waking up.
+    Returns a dict mapping each alias to True if it was warmed up.
+    """
+    aliases = list(aliases or connections)
+    results = {}
+    for alias in aliases:
+        stats = _alias_stats(alias)
+        started = time.monotonic()
+        results[alias] = False
+        for attempt in range(1, attempts + 1):
+            stats['warmup_attempts'] += 1
+            try:
+                pool = get_pool(alias)
+                if pool is not None:
+                    # Blocks until the pool holds min_size connections
+                    pool.open(wait=True, timeout=timeout)
+                with connections[alias].cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                results[alias] = True
+                break
+            except DatabaseError as exc:
+                stats['warmup_failures'] += 1
+                if attempt == attempts:
+                    logger.error('Could not warm up database %r: %s', alias, exc)
+                    break
+                delay = min(max_backoff, backoff * 2 ** (attempt - 1))
+                delay += random.uniform(0, delay / 2)
+                logger.warning(
+                    'Database %r not ready (attempt %d/%d), retrying in %.1fs: %s',
+                    alias, attempt, attempts, delay, exc
+                )
+                connections[alias].close()
+                time.sleep(delay)
+        stats['warmup_seconds'] = round(time.monotonic() - started, 4)
+    return results
+
+
+def connection_stats():
+    """Return per-alias connection and pool statistics for this worker"""
+    stats = {}
+    for alias in connections:
+        connection = connections[alias]
+        entry = {
+            'vendor': connection.vendor,
+            'persistent': connection.settings_dict.get('CONN_MAX_AGE') != 0,
+            'health_checks': connection.settings_dict.get('CONN_HEALTH_CHECKS', False),
+            'pooled': False,
+            **_alias_stats(alias),
+        }
+        pool = get_pool(alias)
+        if pool is not None:
+            entry['pooled'] = True
+            entry['pool'] = {
+                'min_size': pool.min_size,
+                'max_size': pool.max_size,
+                'timeout': pool.timeout,
+                **pool.get_stats(),
+            }
+        stats[alias] = entry
+    return stats
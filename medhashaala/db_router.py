@@ -0,0 +1,173 @@
+"""
+Database routing for read replicas.
+
+Safe-method requests handled by the views listed in
+``DATABASE_REPLICAS['VIEWS']`` read from one of the replica aliases in
+``DATABASE_REPLICAS['ALIASES']``. Everything else (writes, migrations,
+unlisted views, management commands) uses the ``default`` primary.
+
+After a write the client is pinned to the primary for ``PIN_SECONDS`` so
+it always reads its own writes. Replicas that fail a health check or lag
+more than ``MAX_LAG_SECONDS`` behind the primary are skipped until the
+next check, and so is a replica whose connection fails during a request
+(``ReplicaRoutingMiddleware`` then retries the request on the primary).
+"""
+
+import random
+import time
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULTS = {
+    'ALIASES': [],
+    'VIEWS': [],
+    'PIN_SECONDS': 5,
+    'PIN_COOKIE': 'db_primary_pin',
+    'MAX_LAG_SECONDS': 10,
+    'HEALTH_CHECK_INTERVAL': 30,
+}
+
+_state = Local()
+
+# alias -> (checked_at, healthy)
+_health = {}
+
+
+def get_replica_setting(name):
+    """Return a DATABASE_REPLICAS setting, falling back to the default value"""
+    return getattr(settings, 'DATABASE_REPLICAS', {}).get(name, DEFAULTS[name])
+
+
+def use_replicas(enabled=True):
+    """Allow (or forbid) replica reads for the current request"""
+    _state.replicas = enabled
+
+
+def pin_to_primary():
+    """Send every remaining read of the current request to the primary"""
+    _state.pinned = True
+
+
+def is_pinned():
+    """Return True if the current request must read from the primary"""
+    return getattr(_state, 'pinned', False)
+
+
+def has_written():
+    """Return True if the current request has written to the primary"""
+    return getattr(_state, 'wrote', False)
+
+
+def current_replica():
+    """Return the replica alias the current request reads from, or None"""
+    alias = getattr(_state, 'alias', None)
+    return alias if alias not in (None, DEFAULT_DB_ALIAS) else None
+
+
+def reset_state():
+    """Forget the routing state of the current request"""
+    _state.replicas = False
+    _state.pinned = False
+    _state.wrote = False
+    _state.alias = None
+
+
+def measure_replica_lag(alias):
+    """
+    Return the replication lag of a replica in seconds.
+
+    SQLite and other non-PostgreSQL aliases are treated as always in sync,
+    which keeps the router testable with two local SQLite databases.
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor != 'postgresql':
+            cursor.execute('SELECT 1')
+            return 0.0
+        cursor.execute(
+            "SELECT CASE WHEN pg_is_in_recovery() "
+            "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+            "ELSE 0 END"
+        )
+        return float(cursor.fetchone()[0])
+
+
+def replica_is_healthy(alias):
+    """Check (and cache) whether a replica is reachable and fresh enough"""
+    now = time.monotonic()
+    checked_at, healthy = _health.get(alias, (None, False))
+    if checked_at is not None and now - checked_at < get_replica_setting('HEALTH_CHECK_INTERVAL'):
+        return healthy
+
+    try:
+        healthy = measure_replica_lag(alias) <= get_replica_setting('MAX_LAG_SECONDS')
+    except Exception:
+        healthy = False
+    _health[alias] = (now, healthy)
+    return healthy
+
+
+def mark_replica_unhealthy(alias):
+    """Take a replica out of rotation until its next health check"""
+    _health[alias] = (time.monotonic(), False)
+
+
+def fail_over():
+    """
+    Take the replica of the current request out of rotation and send its
+    remaining reads to the primary; return the replica alias, or None if
+    the request did not read from a replica.
+    """
+    alias = current_replica()
+    if alias is not None:
+        mark_replica_unhealthy(alias)
+        _state.alias = DEFAULT_DB_ALIAS
+    return alias
+
+
+def clear_health_cache():
+    """Forget all cached health check results"""
+    _health.clear()
+
+
+def choose_replica():
+    """Return a healthy replica alias, or the primary alias if there is none"""
+    candidates = [
+        alias for alias in get_replica_setting('ALIASES')
+        if alias != DEFAULT_DB_ALIAS and replica_is_healthy(alias)
+    ]
+    if not candidates:
+        return DEFAULT_DB_ALIAS
+    return random.choice(candidates)
+
+
+class ReplicaRouter:
+    """
+    Route reads to replicas when the current request allows it.
+
+    The request-level decision is made by ``ReplicaRoutingMiddleware``;
+    outside of a request every query goes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not getattr(_state, 'replicas', False) or is_pinned():
+            return DEFAULT_DB_ALIAS
+        alias = getattr(_state, 'alias', None)
+        if alias is None:
+            # Stick to one replica for the whole request
+            alias = _state.alias = choose_replica()
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Reads that follow a write in the same request must see it
+        pin_to_primary()
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *get_replica_setting('ALIASES')}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
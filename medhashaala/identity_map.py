@@ -0,0 +1,167 @@
+"""
+Request-scoped identity map.
+
+A request tends to load the same rows several times: authentication loads
+the user, then ``current_subscription`` its active subscription, then
+``subscription.plan``, ``subscription.user`` and the serializers go back
+for them. While ``IdentityMapMiddleware`` has a map active, querysets of
+models whose manager uses ``IdentityMapQuerySet`` (also their base manager,
+so foreign keys go through it) answer ``get()`` by primary key from the map
+and remember what they load. Other lookups opt in with ``cached(model, key,
+loader)``, like ``CustomUser.current_subscription``.
+
+Within a request every lookup of a row returns the same instance, changes
+made to it included. Saving or deleting an instance, and bulk ``update()``,
+``delete()``, ``bulk_create()`` and ``bulk_update()``, drop all entries of
+the model. Outside requests (jobs, the shell, management commands) no map
+is active and nothing is cached.
+"""
+
+from asgiref.local import Local
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models.expressions import Combinable
+from django.db.models.query import ModelIterable
+from django.db.models.signals import post_delete, post_save
+
+_state = Local()
+
+# Marks a missing entry (None is a valid one)
+_MISSING = object()
+
+
+def activate():
+    """Start an empty identity map for the current request"""
+    _state.entries = {}
+
+
+def deactivate():
+    """Drop the identity map of the current request"""
+    _state.entries = None
+
+
+def is_active():
+    """Return True if the current request has an identity map"""
+    return getattr(_state, 'entries', None) is not None
+
+
+def _entries(model):
+    entries = getattr(_state, 'entries', None)
+    if entries is None:
+        return None
+    return entries.setdefault(model._meta.concrete_model._meta.label_lower, {})
+
+
+def remember(model, key, value):
+    """Keep ``value`` under ``key`` until a write to ``model`` or the end of the request"""
+    entries = _entries(model)
+    if entries is not None:
+        entries[key] = value
+    return value
+
+
+def cached(model, key, loader):
+    """Return the entry of ``model`` under ``key``, loading it with ``loader()`` on a miss"""
+    entries = _entries(model)
+    if entries is None:
+        return loader()
+    value = entries.get(key, _MISSING)
+    if value is _MISSING:
+        value = entries[key] = loader()
+    return value
+
+
+def forget(model=None):
+    """Drop the entries of ``model``, or every entry"""
+    entries = getattr(_state, 'entries', None)
+    if not entries:
+        return
+    if model is None:
+        entries.clear()
+    else:
+        entries.pop(model._meta.concrete_model._meta.label_lower, None)
+
+
+def _pk_key(model, db, value):
+    return ('pk', db, model._meta.pk.to_python(value))
+
+
+def remember_instance(instance):
+    """Put a loaded instance in the identity map, for later ``get()`` by primary key"""
+    if instance is not None and instance.pk is not None:
+        remember(type(instance), _pk_key(type(instance), instance._state.db, instance.pk), instance)
+    return instance
+
+
+def _written(sender, **kwargs):
+    forget(sender)
+
+
+post_save.connect(_written, dispatch_uid='identity_map.save')
+post_delete.connect(_written, dispatch_uid='identity_map.delete')
+
+
+class IdentityMapQuerySet(models.QuerySet):
+    """QuerySet whose primary-key ``get()`` goes through the request's identity map"""
+
+    def _pk_lookup(self, args, kwargs):
+        """Return the primary key ``get(*args, **kwargs)`` looks up, or _MISSING if it is not a plain pk lookup"""
+        query = self.query
+        if (
+            query.where or query.select_related or query.annotations or query.extra
+            or query.select_for_update or query.combinator or query.deferred_loading != (frozenset(), True)
+            or self._prefetch_related_lookups or self._fields is not None
+            or self._iterable_class is not ModelIterable
+        ):
+            return _MISSING
+        if args:
+            # Foreign key descriptors pass Q(id=value)
+            if kwargs or len(args) != 1 or not isinstance(args[0], models.Q):
+                return _MISSING
+            q = args[0]
+            if q.negated or len(q.children) != 1 or not isinstance(q.children[0], tuple):
+                return _MISSING
+            (name, value), = q.children
+        elif len(kwargs) == 1:
+            (name, value), = kwargs.items()
+        else:
+            return _MISSING
+        pk = self.model._meta.pk
+        if name.removesuffix('__exact') not in ('pk', pk.name, pk.attname):
+            return _MISSING
+        return value
+
+    def get(self, *args, **kwargs):
+        entries = _entries(self.model)
+        if entries is None:
+            return super().get(*args, **kwargs)
+        value = self._pk_lookup(args, kwargs)
+        if value is _MISSING or isinstance(value, (models.Model, Combinable)):
+            return super().get(*args, **kwargs)
+        try:
+            key = _pk_key(self.model, self.db, value)
+        except ValidationError:
+            return super().get(*args, **kwargs)
+        instance = entries.get(key)
+        if instance is None:
+            instance = entries[key] = super().get(*args, **kwargs)
+        return instance
+
+    def update(self, **kwargs):
+        forget(self.model)
+        return super().update(**kwargs)
+
+    def delete(self):
+        forget(self.model)
+        return super().delete()
+
+    def bulk_create(self, *args, **kwargs):
+        forget(self.model)
+        return super().bulk_create(*args, **kwargs)
+
+    def bulk_update(self, *args, **kwargs):
+        forget(self.model)
+        return super().bulk_update(*args, **kwargs)
+
+
+IdentityMapManager = models.Manager.from_queryset(IdentityMapQuerySet)
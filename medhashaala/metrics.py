@@ -0,0 +1,270 @@
+"""
+Per-endpoint request metrics in Prometheus text format.
+
+``MetricsMiddleware`` records, for every resolved route, the request
+latency histogram, SQL query count and time, serialization time (spent in
+serializers using ``TimedSerializerMixin`` and in projections), response
+render time and response size. Each thread aggregates into its own shard,
+so recording never takes a lock; shards are only summed when metrics are
+exported.
+
+Under gunicorn every worker periodically writes its totals to
+``METRICS['MULTIPROCESS_DIR']`` and ``/metrics`` merges the files of all
+workers.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 10,
+    'TOKEN': None,
+}
+
+# Indexes into a route record
+COUNT, LATENCY, BUCKETS, QUERIES, SQL_TIME, SERIALIZE_TIME, RENDER_TIME, BYTES, STATUSES = range(9)
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+_last_flush = 0.0
+
+
+def get_metrics_setting(name):
+    """Return a METRICS setting, falling back to the default value"""
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        # Only taken once per thread
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def _new_record():
+    return [0, 0.0, [0] * len(LATENCY_BUCKETS), 0, 0.0, 0.0, 0.0, 0, {}]
+
+
+@contextmanager
+def serializing():
+    """Count the block as serialization time of the current request; nested blocks count once"""
+    if getattr(_local, 'serializing', False):
+        yield
+        return
+    _local.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.serializing = False
+        _local.serialize_time = getattr(_local, 'serialize_time', 0.0) + time.perf_counter() - started
+
+
+def take_serialize_time():
+    """Return the serialization time counted in this thread since the last call"""
+    elapsed = getattr(_local, 'serialize_time', 0.0)
+    _local.serialize_time = 0.0
+    return elapsed
+
+
+class TimedSerializerMixin:
+    """Serializer mixin counting ``to_representation`` as serialization time"""
+
+    def to_representation(self, instance):
+        with serializing():
+            return super().to_representation(instance)
+
+
+def record_request(route, method, status, latency, queries=0, sql_time=0.0, serialize_time=0.0, render_time=0.0,
+                   size=0):
+    """Add one request to the current thread's shard"""
+    shard = _shard()
+    key = (route, method)
+    record = shard.get(key)
+    if record is None:
+        record = shard[key] = _new_record()
+    record[COUNT] += 1
+    record[LATENCY] += latency
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if latency <= bound:
+            record[BUCKETS][index] += 1
+            break
+    record[QUERIES] += queries
+    record[SQL_TIME] += sql_time
+    record[SERIALIZE_TIME] += serialize_time
+    record[RENDER_TIME] += render_time
+    record[BYTES] += size
+    statuses = record[STATUSES]
+    statuses[status] = statuses.get(status, 0) + 1
+
+
+def _merge(target, key, record):
+    merged = target.get(key)
+    if merged is None:
+        merged = target[key] = _new_record()
+    for index in (COUNT, LATENCY, QUERIES, SQL_TIME, SERIALIZE_TIME, RENDER_TIME, BYTES):
+        merged[index] += record[index]
+    for index, value in enumerate(record[BUCKETS]):
+        merged[BUCKETS][index] += value
+    for status, value in record[STATUSES].items():
+        merged[STATUSES][str(status)] = merged[STATUSES].get(str(status), 0) + value
+
+
+def snapshot():
+    """Return the totals of this process, summed over all thread shards"""
+    totals = {}
+    for shard in list(_shards):
+        # Copy first: the owning thread may add keys while we iterate
+        for key, record in list(shard.items()):
+            _merge(totals, key, record)
+    return totals
+
+
+def reset():
+    """Forget every recorded request of this process"""
+    for shard in list(_shards):
+        shard.clear()
+
+
+def flush(force=False):
+    """Write this worker's totals to the multiprocess directory"""
+    global _last_flush
+    directory = get_metrics_setting('MULTIPROCESS_DIR')
+    if not directory:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < get_metrics_setting('FLUSH_INTERVAL'):
+        return
+    _last_flush = now
+
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    data = [[route, method, record] for (route, method), record in snapshot().items()]
+    pid = os.getpid()
+    tmp = path / f'.{pid}.tmp'
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path / f'{pid}.json')
+
+
+def collect():
+    """Return the totals of all workers (or of this process alone)"""
+    directory = get_metrics_setting('MULTIPROCESS_DIR')
+    if not directory:
+        return snapshot()
+
+    flush(force=True)
+    totals = {}
+    for file in Path(directory).glob('*.json'):
+        try:
+            data = json.loads(file.read_text())
+        except (OSError, ValueError):
+            continue
+        for route, method, record in data:
+            _merge(totals, (route, method), record)
+    return totals
+
+
+def _labels(**labels):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+
+
+def render_prometheus(totals=None):
+    """Render metrics in the Prometheus text exposition format"""
+    if totals is None:
+        totals = collect()
+    items = sorted(totals.items())
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    family('medhashaala_http_requests_total', 'counter', 'Requests by route, method and status.')
+    for (route, method), record in items:
+        for status, value in sorted(record[STATUSES].items()):
+            labels = _labels(route=route, method=method, status=status)
+            lines.append(f'medhashaala_http_requests_total{{{labels}}} {value}')
+
+    family('medhashaala_http_request_duration_seconds', 'histogram', 'Request latency by route.')
+    for (route, method), record in items:
+        cumulative = 0
+        for bound, value in zip(LATENCY_BUCKETS, record[BUCKETS]):
+            cumulative += value
+            labels = _labels(route=route, method=method, le=bound)
+            lines.append(f'medhashaala_http_request_duration_seconds_bucket{{{labels}}} {cumulative}')
+        labels = _labels(route=route, method=method, le='+Inf')
+        lines.append(f'medhashaala_http_request_duration_seconds_bucket{{{labels}}} {record[COUNT]}')
+        labels = _labels(route=route, method=method)
+        lines.append(f'medhashaala_http_request_duration_seconds_sum{{{labels}}} {record[LATENCY]:.6f}')
+        lines.append(f'medhashaala_http_request_duration_seconds_count{{{labels}}} {record[COUNT]}')
+
+    counters = [
+        ('medhashaala_db_queries_total', QUERIES, 'SQL queries executed by route.', '{}'),
+        ('medhashaala_db_query_seconds_total', SQL_TIME, 'Time spent in SQL by route.', '{:.6f}'),
+        ('medhashaala_serialize_seconds_total', SERIALIZE_TIME, 'Time spent serializing response data by route.',
+         '{:.6f}'),
+        ('medhashaala_render_seconds_total', RENDER_TIME, 'Time spent rendering responses by route.', '{:.6f}'),
+        ('medhashaala_response_bytes_total', BYTES, 'Response body bytes by route.', '{}'),
+    ]
+    for name, index, help_text, fmt in counters:
+        family(name, 'counter', help_text)
+        for (route, method), record in items:
+            labels = _labels(route=route, method=method)
+            lines.append(f'{name}{{{labels}}} {fmt.format(record[index])}')
+
+    from .db_connections import connection_stats
+
+    pid = os.getpid()
+    family('medhashaala_db_connections_opened_total', 'counter', 'Database connections opened by this worker.')
+    stats = sorted(connection_stats().items())
+    for alias, entry in stats:
+        labels = _labels(alias=alias, pid=pid)
+        lines.append(f'medhashaala_db_connections_opened_total{{{labels}}} {entry["connections_opened"]}')
+    for stat in ('pool_size', 'pool_available', 'requests_waiting'):
+        family(f'medhashaala_db_{stat}', 'gauge', f'Connection pool {stat.replace("_", " ")} of this worker.')
+        for alias, entry in stats:
+            if 'pool' in entry:
+                labels = _labels(alias=alias, pid=pid)
+                lines.append(f'medhashaala_db_{stat}{{{labels}}} {entry["pool"].get(stat, 0)}')
+
+    from invalidation.bus import invalidation_stats
+
+    bus = invalidation_stats()
+    labels = _labels(pid=pid, mode=bus['mode'])
+    family('medhashaala_invalidation_events_total', 'counter', 'Invalidation events received from other processes.')
+    lines.append(f'medhashaala_invalidation_events_total{{{labels}}} {bus["received"]}')
+    family('medhashaala_invalidation_lag_seconds', 'summary', 'Delay between publishing and evicting an invalidation.')
+    lines.append(f'medhashaala_invalidation_lag_seconds_sum{{{labels}}} {bus["lag_sum"]:.6f}')
+    lines.append(f'medhashaala_invalidation_lag_seconds_count{{{labels}}} {bus["received"]}')
+    family('medhashaala_invalidation_lag_max_seconds', 'gauge', 'Longest invalidation delay seen by this worker.')
+    lines.append(f'medhashaala_invalidation_lag_max_seconds{{{labels}}} {bus["lag_max"]:.6f}')
+
+    from .coalescing import single_flight_stats
+
+    flights = single_flight_stats()
+    labels = _labels(pid=pid)
+    family('medhashaala_cache_loads_total', 'counter', 'Cache loads run by this worker.')
+    lines.append(f'medhashaala_cache_loads_total{{{labels}}} {flights["loads"]}')
+    family('medhashaala_cache_loads_coalesced_total', 'counter', 'Cache misses that waited for a load already in flight.')
+    lines.append(f'medhashaala_cache_loads_coalesced_total{{{labels}}} {flights["coalesced"]}')
+    family('medhashaala_cache_loads_shared_total', 'counter', 'Cache loads answered with the result of another worker.')
+    lines.append(f'medhashaala_cache_loads_shared_total{{{labels}}} {flights["shared"]}')
+
+    return '\n'.join(lines) + '\n'
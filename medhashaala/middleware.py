@@ -0,0 +1,170 @@
+import logging
+import time
+from contextlib import ExitStack
+from functools import lru_cache
+
+from django.db import InterfaceError, OperationalError, connections
+from django.utils.module_loading import import_string
+
+from . import db_router, identity_map, metrics
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+@lru_cache(maxsize=None)
+def _replica_view_classes(paths):
+    return tuple(import_string(path) for path in paths)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Decide per request whether reads may be served by a replica.
+
+    Only safe-method requests to the views configured in
+    ``DATABASE_REPLICAS['VIEWS']`` use replicas, and only when the client
+    is not pinned to the primary by a recent write. A request whose replica
+    fails is run again on the primary, and the replica is skipped until its
+    next health check.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        db_router.reset_state()
+        if request.COOKIES.get(db_router.get_replica_setting('PIN_COOKIE')):
+            db_router.pin_to_primary()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = db_router.has_written() and request.method not in SAFE_METHODS
+            db_router.reset_state()
+
+        if wrote:
+            response.set_cookie(
+                db_router.get_replica_setting('PIN_COOKIE'),
+                '1',
+                max_age=db_router.get_replica_setting('PIN_SECONDS'),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in SAFE_METHODS:
+            return None
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        paths = tuple(db_router.get_replica_setting('VIEWS'))
+        if view_class is not None and issubclass(view_class, _replica_view_classes(paths)):
+            db_router.use_replicas()
+        return None
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, (OperationalError, InterfaceError)):
+            return None
+        alias = db_router.fail_over()
+        if alias is None:
+            return None
+        # Only safe-method requests read from replicas, so running the
+        # view again is harmless
+        logger.warning('Replica %s failed (%s), retrying %s on the primary', alias, exception, request.path)
+        match = request.resolver_match
+        return match.func(request, *match.args, **match.kwargs)
+
+
+class MetricsMiddleware:
+    """
+    Record latency, SQL and response metrics for every resolved route.
+
+    Keep it first in MIDDLEWARE so the latency covers the whole stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = metrics.get_metrics_setting('ENABLED')
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        sql = [0, 0.0]
+
+        def count_sql(execute, sql_text, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql_text, params, many, context)
+            finally:
+                sql[0] += 1
+                sql[1] += time.perf_counter() - started
+
+        metrics.take_serialize_time()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count_sql))
+            response = self.get_response(request)
+        latency = time.perf_counter() - started
+
+        match = request.resolver_match
+        route = (match.url_name or match.view_name) if match else 'unmatched'
+        size = 0 if response.streaming else len(response.content)
+        metrics.record_request(
+            route, request.method, response.status_code, latency,
+            queries=sql[0], sql_time=sql[1], serialize_time=metrics.take_serialize_time(),
+            render_time=getattr(request, '_metrics_render_time', 0.0), size=size,
+        )
+        metrics.flush()
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered (by the renderer, from data the view
+        # already serialized) after this hook; time the rendering
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._metrics_render_time = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Add ``X-RateLimit-Limit``, ``X-RateLimit-Remaining`` and
+    ``X-RateLimit-Reset`` headers to responses of throttled requests
+    (see subscriptions.throttling). Refused requests also get ``Retry-After``
+    from DRF.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            limit, remaining, reset = rate_limit
+            response.headers['X-RateLimit-Limit'] = str(limit)
+            response.headers['X-RateLimit-Remaining'] = str(remaining)
+            response.headers['X-RateLimit-Reset'] = str(reset)
+        return response
+
+
+class IdentityMapMiddleware:
+    """
+    Give each request its own identity map (see medhashaala.identity_map),
+    dropped when the response is returned.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        identity_map.activate()
+        try:
+            return self.get_response(request)
+        finally:
+            identity_map.deactivate()
@@ -0,0 +1,162 @@
+"""
+Precompiled SQL for fixed hot queries.
+
+Building a queryset and compiling it to SQL costs more CPU than running a
+primary-key or unique-column lookup on a warm connection. A
+``PreparedQuery`` is written as an ordinary queryset whose varying values
+are ``Param`` expressions::
+
+    USER_BY_EMAIL = PreparedQuery(
+        lambda email: CustomUser.objects.filter(email=email)[:2],
+        email=CustomUser._meta.get_field('email'),
+    )
+    user = USER_BY_EMAIL.first(email='a@example.com')
+
+It is compiled once per process and database alias. Each call only
+converts the parameters for the database (as the field would), runs the
+SQL and maps the rows to model instances with ``Model.from_db`` or, for
+``values()`` querysets, to dicts, applying the same converters as the ORM.
+Reads are routed like the ORM's (``router.db_for_read``).
+
+Only plain querysets can be compiled: no ``select_related``,
+``prefetch_related``, annotations or ``extra``. With
+``PREPARED_QUERIES['ENABLED']`` off, or for a queryset that cannot be
+compiled, the queryset is built with the actual values and run by the ORM.
+"""
+
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Expression
+from django.db.models.query import ModelIterable, ValuesIterable
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+}
+
+
+def get_prepared_setting(name):
+    """Return a PREPARED_QUERIES setting, falling back to the default value"""
+    return getattr(settings, 'PREPARED_QUERIES', {}).get(name, DEFAULTS[name])
+
+
+class Param(Expression):
+    """A placeholder for a value bound when the prepared query runs"""
+
+    def __init__(self, name, output_field):
+        super().__init__(output_field=output_field)
+        self.name = name
+
+    def as_sql(self, compiler, connection):
+        return '%s', [self]
+
+
+class _Compiled:
+    """The SQL of a prepared query on one database and how to read its rows"""
+
+    def __init__(self, sql, params, names, converters, model):
+        self.sql = sql
+        # Constant values, and Params to replace with the bound values
+        self.params = params
+        self.names = names
+        # [(column position, [converter, ...], expression), ...]
+        self.converters = converters
+        self.model = model
+
+
+class PreparedQuery:
+    """
+    A query built once from ``build(**params)`` and run with bound values;
+    ``params`` maps each parameter name to the model field its values are for.
+    """
+
+    def __init__(self, build, **params):
+        self.build = build
+        self.params = params
+        self._lock = threading.Lock()
+        self._template = None
+        # database alias -> _Compiled, or None if the queryset cannot be compiled
+        self._compiled = {}
+
+    def queryset(self, **values):
+        """Return the ORM queryset for ``values`` (the fallback)"""
+        return self.build(**values)
+
+    @property
+    def template(self):
+        """The queryset built with a ``Param`` for every parameter"""
+        if self._template is None:
+            self._template = self.build(**{name: Param(name, field) for name, field in self.params.items()})
+        return self._template
+
+    def compile(self, using):
+        """Return the compiled query for a database alias (None if it cannot be compiled)"""
+        try:
+            return self._compiled[using]
+        except KeyError:
+            pass
+        with self._lock:
+            if using not in self._compiled:
+                self._compiled[using] = self._compile(using)
+            return self._compiled[using]
+
+    def _compile(self, using):
+        queryset = self.template
+        query = queryset.query.chain()
+        if (
+            query.select_related or query.annotations or query.extra or queryset._prefetch_related_lookups
+            or queryset._iterable_class not in (ModelIterable, ValuesIterable)
+        ):
+            logger.warning('Cannot precompile %r; it runs through the ORM', queryset)
+            return None
+        compiler = query.get_compiler(using=using)
+        sql, params = compiler.as_sql()
+        expressions = [column for column, _, _ in compiler.select]
+        if queryset._iterable_class is ValuesIterable:
+            names, model = list(query.values_select), None
+        else:
+            names, model = [column.target.attname for column in expressions], queryset.model
+        converters = [
+            (position, functions, expression)
+            for position, (functions, expression) in compiler.get_converters(expressions).items()
+        ]
+        return _Compiled(sql, list(params), names, converters, model)
+
+    def execute(self, **values):
+        """Return the model instances (or dicts, for ``values()``) matching ``values``"""
+        using = router.db_for_read(self.template.model)
+        compiled = self.compile(using) if get_prepared_setting('ENABLED') else None
+        if compiled is None or None in values.values():
+            # The ORM turns None into IS NULL
+            return list(self.queryset(**values))
+        connection = connections[using]
+        params = [
+            param.output_field.get_db_prep_value(values[param.name], connection) if isinstance(param, Param) else param
+            for param in compiled.params
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(compiled.sql, params)
+            rows = cursor.fetchall()
+        if compiled.converters:
+            rows = [_convert(list(row), compiled.converters, connection) for row in rows]
+        if compiled.model is None:
+            return [dict(zip(compiled.names, row)) for row in rows]
+        return [compiled.model.from_db(using, compiled.names, row) for row in rows]
+
+    def first(self, **values):
+        """Return the first instance (or dict) matching ``values``, or None"""
+        rows = self.execute(**values)
+        return rows[0] if rows else None
+
+
+def _convert(row, converters, connection):
+    for position, functions, expression in converters:
+        value = row[position]
+        for function in functions:
+            value = function(value, expression, connection)
+        row[position] = value
+    return row
@@ -0,0 +1,157 @@
+"""
+Failing fast while the database is unreachable.
+
+Neon can take seconds to wake up or drop connections for a moment; a
+request that waits for it ties up a worker for up to the connect timeout.
+``database_breaker`` guards the reads that have a cached fallback (plan
+catalog, entitlements, authentication): after ``FAILURE_THRESHOLD``
+consecutive connection errors it opens and those reads raise
+``CircuitOpenError`` at once, so callers answer from their last known good
+state. After ``RESET_TIMEOUT`` seconds one call is let through to probe the
+database; its success closes the breaker again.
+
+``refresh_later`` runs cache refreshes in a small background pool, once
+per key at a time, so stale-while-revalidate readers never wait for them.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections
+from rest_framework import exceptions
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FAILURE_THRESHOLD': 3,
+    'RESET_TIMEOUT': 5,
+    'REFRESH_THREADS': 2,
+}
+
+# Errors meaning the database is unreachable, not that a query is wrong
+CONNECTION_ERRORS = (OperationalError, InterfaceError)
+
+
+def get_circuit_setting(name):
+    """Return a DATABASE_CIRCUIT setting, falling back to the default value"""
+    return getattr(settings, 'DATABASE_CIRCUIT', {}).get(name, DEFAULTS[name])
+
+
+class CircuitOpenError(Exception):
+    """The guarded resource failed recently; not trying again yet"""
+
+
+class DatabaseUnavailable(exceptions.APIException):
+    status_code = 503
+    default_detail = 'The service is temporarily unavailable, try again shortly.'
+    default_code = 'database_unavailable'
+
+
+class CircuitBreaker:
+    """Closed, open or half-open breaker counting consecutive failures"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, errors=CONNECTION_ERRORS):
+        self.name = name
+        self.errors = errors
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def allow(self):
+        """Return True if a call may go through now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= get_circuit_setting('RESET_TIMEOUT'):
+                # Let one probe through; the others keep failing fast
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info('Circuit %s closed', self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= get_circuit_setting('FAILURE_THRESHOLD'):
+                if self.state != self.OPEN:
+                    logger.warning('Circuit %s open after %s failure(s)', self.name, self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    @contextmanager
+    def guard(self):
+        """Run the block unless the breaker is open; count its connection errors"""
+        if not self.allow():
+            raise CircuitOpenError(f'{self.name} is unavailable')
+        try:
+            yield
+        except self.errors:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Any other error still came from a reachable database
+            self.record_success()
+            raise
+        self.record_success()
+
+
+database_breaker = CircuitBreaker('database')
+
+# Raised by guarded reads when the database cannot answer
+UNAVAILABLE = CONNECTION_ERRORS + (CircuitOpenError,)
+
+_refresh_lock = threading.Lock()
+_refreshing = set()
+_executor = None
+
+
+def _run_refresh(key, function):
+    try:
+        function()
+    except UNAVAILABLE as exc:
+        logger.info('Background refresh of %s skipped: %s', key, exc)
+    except Exception:
+        logger.exception('Background refresh of %s failed', key)
+    finally:
+        with _refresh_lock:
+            _refreshing.discard(key)
+        close_old_connections()
+
+
+def refresh_later(key, function):
+    """Call ``function`` in the background unless a refresh of ``key`` is already running"""
+    global _executor
+    with _refresh_lock:
+        if key in _refreshing:
+            return False
+        _refreshing.add(key)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(get_circuit_setting('REFRESH_THREADS'), thread_name_prefix='cache-refresh')
+    _executor.submit(_run_refresh, key, function)
+    return True
+
+
+def wait_for_refreshes(timeout=5):
+    """Block until the running background refreshes are done (for tests)"""
+    deadline = time.monotonic() + timeout
+    while _refreshing and time.monotonic() < deadline:
+        time.sleep(0.005)
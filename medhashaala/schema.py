@@ -0,0 +1,124 @@
+"""
+OpenAPI schema served from a prebuilt artifact.
+
+Introspecting every viewset and serializer takes hundreds of milliseconds,
+so the schema is generated once, at deploy time with
+``manage.py openapi_schema`` or lazily on the first request of a process,
+and then served from memory with an ETag. drf_spectacular is only imported
+when the schema has to be generated or the docs pages are opened.
+"""
+
+import hashlib
+import sys
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from django.views.decorators.http import condition
+from rest_framework.schemas.inspectors import ViewInspector
+
+DEFAULTS = {
+    'ARTIFACT': None,
+    'GENERATE_ON_MISS': True,
+}
+
+_lock = threading.Lock()
+# (content, etag) once loaded
+_cached = None
+
+
+def get_schema_setting(name):
+    """Return an OPENAPI_SCHEMA setting, falling back to the default value"""
+    return getattr(settings, 'OPENAPI_SCHEMA', {}).get(name, DEFAULTS[name])
+
+
+def artifact_path():
+    return Path(get_schema_setting('ARTIFACT') or Path(settings.BASE_DIR, 'openapi-schema.json'))
+
+
+def generate_schema():
+    """Introspect the API and return the schema as JSON bytes"""
+    import drf_spectacular.openapi  # noqa: F401 (switches LazyAutoSchema over)
+    from drf_spectacular.renderers import OpenApiJsonRenderer
+    from drf_spectacular.settings import spectacular_settings
+
+    import accounts.schema  # noqa: F401 (authentication extensions)
+
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    schema = generator.get_schema(request=None, public=True)
+    return OpenApiJsonRenderer().render(schema, renderer_context={})
+
+
+def write_schema_artifact(path=None):
+    """Generate the schema and store it as the artifact; return its path"""
+    path = Path(path or artifact_path())
+    path.write_bytes(generate_schema())
+    return path
+
+
+def load_schema():
+    """Return the (content, etag) pair of the schema, loading it once per process"""
+    global _cached
+    if _cached is None:
+        with _lock:
+            if _cached is None:
+                path = artifact_path()
+                if path.exists():
+                    content = path.read_bytes()
+                elif get_schema_setting('GENERATE_ON_MISS'):
+                    content = generate_schema()
+                else:
+                    raise FileNotFoundError(f'OpenAPI schema artifact {path} is missing')
+                _cached = (content, hashlib.sha256(content).hexdigest()[:32])
+    return _cached
+
+
+def clear_schema_cache():
+    """Forget the loaded schema, e.g. after rebuilding the artifact"""
+    global _cached
+    _cached = None
+
+
+@condition(etag_func=lambda request: load_schema()[1])
+def schema_view(request):
+    """
+    OpenAPI schema (JSON) for this API.
+
+    GET /api/schema/
+    """
+    content, _ = load_schema()
+    response = HttpResponse(content, content_type='application/vnd.oai.openapi+json')
+    response['Cache-Control'] = 'public, max-age=300'
+    return response
+
+
+def lazy_view(view_path, **initkwargs):
+    """Return a view that imports the class-based view ``view_path`` on first use"""
+    view = None
+
+    def wrapper(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string(view_path).as_view(**initkwargs)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class LazyAutoSchema(ViewInspector):
+    """
+    ``DEFAULT_SCHEMA_CLASS`` for lean startup.
+
+    Routers read every view's ``schema`` attribute when building URLs, which
+    would import drf_spectacular's inspector (and its dependencies) in every
+    worker. This placeholder is used until the schema is generated; from
+    then on drf_spectacular's ``AutoSchema`` is returned.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        if 'drf_spectacular.openapi' in sys.modules:
+            from drf_spectacular.openapi import AutoSchema
+            return AutoSchema(*args, **kwargs)
+        return super().__new__(cls)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -29,10 +30,16 @@ DEBUG = True
 ALLOWED_HOSTS = ['medhashaala.onrender.com']
 
 
+# Lean API-serving mode (DJANGO_LEAN_STARTUP=1): admin modules and the
+# OpenAPI schema inspector are only imported when first used
+LEAN_STARTUP = os.environ.get('DJANGO_LEAN_STARTUP') == '1'
+
+
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    # SimpleAdminConfig skips admin autodiscovery at startup
+    'django.contrib.admin.apps.SimpleAdminConfig' if LEAN_STARTUP else 'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -44,14 +51,22 @@ INSTALLED_APPS = [
     'drf_spectacular',
     'accounts',
     'subscriptions',
+    'profiling',
+    'jobs',
+    'invalidation',
 ]
 
 MIDDLEWARE = [
+    'medhashaala.middleware.MetricsMiddleware',
+    'medhashaala.middleware.RateLimitHeadersMiddleware',
+    'medhashaala.middleware.IdentityMapMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'profiling.middleware.ProfilingMiddleware',
+    'medhashaala.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -100,10 +115,281 @@ DATABASES = {
             'sslmode': 'require',
             'channel_binding': 'require',
             # Remove 'options': '-c search_path=...' if present
+            'connect_timeout': 10,
+            'keepalives': 1,
+            'keepalives_idle': 30,
         },
+        # Drop broken connections before reusing them
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Connection pooling
+# With psycopg 3 every worker keeps a bounded pool of warm connections;
+# requests wait at most 'timeout' seconds for a free one. Without it,
+# connections are kept open between requests instead.
+try:
+    import psycopg_pool  # noqa: F401
+except ImportError:
+    DATABASES['default']['CONN_MAX_AGE'] = 600
+else:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': 1,
+        'max_size': 4,
+        'timeout': 10,
+        'max_idle': 300,
+        'max_lifetime': 1800,
+        # Connections are checked out with ConnectionPool.check_connection,
+        # which Django passes itself because of CONN_HEALTH_CHECKS
+    }
+
+# Connections opened by each gunicorn worker at boot (see gunicorn.conf.py)
+DATABASE_WARMUP = {
+    'ENABLED': True,
+    'ATTEMPTS': 5,
+    # Seconds before the first retry; doubles on every attempt
+    'BACKOFF': 0.5,
+    'MAX_BACKOFF': 8,
+    'TIMEOUT': 30,
+}
+
+# Worker warm-up before serving traffic (see medhashaala/warmup.py);
+# GET /readyz answers 503 until every step has succeeded
+WARMUP = {
+    'ENABLED': True,
+    'STEPS': [
+        'medhashaala.warmup.load_urlconfs',
+        'medhashaala.warmup.build_serializers',
+        'medhashaala.warmup.open_connections',
+        'subscriptions.catalog.load_plan_catalog',
+    ],
+    # Serializers whose fields are built ahead of the first request
+    'SERIALIZERS': [
+        'subscriptions.serializers.SubscriptionPlanSerializer',
+        'subscriptions.serializers.UserSubscriptionSerializer',
+        'subscriptions.serializers.UserSubscriptionReadSerializer',
+        'accounts.serializers.CustomUserSerializer',
+        'accounts.serializers.CustomUserCreateSerializer',
+        'accounts.views.EmailOrPhoneLoginSerializer',
+    ],
+}
+
+# In-process plan catalog, evicted through the invalidation bus. After TTL
+# seconds it is reloaded in the background; older than MAX_STALE seconds,
+# readers wait for the database again.
+PLAN_CATALOG = {
+    'TTL': 60,
+    'MAX_STALE': 3600,
+}
+
+# Active subscription of each user, per worker (subscriptions/entitlements.py):
+# refreshed in the background after FRESH seconds, and served from the last
+# known good state for up to MAX_STALE seconds while the database is unreachable
+ENTITLEMENTS = {
+    'FRESH': 30,
+    'MAX_STALE': 900,
+    'MAX_ENTRIES': 50000,
+}
+
+# Expired and cancelled subscriptions unchanged for RETENTION_DAYS move to the
+# archive table (subscriptions/archive.py), BATCH_SIZE rows per transaction and
+# at most MAX_BATCHES per job, pausing PAUSE seconds between batches
+SUBSCRIPTION_ARCHIVE = {
+    'RETENTION_DAYS': 180,
+    'BATCH_SIZE': 1000,
+    'MAX_BATCHES': 20,
+    'PAUSE': 0.1,
+}
+
+# Guarded database reads (catalog, entitlements, authentication) fail fast
+# for RESET_TIMEOUT seconds after FAILURE_THRESHOLD connection errors in a row
+DATABASE_CIRCUIT = {
+    'FAILURE_THRESHOLD': 3,
+    'RESET_TIMEOUT': 5,
+    'REFRESH_THREADS': 2,
+}
+
+# Hot lookups (login, active subscription, plan by id) run SQL compiled once
+# per worker (medhashaala/prepared.py); False sends them through the ORM
+PREPARED_QUERIES = {
+    'ENABLED': True,
+}
+
+# Caches
+# Rate-limit counters must be shared by all workers: with redis-py installed
+# and REDIS_URL set they live in Redis; otherwise each worker counts on its
+# own, and a client gets the limit once per worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ratelimit',
+    },
+}
+try:
+    import redis  # noqa: F401
+except ImportError:
+    pass
+else:
+    if os.environ.get('REDIS_URL'):
+        CACHES['ratelimit'] = {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'KEY_PREFIX': 'medhashaala',
+        }
+
+# Single-flight loading of per-worker caches (medhashaala/coalescing.py): one
+# load per key per worker; the plan catalog also takes a lock in CACHE for up
+# to LOCK_TIMEOUT seconds, and the other workers wait up to LOCK_WAIT seconds
+# for the result it leaves there for RESULT_TTL seconds
+SINGLE_FLIGHT = {
+    'CACHE': 'ratelimit',
+    'LOCK_TIMEOUT': 5,
+    'LOCK_WAIT': 2,
+    'RESULT_TTL': 2,
+}
+
+# Rate limiting (subscriptions/throttling.py); rates are '<requests>/<sec|min|hour|day>',
+# None is unlimited. The first match wins: role, plan feature, plan name, DEFAULT.
+RATE_LIMITS = {
+    'ENABLED': True,
+    'CACHE': 'ratelimit',
+    # Anonymous requests, per client IP
+    'ANON': '60/min',
+    # Signed-in users without a plan
+    'DEFAULT': '60/min',
+    # 'staff' matches any staff user
+    'ROLES': {
+        'super_admin': None,
+        'admin': '6000/min',
+        'staff': '6000/min',
+    },
+    'FEATURES': {
+        'api_access': '6000/min',
+    },
+    'PLANS': {
+        'Premium': '1200/min',
+        'Standard': '600/min',
+        'Basic': '120/min',
+    },
+    # Requests a worker counts locally before pushing them to the cache, while
+    # the count is below LOCAL_THRESHOLD of the limit
+    'LOCAL_BATCH': 10,
+    'LOCAL_THRESHOLD': 0.5,
+}
+
+# Usage metering: per-worker counters written behind to UsageRecord
+METERING = {
+    'ENABLED': True,
+    # Seconds between write-behind flushes (by each worker's flusher thread), or earlier once MAX_PENDING keys wait
+    'FLUSH_INTERVAL': 10,
+    'MAX_PENDING': 10000,
+    # Seconds a worker trusts its snapshot of a user's stored usage
+    'ALLOWANCE_TTL': 30,
+    # metric -> {plan feature: monthly limit (None = unlimited)}; the first feature of the plan wins
+    'QUOTAS': {
+        'queries': {
+            'unlimited_queries': None,
+            'standard_queries': 10000,
+            'limited_queries': 1000,
+        },
+    },
+}
+
+# Read replicas
+# Add replica aliases to DATABASES and list them in ALIASES, e.g.
+# DATABASES['replica'] = {**DATABASES['default'], 'HOST': '<replica host>'}
+
+DATABASE_ROUTERS = ['medhashaala.db_router.ReplicaRouter']
+
+DATABASE_REPLICAS = {
+    'ALIASES': [],
+    # Safe-method requests to these views may read from a replica
+    'VIEWS': [
+        'subscriptions.views.SubscriptionPlanViewSet',
+        'subscriptions.views.UserSubscriptionViewSet',
+        'djoser.views.UserViewSet',
+    ],
+    # Clients read from the primary for this long after a write
+    'PIN_SECONDS': 5,
+    'PIN_COOKIE': 'db_primary_pin',
+    'MAX_LAG_SECONDS': 10,
+    'HEALTH_CHECK_INTERVAL': 30,
+}
+
+# Background jobs (python manage.py run_jobs)
+JOBS = {
+    'QUEUES': ['default'],
+    # Seconds between polls while idle
+    'POLL_INTERVAL': 1.0,
+    # Failed jobs are retried after BACKOFF * 2 ** (attempt - 1) seconds, up to MAX_BACKOFF
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 30,
+    'MAX_BACKOFF': 3600,
+    # Running jobs are queued again when their worker holds them longer than this
+    'LEASE': 600,
+    # Succeeded jobs are deleted after this many days
+    'KEEP_DAYS': 14,
+    # Chunked jobs (jobs/chunks.py) process CHUNK_SIZE rows per transaction and
+    # are requeued after MAX_CHUNKS chunks, pausing CHUNK_PAUSE seconds in between
+    'CHUNK_SIZE': 500,
+    'MAX_CHUNKS': 50,
+    'CHUNK_PAUSE': 0.05,
+    # Enqueued once per period, however many workers run
+    'PERIODIC': {
+        'expire-subscriptions': {'task': 'subscriptions.jobs.expire_subscriptions', 'every': 300},
+        'renewal-reminders': {'task': 'subscriptions.jobs.send_renewal_reminders', 'every': 86400, 'kwargs': {'days': 7}},
+        'purge-jobs': {'task': 'jobs.queue.purge_finished', 'every': 86400},
+        'deliver-outbox': {'task': 'accounts.outbox.deliver_outbox', 'every': 60},
+        'purge-invalidation-events': {'task': 'invalidation.bus.purge_events', 'every': 3600},
+        'archive-subscriptions': {'task': 'subscriptions.archive.archive_subscriptions', 'every': 3600},
+    },
+}
+
+# Cross-worker cache invalidation (invalidation/bus.py). Every worker LISTENs
+# on PostgreSQL with psycopg 3 and polls the event table otherwise.
+INVALIDATION = {
+    'ENABLED': True,
+    # Modules whose per-process caches register with bus.track()
+    'SUBSCRIBERS': [
+        'accounts.authentication',
+        'subscriptions.catalog',
+        'subscriptions.entitlements',
+        'subscriptions.metering',
+    ],
+    'CHANNEL': 'cache_invalidation',
+    # LISTEN needs a session: bypass Neon's transaction-mode pooler
+    'LISTEN_OPTIONS': {
+        'host': DATABASES['default']['HOST'].replace('-pooler', ''),
+    },
+    # Seconds between polls (and between checks for stopping while listening)
+    'POLL_INTERVAL': 1.0,
+    # Polls re-read events this many seconds old, for transactions that commit late
+    'POLL_OVERLAP': 60,
+    'RECONNECT_DELAY': 5,
+    # Events are deleted after this many hours
+    'KEEP_HOURS': 24,
+}
+
+# Emails are written to an outbox and sent in batches by a background job;
+# OUTBOX['BACKEND'] is the backend that actually delivers them
+EMAIL_BACKEND = 'accounts.outbox.OutboxBackend'
+OUTBOX = {
+    'BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+    # Emails sent per connection
+    'BATCH_SIZE': 50,
+    # Emails sent within this many seconds are delivered together
+    'WINDOW': 5,
+    'QUEUE': 'default',
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 60,
+    'MAX_BACKOFF': 3600,
+    # Emails claimed by a delivery run that died are retried after this long
+    'LEASE': 300,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -158,7 +444,7 @@ AUTHENTICATION_BACKENDS = [
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.ResilientJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -166,7 +452,12 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
-    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_THROTTLE_CLASSES': (
+        'subscriptions.throttling.PlanRateThrottle',
+    ),
+    'DEFAULT_SCHEMA_CLASS': (
+        'medhashaala.schema.LazyAutoSchema' if LEAN_STARTUP else 'drf_spectacular.openapi.AutoSchema'
+    ),
 }
 
 # Simple JWT Configuration
@@ -209,6 +500,8 @@ DJOSER = {
     'SEND_ACTIVATION_EMAIL': False,
     'SEND_CONFIRMATION_EMAIL': False,
     'PASSWORD_RESET_SHOW_EMAIL_NOT_FOUND': True,
+    # JWT only: no authtoken tokens to delete when a user logs out or deletes their account
+    'TOKEN_MODEL': None,
     'ACTIVATION_URL': 'activate/{uid}/{token}',
     'PASSWORD_RESET_CONFIRM_URL': 'password/reset/confirm/{uid}/{token}',
     'USERNAME_RESET_CONFIRM_URL': 'username/reset/confirm/{uid}/{token}',
@@ -226,3 +519,39 @@ SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True,
     'SCHEMA_PATH_PREFIX': '/api/',
 }
+
+# Prebuilt OpenAPI schema served at /api/schema/
+# Build it at deploy time with: python manage.py openapi_schema
+OPENAPI_SCHEMA = {
+    'ARTIFACT': BASE_DIR / 'openapi-schema.json',
+    # Generate the schema on the first request when the artifact is missing
+    'GENERATE_ON_MISS': True,
+}
+
+# Request metrics served at /metrics
+METRICS = {
+    'ENABLED': True,
+    # Shared directory where gunicorn workers publish their totals
+    # (set by gunicorn.conf.py); None keeps metrics per process
+    'MULTIPROCESS_DIR': os.environ.get('METRICS_MULTIPROCESS_DIR'),
+    # Seconds between writes of a worker's totals to MULTIPROCESS_DIR
+    'FLUSH_INTERVAL': 10,
+    # Bearer token required to scrape /metrics; without one, /metrics is
+    # only served when DEBUG is on
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+# Request profiling
+# Staff users profile a request by sending the HEADER; SAMPLE_RATE profiles
+# that fraction of all requests. Captures are listed in the admin.
+PROFILING = {
+    'HEADER': 'X-Profile',
+    'SAMPLE_RATE': 0.0,
+    # Seconds between stack samples
+    'INTERVAL': 0.005,
+    'DIRECTORY': BASE_DIR / 'profiles',
+    # 'speedscope' (JSON for speedscope.app) or 'collapsed' (flamegraph.pl)
+    'FORMAT': 'speedscope',
+    # Number of captures kept on disk
+    'KEEP': 200,
+}
@@ -0,0 +1,158 @@
+"""
+Worker startup profile.
+
+Run in a fresh interpreter by ``manage.py startup_profile``::
+
+    python -X importtime -m medhashaala.startup --path /metrics
+
+It boots Django the way a gunicorn worker does (settings, app registry,
+URLconf, WSGI handler and middleware) and then serves one request, timing
+every phase and each ``AppConfig.ready``. The phase timings are printed as
+JSON on stdout; ``-X importtime`` writes the import tree to stderr, which
+``parse_importtime`` turns into a per-module breakdown.
+"""
+
+import io
+import json
+import sys
+import time
+
+# Modules that lean startup defers until first use
+DEFERRED_MODULES = (
+    'django.contrib.auth.admin',
+    'drf_spectacular.openapi',
+    'drf_spectacular.views',
+)
+
+
+def parse_importtime(text):
+    """
+    Parse ``-X importtime`` output.
+
+    Returns a list of ``(module, self_us, cumulative_us, depth)`` tuples in
+    the order they were printed (children before their parent).
+    """
+    entries = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            # Header line
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    return entries
+
+
+def summarize_imports(entries, top=15):
+    """Return the import total, the slowest packages and the slowest top-level imports"""
+    packages = {}
+    for module, self_us, _, _ in entries:
+        package = module.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    roots = [(module, cumulative) for module, _, cumulative, depth in entries if depth == 0]
+    return {
+        'total_ms': round(sum(self_us for _, self_us, _, _ in entries) / 1000, 1),
+        'modules': len(entries),
+        'packages_ms': [
+            (package, round(us / 1000, 1))
+            for package, us in sorted(packages.items(), key=lambda item: -item[1])[:top]
+        ],
+        'imports_ms': [
+            (module, round(us / 1000, 1))
+            for module, us in sorted(roots, key=lambda item: -item[1])[:top]
+        ],
+    }
+
+
+def profile_startup(path='/metrics'):
+    """Boot Django, serve one GET request to ``path`` and return the timings"""
+    phases = {}
+    ready = {}
+    started = time.perf_counter()
+
+    def phase(name, since):
+        now = time.perf_counter()
+        phases[name] = round((now - since) * 1000, 2)
+        return now
+
+    import django
+    from django.apps.config import AppConfig
+    from django.conf import settings
+
+    settings.INSTALLED_APPS
+    mark = phase('settings', started)
+
+    create = AppConfig.create.__func__
+
+    def timed_create(cls, entry):
+        app_config = create(cls, entry)
+        original = app_config.ready
+
+        def timed_ready():
+            ready_started = time.perf_counter()
+            original()
+            ready[app_config.label] = round((time.perf_counter() - ready_started) * 1000, 2)
+
+        app_config.ready = timed_ready
+        return app_config
+
+    AppConfig.create = classmethod(timed_create)
+    try:
+        django.setup()
+    finally:
+        AppConfig.create = classmethod(create)
+    mark = phase('apps', mark)
+
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+    mark = phase('urlconf', mark)
+
+    from django.core.handlers.wsgi import WSGIHandler
+
+    application = WSGIHandler()
+    mark = phase('middleware', mark)
+
+    host = next((host for host in settings.ALLOWED_HOSTS if host not in ('*', '')), 'localhost').lstrip('.')
+    status = []
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '443',
+        'HTTP_HOST': host,
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'https',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+    }
+    response = application(environ, lambda code, headers, exc_info=None: status.append(code))
+    b''.join(response)
+    response.close()
+    mark = phase('first_response', mark)
+
+    return {
+        'lean': getattr(settings, 'LEAN_STARTUP', False),
+        'path': path,
+        'status': status[0] if status else None,
+        'total_ms': round((mark - started) * 1000, 2),
+        'phases_ms': phases,
+        'ready_ms': ready,
+        'loaded': {module: module in sys.modules for module in DEFERRED_MODULES},
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default='/metrics')
+    args = parser.parse_args()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'medhashaala.settings')
+    json.dump(profile_startup(args.path), sys.stdout)
@@ -0,0 +1,94 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connections
+from django.test import Client, TestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from subscriptions.models import SubscriptionPlan
+from . import db_router
+
+User = get_user_model()
+
+
+class ReplicaAliasTest(TestCase):
+    """Test cases for the router with a second test database as the replica"""
+    
+    @classmethod
+    def setUpClass(cls):
+        primary = connections['default'].settings_dict
+        connections.settings['replica'] = dict(
+            primary, TEST=dict(primary['TEST'], NAME=f"{primary['NAME']}_replica")
+        )
+        cls.replica_name = connections['replica'].settings_dict['NAME']
+        connections['replica'].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # Set here rather than on the class, so that the test runner does not
+        # look for a test database of its own for 'replica'
+        cls.databases = {'default', 'replica'}
+        super().setUpClass()
+    
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].creation.destroy_test_db(cls.replica_name, verbosity=0)
+        del connections.settings['replica']
+        delattr(connections._connections, 'replica')
+    
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(email='test@example.com', name='Test User', password='testpass123')
+        self.admin_user = User.objects.create_user(
+            email='admin@example.com', name='Admin User', password='adminpass123', is_staff=True
+        )
+        SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('9.99'))
+        # The replica has the users, and a plan the primary does not have
+        for user in User.objects.all():
+            user.save(using='replica', force_insert=True)
+        SubscriptionPlan.objects.using('replica').create(name='Replica', features=['feature1'], price=Decimal('9.99'))
+        
+        self.client = Client()
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        db_router.reset_state()
+        db_router.clear_health_cache()
+        self.addCleanup(db_router.clear_health_cache)
+        replica_settings = self.settings(DATABASE_REPLICAS=dict(settings.DATABASE_REPLICAS, ALIASES=['replica']))
+        replica_settings.enable()
+        self.addCleanup(replica_settings.disable)
+    
+    def plan_names(self, **headers):
+        response = self.client.get('/api/plans/', **self.headers, **headers)
+        self.assertEqual(response.status_code, 200)
+        return sorted(plan['name'] for plan in response.json()['results'])
+    
+    def test_reads_replica_writes_and_pinned_reads_primary(self):
+        """Test that reads go to the replica, and writes and reads after a write to the primary"""
+        self.assertEqual(self.plan_names(), ['Replica'])
+        
+        response = self.client.post(
+            '/api/plans/',
+            {'name': 'Premium', 'features': ['feature1'], 'price': '19.99'},
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.admin_user)}'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(SubscriptionPlan.objects.using('default').filter(name='Premium').exists())
+        self.assertFalse(SubscriptionPlan.objects.using('replica').filter(name='Premium').exists())
+        
+        # The client holds the pin cookie now
+        self.assertEqual(self.plan_names(), ['Basic', 'Premium'])
+        self.client.cookies.clear()
+        self.assertEqual(self.plan_names(), ['Replica'])
+    
+    def test_failing_replica_falls_back_to_primary(self):
+        """Test that a replica failing during a request is retried on the primary and skipped afterwards"""
+        def fail(execute, sql, params, many, context):
+            # The health check passes; the replica goes away afterwards
+            if SubscriptionPlan._meta.db_table in sql:
+                raise OperationalError('replica went away')
+            return execute(sql, params, many, context)
+        
+        with connections['replica'].execute_wrapper(fail), self.assertLogs('medhashaala.middleware', 'WARNING'):
+            self.assertEqual(self.plan_names(), ['Basic'])
+        self.assertFalse(db_router.replica_is_healthy('replica'))
+        self.assertEqual(self.plan_names(), ['Basic'])
@@ -14,26 +14,33 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
 from django.urls import path, include
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
-from accounts.views import CustomTokenObtainPairView
+from .schema import lazy_view, schema_view
+from .views import DatabaseConnectionStatsView, metrics_view, readiness_view
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    # (urlconf, app_name, namespace) like admin.site.urls, but the module is
+    # only imported when an admin URL is first resolved or reversed
+    path('admin/', ('medhashaala.admin_urls', 'admin', 'admin')),
     
-    # API Documentation
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
-    path('api/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    # API Documentation (schema served from the prebuilt artifact)
+    path('api/schema/', schema_view, name='schema'),
+    path('api/docs/', lazy_view('drf_spectacular.views.SpectacularSwaggerView', url_name='schema'), name='swagger-ui'),
+    path('api/redoc/', lazy_view('drf_spectacular.views.SpectacularRedocView', url_name='schema'), name='redoc'),
     
     # Authentication endpoints
+    # JWT create (email or phone) and the user endpoints override djoser's
+    path('api/auth/', include('accounts.urls')),
     path('api/auth/', include('djoser.urls')),
-    # Override JWT create with custom view (email or phone)
-    path('api/auth/jwt/create/', CustomTokenObtainPairView.as_view(), name='jwt-create'),
     # Keep refresh/verify from djoser/simplejwt
     path('api/auth/', include('djoser.urls.jwt')),
     
+    # Operations
+    path('api/admin/db-connections/', DatabaseConnectionStatsView.as_view(), name='db-connections'),
+    path('api/admin/', include('jobs.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    path('readyz', readiness_view, name='readiness'),
+    
     # Subscriptions endpoints
     path('', include('subscriptions.urls')),
 ]
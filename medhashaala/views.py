@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import metrics, warmup
+from .db_connections import connection_stats
+
+
+class DatabaseConnectionStatsView(APIView):
+    """
+    Connection and pool statistics of the worker serving the request.
+
+    GET /api/admin/db-connections/
+    """
+    
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        return Response(connection_stats())
+
+
+def metrics_view(request):
+    """
+    Request metrics of all workers in Prometheus text format.
+
+    GET /metrics
+    Scrapers must send METRICS['TOKEN'] as a Bearer token. Without a token
+    configured, metrics are only served when DEBUG is on.
+    """
+    token = metrics.get_metrics_setting('TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not constant_time_compare(supplied, token):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        return HttpResponse(status=403)
+    return HttpResponse(
+        metrics.render_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def readiness_view(request):
+    """
+    Readiness of the worker serving the request.
+
+    GET /readyz
+    503 until the worker has warmed up; the probe starts warm-up when no
+    server hook has. Does not query the database.
+    """
+    if not warmup.is_ready():
+        warmup.ensure_warm_up()
+    state = warmup.readiness()
+    return JsonResponse(state, status=200 if state['ready'] else 503)
@@ -0,0 +1,152 @@
+"""
+Worker warm-up and readiness.
+
+The first requests after a deploy would otherwise pay for importing and
+indexing the URLconfs, building serializer fields, connecting to Neon
+(possibly waking it up) and loading the plan catalog. ``warm_up`` runs the
+``WARMUP['STEPS']`` before a worker serves traffic: gunicorn calls it from
+``post_worker_init``, and under other servers the first readiness probe
+starts it in the background. ``GET /readyz`` answers 503 until every step
+has succeeded, and never touches the database itself.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import URLResolver, get_resolver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'STEPS': [],
+    'SERIALIZERS': [],
+}
+
+_lock = threading.Lock()
+_state = {
+    'ready': False,
+    'running': False,
+    'steps': {},
+}
+
+
+def get_warmup_setting(name):
+    """Return a WARMUP setting, falling back to the default value"""
+    return getattr(settings, 'WARMUP', {}).get(name, DEFAULTS[name])
+
+
+def load_urlconfs():
+    """Import every URLconf and build the reverse() lookup tables"""
+    # The admin URLconf stays deferred in lean mode
+    skip = {'admin'} if getattr(settings, 'LEAN_STARTUP', False) else set()
+
+    def walk(resolver):
+        count = 0
+        for pattern in resolver.url_patterns:
+            if not isinstance(pattern, URLResolver):
+                count += 1
+            elif pattern.namespace not in skip:
+                count += walk(pattern)
+        return count
+
+    resolver = get_resolver()
+    routes = walk(resolver)
+    if not skip:
+        resolver.reverse_dict
+    return routes
+
+
+def build_serializers():
+    """Build the fields of the hot serializers"""
+    paths = get_warmup_setting('SERIALIZERS')
+    for path in paths:
+        import_string(path)().fields
+    return len(paths)
+
+
+def open_connections():
+    """Connect to every database, retrying while Neon wakes up"""
+    from .db_connections import warm_up_connections
+
+    options = settings.DATABASE_WARMUP
+    if not options['ENABLED']:
+        return 'disabled'
+    results = warm_up_connections(
+        attempts=options['ATTEMPTS'],
+        backoff=options['BACKOFF'],
+        max_backoff=options['MAX_BACKOFF'],
+        timeout=options['TIMEOUT'],
+    )
+    failed = [alias for alias, ok in results.items() if not ok]
+    if failed:
+        raise RuntimeError(f"Could not connect to {', '.join(failed)}")
+    return results
+
+
+def warm_up():
+    """Run every warm-up step; return True if the worker is ready"""
+    with _lock:
+        if _state['running']:
+            return _state['ready']
+        _state['running'] = True
+
+    steps = {}
+    ready = True
+    try:
+        for path in get_warmup_setting('STEPS'):
+            started = time.perf_counter()
+            try:
+                result = {'result': import_string(path)()}
+            except Exception as exc:
+                logger.exception('Warm-up step %s failed', path)
+                result = {'error': str(exc)}
+                ready = False
+            result['seconds'] = round(time.perf_counter() - started, 4)
+            steps[path] = result
+    finally:
+        with _lock:
+            _state.update(ready=ready, running=False, steps=steps)
+    logger.info('Warm-up %s: %s', 'finished' if ready else 'failed', steps)
+    return ready
+
+
+def _warm_up_in_background():
+    try:
+        warm_up()
+    finally:
+        # Hand pooled connections back; plain ones would only serve this thread
+        connections.close_all()
+
+
+def is_ready():
+    """Return True once warm-up has succeeded (or when it is disabled)"""
+    return _state['ready'] or not get_warmup_setting('ENABLED')
+
+
+def ensure_warm_up():
+    """Start warm-up in a background thread unless it is done or running"""
+    with _lock:
+        if _state['ready'] or _state['running']:
+            return
+    threading.Thread(target=_warm_up_in_background, name='warm-up', daemon=True).start()
+
+
+def readiness():
+    """Return the readiness of this worker and the outcome of each step"""
+    with _lock:
+        return {
+            'ready': is_ready(),
+            'running': _state['running'],
+            'steps': dict(_state['steps']),
+        }
+
+
+def reset():
+    """Forget the warm-up state of this process"""
+    with _lock:
+        _state.update(ready=False, running=False, steps={})
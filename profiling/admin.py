@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .middleware import get_profiling_setting
+from .models import ProfileCapture
+
+
+@admin.register(ProfileCapture)
+class ProfileCaptureAdmin(admin.ModelAdmin):
+    """Admin interface listing recent request profiles"""
+    
+    list_display = ['created_at', 'method', 'route', 'status_code', 'user_role', 'trigger',
+                    'duration_ms', 'sample_count', 'download']
+    list_filter = ['route', 'user_role', 'trigger', 'created_at']
+    search_fields = ['route', 'path']
+    readonly_fields = [field.name for field in ProfileCapture._meta.fields] + ['download']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view),
+                 name='profiling_profilecapture_download'),
+        ] + super().get_urls()
+    
+    def download(self, obj):
+        """Link to the profile file (open it in speedscope.app)"""
+        url = reverse('admin:profiling_profilecapture_download', args=[obj.pk])
+        return format_html('<a href="{}">{}</a>', url, obj.file_name)
+    download.short_description = 'Profile'
+    
+    def download_view(self, request, pk):
+        capture = get_object_or_404(ProfileCapture, pk=pk)
+        directory = Path(get_profiling_setting('DIRECTORY') or Path(settings.BASE_DIR, 'profiles'))
+        file_path = directory / capture.file_name
+        if not file_path.exists():
+            raise Http404('The profile file no longer exists')
+        return FileResponse(file_path.open('rb'), as_attachment=True, filename=capture.file_name)
@@ -0,0 +1,99 @@
+import random
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .sampler import Sampler
+
+DEFAULTS = {
+    'HEADER': 'X-Profile',
+    'SAMPLE_RATE': 0.0,
+    'INTERVAL': 0.005,
+    'DIRECTORY': None,
+    'FORMAT': 'speedscope',
+    'KEEP': 200,
+}
+
+
+def get_profiling_setting(name):
+    """Return a PROFILING setting, falling back to the default value"""
+    return getattr(settings, 'PROFILING', {}).get(name, DEFAULTS[name])
+
+
+def store_capture(sampler, request, response, trigger):
+    """Write a profile to disk, record it and prune old captures"""
+    from .models import ProfileCapture
+
+    match = request.resolver_match
+    route = (match.url_name or match.view_name) if match else 'unmatched'
+    user = getattr(request, 'user', None)
+    role = (getattr(user, 'role', '') or 'staff') if user and user.is_authenticated else 'anonymous'
+    profile_format = get_profiling_setting('FORMAT')
+
+    directory = Path(get_profiling_setting('DIRECTORY') or Path(settings.BASE_DIR, 'profiles'))
+    directory.mkdir(parents=True, exist_ok=True)
+    stamp = timezone.now().strftime('%Y%m%dT%H%M%S%f')
+    extension = 'speedscope.json' if profile_format == 'speedscope' else 'collapsed.txt'
+    file_name = f'{stamp}-{route}-{role}.{extension}'
+    name = f'{request.method} {request.path} [{route}, {role}]'
+    content = sampler.to_speedscope(name) if profile_format == 'speedscope' else sampler.to_collapsed()
+    (directory / file_name).write_text(content)
+
+    capture = ProfileCapture.objects.create(
+        route=route,
+        method=request.method,
+        path=request.path[:500],
+        status_code=response.status_code,
+        user_role=role,
+        trigger=trigger,
+        duration_ms=round(sampler.duration * 1000, 3),
+        sample_count=sampler.sample_count,
+        format=profile_format,
+        file_name=file_name,
+    )
+
+    stale = ProfileCapture.objects.all()[get_profiling_setting('KEEP'):]
+    for old in stale:
+        (directory / old.file_name).unlink(missing_ok=True)
+        old.delete()
+    return capture
+
+
+class ProfilingMiddleware:
+    """
+    Profile a request with the sampling profiler when asked to.
+
+    Staff users trigger a capture with the ``X-Profile`` header; in
+    addition a ``SAMPLE_RATE`` fraction of all requests is captured.
+    Other requests only pay for a header lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = get_profiling_setting('HEADER')
+        self.sample_rate = get_profiling_setting('SAMPLE_RATE')
+        self.interval = get_profiling_setting('INTERVAL')
+
+    def __call__(self, request):
+        if request.headers.get(self.header):
+            trigger = 'header'
+        elif self.sample_rate and random.random() < self.sample_rate:
+            trigger = 'sampled'
+        else:
+            return self.get_response(request)
+
+        sampler = Sampler(interval=self.interval).start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+
+        # DRF authenticates inside the view and sets request.user then
+        user = getattr(request, 'user', None)
+        if trigger == 'header' and not (user and user.is_staff):
+            return response
+
+        capture = store_capture(sampler, request, response, trigger)
+        response['X-Profile-Id'] = str(capture.pk)
+        return response
@@ -0,0 +1,30 @@
+from django.db import models
+
+
+class ProfileCapture(models.Model):
+    """A sampled profile of one request, written to PROFILING['DIRECTORY']"""
+    
+    FORMAT_CHOICES = [
+        ('speedscope', 'Speedscope JSON'),
+        ('collapsed', 'Collapsed stacks'),
+    ]
+    
+    route = models.CharField(max_length=200)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.PositiveSmallIntegerField()
+    user_role = models.CharField(max_length=20, blank=True)
+    trigger = models.CharField(max_length=20, help_text="'header' or 'sampled'")
+    duration_ms = models.FloatField()
+    sample_count = models.PositiveIntegerField()
+    format = models.CharField(max_length=20, choices=FORMAT_CHOICES)
+    file_name = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Profile Capture"
+        verbose_name_plural = "Profile Captures"
+    
+    def __str__(self):
+        return f"{self.method} {self.route} ({self.duration_ms:.0f} ms)"
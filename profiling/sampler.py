@@ -0,0 +1,93 @@
+"""
+Statistical sampling profiler for a single thread.
+
+A background thread wakes up every ``interval`` seconds, grabs the current
+stack of the profiled thread through ``sys._current_frames()`` and counts
+identical stacks. The profiled code runs unmodified, so the overhead is
+bounded by the sampling rate rather than by the number of calls.
+"""
+
+import json
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class Sampler:
+    """Sample the stack of ``thread_id`` until ``stop()`` is called"""
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._started
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            # Root first, as flame graphs expect
+            self.samples[tuple(reversed(stack))] += 1
+
+    @property
+    def sample_count(self):
+        return sum(self.samples.values())
+
+    def to_collapsed(self):
+        """Render the samples as collapsed stacks (flamegraph.pl, speedscope)"""
+        lines = []
+        for stack, count in self.samples.most_common():
+            names = ';'.join(f'{name} ({filename}:{line})' for name, filename, line in stack)
+            lines.append(f'{names} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def to_speedscope(self, name):
+        """Render the samples in the speedscope file format"""
+        frames = []
+        index = {}
+        samples = []
+        weights = []
+        for stack, count in self.samples.items():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                ids.append(index[frame])
+            samples.append(ids)
+            weights.append(count * self.interval)
+        return json.dumps({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'medhashaala-profiler',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        })
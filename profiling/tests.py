@@ -0,0 +1,106 @@
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from .models import ProfileCapture
+from .sampler import Sampler
+
+User = get_user_model()
+
+
+def busy_wait(seconds):
+    """Keep the profiled thread on-CPU for ``seconds``"""
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class SamplerTest(TestCase):
+    """Test cases for the statistical sampler"""
+    
+    def test_samples_current_thread(self):
+        """Test that the sampler records the stack of the profiled thread"""
+        sampler = Sampler(interval=0.001).start()
+        busy_wait(0.05)
+        sampler.stop()
+        
+        self.assertGreater(sampler.sample_count, 0)
+        self.assertIn('busy_wait', sampler.to_collapsed())
+        
+        profile = sampler.to_speedscope('test')
+        self.assertIn('"type": "sampled"', profile)
+        self.assertIn('busy_wait', profile)
+
+
+class ProfilingMiddlewareTest(TestCase):
+    """Test cases for per-request profiling"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            name='Test User',
+            password='testpass123',
+            role='user'
+        )
+        self.admin_user = User.objects.create_user(
+            email='admin@example.com',
+            name='Admin User',
+            password='adminpass123',
+            role='admin',
+            is_staff=True,
+            is_superuser=True
+        )
+    
+    def profiling_settings(self, **overrides):
+        return self.settings(PROFILING={'DIRECTORY': self.directory, 'INTERVAL': 0.001, **overrides})
+    
+    def test_header_profiles_staff_requests(self):
+        """Test that staff users can profile a request with the header"""
+        with self.profiling_settings():
+            client = Client()
+            client.force_login(self.admin_user)
+            response = client.get('/api/plans/', HTTP_X_PROFILE='1')
+            
+            self.assertEqual(response.status_code, 200)
+            capture = ProfileCapture.objects.get(pk=response['X-Profile-Id'])
+            self.assertEqual(capture.route, 'plan-list')
+            self.assertEqual(capture.user_role, 'admin')
+            self.assertEqual(capture.trigger, 'header')
+            self.assertTrue(capture.file_name.endswith('.speedscope.json'))
+            
+            # The capture is listed and downloadable in the admin
+            response = client.get('/admin/profiling/profilecapture/')
+            self.assertContains(response, capture.file_name)
+            response = client.get(f'/admin/profiling/profilecapture/{capture.pk}/download/')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'"profiles"', b''.join(response.streaming_content))
+    
+    def test_header_is_ignored_for_regular_users(self):
+        """Test that regular users cannot trigger a capture"""
+        with self.profiling_settings():
+            client = Client()
+            client.force_login(self.user)
+            response = client.get('/api/plans/', HTTP_X_PROFILE='1')
+        
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(ProfileCapture.objects.exists())
+    
+    def test_sample_rate_and_retention(self):
+        """Test sampled captures and pruning of old captures"""
+        with self.profiling_settings(SAMPLE_RATE=1.0, FORMAT='collapsed', KEEP=2):
+            client = Client()
+            client.force_login(self.user)
+            for _ in range(3):
+                client.get('/api/plans/')
+        
+        captures = ProfileCapture.objects.all()
+        self.assertEqual(captures.count(), 2)
+        self.assertTrue(all(capture.trigger == 'sampled' for capture in captures))
+        self.assertEqual(len(list(Path(self.directory).iterdir())), 2)
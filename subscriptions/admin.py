@@ -1,10 +1,124 @@
 from django.contrib import admin
-from .models import SubscriptionPlan, UserSubscription
+from django.contrib.admin.utils import build_q_object_from_lookup_parameters, quote
+from django.contrib.admin.views.main import ChangeList
+from django.db import transaction
+from django.urls import reverse
+from invalidation.bus import publish_rows
+from jobs.admin import BackgroundDeletionMixin
+from .archive import CombinedSubscriptions
+from .deletion import start_plan_deletion
+from .history import update_recorded
+from .models import ArchivedSubscription, SubscriptionInterval, SubscriptionPlan, UsageRecord, UserSubscription
+
+
+class CurrentlyActiveFilter(admin.SimpleListFilter):
+    """Filter on is_active in the database"""
+    
+    title = 'currently active'
+    parameter_name = 'currently_active'
+    
+    def lookups(self, request, model_admin):
+        return [('yes', 'Yes'), ('no', 'No')]
+    
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.active()
+        if self.value() == 'no':
+            return queryset.inactive()
+        return queryset
+    
+    def archived_queryset(self, request, queryset):
+        # Archived subscriptions are never active
+        return queryset.none() if self.value() == 'yes' else queryset
+
+
+class ExpiringFilter(admin.SimpleListFilter):
+    """Active subscriptions ending within a number of days"""
+    
+    title = 'expiring within'
+    parameter_name = 'expires_within'
+    
+    def lookups(self, request, model_admin):
+        return [('7', '7 days'), ('30', '30 days')]
+    
+    def queryset(self, request, queryset):
+        if self.value() in ('7', '30'):
+            return queryset.expiring_within(int(self.value()))
+        return queryset
+    
+    def archived_queryset(self, request, queryset):
+        return queryset.none() if self.value() in ('7', '30') else queryset
+
+
+class ArchivedFilter(admin.SimpleListFilter):
+    """Add the archived subscriptions to the list, or list only those (see SubscriptionChangeList)"""
+    
+    title = 'archived'
+    parameter_name = 'archived'
+    
+    def lookups(self, request, model_admin):
+        return [('include', 'Included'), ('only', 'Only')]
+    
+    def choices(self, changelist):
+        choices = list(super().choices(changelist))
+        choices[0]['display'] = 'Excluded'
+        return choices
+    
+    def queryset(self, request, queryset):
+        # The change list reads the archive itself
+        return queryset
+
+
+class CombinedRows(CombinedSubscriptions):
+    """Current and archived subscriptions as the admin change list pages them"""
+    
+    def _clone(self):
+        # The change list copies its queryset when everything fits on one page
+        return self[:]
+
+
+class SubscriptionChangeList(ChangeList):
+    """
+    Change list of the current subscriptions; with the archived filter set it
+    lists the archived ones too, or only those, newest first, with the other
+    filters and the search applied to both tables.
+    """
+    
+    def get_results(self, request):
+        mode = next((spec.value() for spec in self.filter_specs if isinstance(spec, ArchivedFilter)), None)
+        if mode == 'only':
+            self.queryset = self.get_archived_queryset(request)
+        elif mode == 'include':
+            self.queryset = CombinedRows(self.queryset, self.get_archived_queryset(request))
+        super().get_results(request)
+    
+    def get_filters(self, request):
+        filters = super().get_filters(request)
+        # Plain lookups in the query string, kept to apply them to the archive as well
+        self.remaining_lookup_params = filters[2]
+        return filters
+    
+    def get_archived_queryset(self, request):
+        """The archived subscriptions matching the filters and search of the request"""
+        archived = ArchivedSubscription.objects.select_related('user', 'plan').order_by('-created_at', '-id')
+        for spec in self.filter_specs:
+            archived = getattr(spec, 'archived_queryset', spec.queryset)(request, archived)
+        archived = archived.filter(build_q_object_from_lookup_parameters(self.remaining_lookup_params))
+        archived, may_have_duplicates = self.model_admin.get_search_results(request, archived, self.query)
+        return archived.distinct() if may_have_duplicates else archived
+    
+    def url_for_result(self, result):
+        if isinstance(result, ArchivedSubscription):
+            return reverse(
+                'admin:subscriptions_archivedsubscription_change', args=(quote(result.pk),),
+                current_app=self.model_admin.admin_site.name,
+            )
+        return super().url_for_result(result)
 
 
 @admin.register(SubscriptionPlan)
-class SubscriptionPlanAdmin(admin.ModelAdmin):
-    """Admin interface for SubscriptionPlan model"""
+class SubscriptionPlanAdmin(BackgroundDeletionMixin, admin.ModelAdmin):
+    """Admin interface for SubscriptionPlan model; deleting a plan deactivates it and deletes it in the background"""
     
     list_display = ['name', 'price', 'feature_count', 'is_active', 'created_at']
     list_filter = ['is_active', 'name', 'created_at']
@@ -29,6 +143,8 @@ class SubscriptionPlanAdmin(admin.ModelAdmin):
         """Display feature count in admin list"""
         return obj.feature_count
     feature_count.short_description = 'Features Count'
+    
+    deletion_job = staticmethod(start_plan_deletion)
 
 
 @admin.register(UserSubscription)
@@ -36,8 +152,8 @@ class UserSubscriptionAdmin(admin.ModelAdmin):
     """Admin interface for UserSubscription model"""
     
     list_display = ['user', 'plan', 'status', 'is_active', 'start_date', 'end_date']
-    list_filter = ['status', 'plan', 'start_date', 'created_at']
-    search_fields = ['user__username', 'user__email', 'plan__name']
+    list_filter = ['status', CurrentlyActiveFilter, ExpiringFilter, ArchivedFilter, 'plan', 'start_date', 'created_at']
+    search_fields = ['user__email', 'user__phone', 'plan__name']
     readonly_fields = ['created_at', 'updated_at', 'is_active']
     
     fieldsets = (
@@ -58,28 +174,94 @@ class UserSubscriptionAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        """Compute is_active in the database so that the column can be sorted"""
+        return super().get_queryset(request).with_active_now()
+    
+    def get_changelist(self, request, **kwargs):
+        return SubscriptionChangeList
+    
     def is_active(self, obj):
         """Display if subscription is currently active"""
-        return obj.is_active
+        # Falls back to the property on objects not loaded through get_queryset
+        return getattr(obj, 'active_now', obj.is_active)
     is_active.boolean = True
     is_active.short_description = 'Currently Active'
+    is_active.admin_order_field = 'active_now'
     
     actions = ['activate_subscriptions', 'deactivate_subscriptions', 'cancel_subscriptions']
     
+    def update_status(self, queryset, status):
+        """Bulk update; update() sends no signals, so publish the invalidations and record the history here"""
+        with transaction.atomic():
+            publish_rows(queryset, 'user_id')
+            return update_recorded(queryset, status=status)
+    
     def activate_subscriptions(self, request, queryset):
         """Admin action to activate selected subscriptions"""
-        updated = queryset.update(status='active')
+        updated = self.update_status(queryset, 'active')
         self.message_user(request, f'{updated} subscription(s) activated successfully.')
     activate_subscriptions.short_description = "Activate selected subscriptions"
     
     def deactivate_subscriptions(self, request, queryset):
         """Admin action to deactivate selected subscriptions"""
-        updated = queryset.update(status='expired')
+        updated = self.update_status(queryset, 'expired')
         self.message_user(request, f'{updated} subscription(s) deactivated successfully.')
     deactivate_subscriptions.short_description = "Deactivate selected subscriptions"
     
     def cancel_subscriptions(self, request, queryset):
         """Admin action to cancel selected subscriptions"""
-        updated = queryset.update(status='cancelled')
+        updated = self.update_status(queryset, 'cancelled')
         self.message_user(request, f'{updated} subscription(s) cancelled successfully.')
     cancel_subscriptions.short_description = "Cancel selected subscriptions"
+
+
+@admin.register(UsageRecord)
+class UsageRecordAdmin(admin.ModelAdmin):
+    """Admin interface listing metered usage per user and month"""
+    
+    list_display = ['user', 'metric', 'period', 'count', 'updated_at']
+    list_filter = ['metric', 'period']
+    list_select_related = ['user']
+    search_fields = ['user__email', 'user__phone']
+    readonly_fields = ['user', 'metric', 'period', 'count', 'updated_at']
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(SubscriptionInterval)
+class SubscriptionIntervalAdmin(admin.ModelAdmin):
+    """Read-only admin interface over the append-only subscription history"""
+    
+    list_display = ['user', 'subscription_id', 'plan_name', 'status', 'end_date', 'valid_from', 'valid_to']
+    list_filter = ['status', 'plan_name', 'valid_from']
+    list_select_related = ['user']
+    search_fields = ['user__email', 'user__phone', '=subscription_id']
+    date_hierarchy = 'valid_from'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedSubscription)
+class ArchivedSubscriptionAdmin(admin.ModelAdmin):
+    """Read-only admin interface for subscriptions moved to the archive (see subscriptions.archive)"""
+    
+    list_display = ['id', 'user', 'plan', 'status', 'start_date', 'end_date', 'archived_at']
+    list_filter = ['status', 'plan', 'archived_at']
+    list_select_related = ['user', 'plan']
+    search_fields = ['=id', 'user__email', 'user__phone', 'plan__name']
+    readonly_fields = [field.name for field in ArchivedSubscription._meta.fields]
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,153 @@
+"""
+Hot/cold split of subscriptions.
+
+Most ``UserSubscription`` rows end up expired or cancelled and are never
+written again, yet they stay in the table and indexes that every feature
+check, renewal and admin listing scans. ``archive_subscriptions`` (a
+periodic job, see ``JOBS['PERIODIC']``) moves the ones that have not
+changed for ``SUBSCRIPTION_ARCHIVE['RETENTION_DAYS']`` to
+``ArchivedSubscription``, keeping their ids, ``BATCH_SIZE`` rows per
+transaction. A run stops after ``MAX_BATCHES`` batches and enqueues the
+next one, so a large backlog never holds a worker past its lease; on
+PostgreSQL concurrent runs skip each other's locked rows.
+
+Moving a row sends no signals: its subscription history stays as it was
+(the last interval remains open with the terminal state), and no cache
+holds terminal subscriptions. It also frees the ``(user, status)`` slot,
+so ``expire_subscriptions`` can expire the user's next subscription.
+
+Reads that need every subscription go through ``CombinedSubscriptions``
+(the admin API with ``?archived=include``) or ``iter_subscriptions`` (the
+``export_subscriptions`` command).
+"""
+
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import BooleanField, Value
+from django.utils import timezone
+
+from jobs.queue import enqueue
+from medhashaala.identity_map import forget
+from .models import ArchivedSubscription, UserSubscription
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'RETENTION_DAYS': 180,
+    'BATCH_SIZE': 1000,
+    'MAX_BATCHES': 20,
+    'PAUSE': 0.1,
+}
+
+# Statuses a subscription never leaves on its own
+TERMINAL = ('expired', 'cancelled')
+
+# Columns copied to the archive, the same in both tables
+COLUMNS = [field.attname for field in UserSubscription._meta.concrete_fields]
+
+
+def get_archive_setting(name):
+    """Return a SUBSCRIPTION_ARCHIVE setting, falling back to the default value"""
+    return getattr(settings, 'SUBSCRIPTION_ARCHIVE', {}).get(name, DEFAULTS[name])
+
+
+def archivable(cutoff=None):
+    """Subscriptions in a terminal state not updated since ``cutoff`` (default: the retention window)"""
+    if cutoff is None:
+        cutoff = timezone.now() - timedelta(days=get_archive_setting('RETENTION_DAYS'))
+    return UserSubscription.objects.filter(status__in=TERMINAL, updated_at__lt=cutoff)
+
+
+def archive_batch(cutoff, size, using=None):
+    """Move up to ``size`` archivable subscriptions to the archive in one transaction; return their ids"""
+    using = using or router.db_for_write(UserSubscription)
+    skip_locked = connections[using].features.has_select_for_update_skip_locked
+    with transaction.atomic(using=using):
+        rows = list(
+            archivable(cutoff).using(using).select_for_update(skip_locked=skip_locked).order_by('pk').values(
+                *COLUMNS
+            )[:size]
+        )
+        if not rows:
+            return []
+        now = timezone.now()
+        ArchivedSubscription.objects.using(using).bulk_create(
+            [ArchivedSubscription(archived_at=now, **row) for row in rows]
+        )
+        ids = [row['id'] for row in rows]
+        # A plain DELETE: the subscriptions are moved, not deleted, so no
+        # post_delete (which would close their history) is sent
+        UserSubscription.objects.using(using).filter(pk__in=ids)._raw_delete(using)
+    forget(UserSubscription)
+    return ids
+
+
+def archive_subscriptions(max_batches=None):
+    """
+    Archive subscriptions past the retention window, batch by batch; enqueue
+    a follow-up job if ``max_batches`` were not enough. Return the count.
+    """
+    cutoff = timezone.now() - timedelta(days=get_archive_setting('RETENTION_DAYS'))
+    size = get_archive_setting('BATCH_SIZE')
+    max_batches = max_batches or get_archive_setting('MAX_BATCHES')
+    archived = 0
+    for batch in range(max_batches):
+        if batch:
+            time.sleep(get_archive_setting('PAUSE'))
+        ids = archive_batch(cutoff, size)
+        archived += len(ids)
+        if len(ids) < size:
+            break
+    else:
+        enqueue(archive_subscriptions, key=f'archive-subscriptions:{ids[-1]}')
+        logger.info('Archived %s subscription(s); more remain, continuing in a new job', archived)
+    return archived
+
+
+class CombinedSubscriptions:
+    """
+    Current and archived subscriptions, newest first, for pagination: the
+    ordering and count run over a UNION of the keys of both tables, and
+    only the rows of the requested slice are loaded.
+    """
+
+    def __init__(self, current, archived):
+        self.current = current
+        self.archived = archived
+        keys = [
+            queryset.order_by().annotate(archived=Value(flag, output_field=BooleanField())).values_list(
+                'created_at', 'id', 'archived'
+            )
+            for queryset, flag in ((current, False), (archived, True))
+        ]
+        self.keys = keys[0].union(keys[1], all=True).order_by('-created_at', '-id')
+
+    def count(self):
+        return self.keys.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        keys = list(self.keys[index])
+        current = self.current.in_bulk([pk for _, pk, flag in keys if not flag])
+        archived = self.archived.in_bulk([pk for _, pk, flag in keys if flag])
+        # Rows archived or deleted since the keys were read are left out
+        rows = [(archived if flag else current).get(pk) for _, pk, flag in keys]
+        return [row for row in rows if row is not None]
+
+
+def iter_subscriptions(include_current=True, include_archived=True, chunk_size=2000, **filters):
+    """Yield ``(row, archived)`` for the subscriptions of both tables matching ``filters``, a chunk at a time"""
+    if include_current:
+        for row in UserSubscription.objects.filter(**filters).order_by('pk').values(*COLUMNS).iterator(chunk_size):
+            yield row, False
+    if include_archived:
+        for row in ArchivedSubscription.objects.filter(**filters).order_by('pk').values(*COLUMNS).iterator(chunk_size):
+            yield row, True
@@ -0,0 +1,107 @@
+"""
+In-process catalog of subscription plans.
+
+There are only a handful of plans and they change rarely, but entitlement
+checks read one on every call, so each worker keeps them all in memory.
+Saving or deleting a plan clears the catalog of every worker through the
+invalidation bus (see invalidation.bus); ``PLAN_CATALOG['TTL']`` bounds
+staleness should an event be missed. Expired catalogs are refreshed in the
+background, so a slow or unreachable database does not hold up readers.
+Loads are single-flight (see medhashaala.coalescing): when the catalog is
+missing, after a deploy or an invalidation, one query per worker reloads it
+for every waiting request, and readers that must wait for it share one load
+between all workers through the ``SINGLE_FLIGHT`` cache.
+
+Catalog plans are shared between threads: treat them as read-only.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+
+from invalidation.bus import track
+from medhashaala.coalescing import forget, single_flight
+from medhashaala.resilience import UNAVAILABLE, database_breaker, refresh_later
+from .models import SubscriptionPlan
+
+DEFAULTS = {
+    'TTL': 60,
+    'MAX_STALE': 3600,
+}
+
+_lock = threading.Lock()
+# (plans by id, monotonic load time) once loaded
+_catalog = None
+# Bumped by every clear, so that a load that read the old rows is dropped
+_generation = 0
+
+
+def get_catalog_setting(name):
+    """Return a PLAN_CATALOG setting, falling back to the default value"""
+    return getattr(settings, 'PLAN_CATALOG', {}).get(name, DEFAULTS[name])
+
+
+def _read():
+    with database_breaker.guard():
+        return {plan.pk: plan for plan in SubscriptionPlan.objects.all()}
+
+
+def _load(shared=False):
+    global _catalog
+    generation = _generation
+    plans = single_flight('plan-catalog', _read, shared=shared)
+    with _lock:
+        if generation == _generation:
+            _catalog = (plans, time.monotonic())
+    return plans
+
+
+def load_plan_catalog():
+    """Load every plan from the database; return the number of plans"""
+    return len(_load(shared=True))
+
+
+def get_plans():
+    """
+    Return all plans by id. Once the catalog is older than ``TTL`` it is
+    reloaded in the background and the old plans are returned meanwhile, for
+    up to ``MAX_STALE`` seconds; only then do readers wait for the database.
+    """
+    catalog = _catalog
+    if catalog is None:
+        return _load(shared=True)
+    age = time.monotonic() - catalog[1]
+    if age > get_catalog_setting('TTL'):
+        if age > get_catalog_setting('MAX_STALE'):
+            return _load(shared=True)
+        refresh_later('plan-catalog', _load)
+    return catalog[0]
+
+
+def get_plan(plan_id):
+    """Return a plan by id, or None if it does not exist or cannot be loaded now"""
+    try:
+        plan = get_plans().get(plan_id)
+        if plan is None:
+            # Possibly created by another worker since the catalog was loaded
+            plan = _load().get(plan_id)
+    except UNAVAILABLE:
+        return None
+    return plan
+
+
+def clear_plan_catalog():
+    """Forget the loaded plans; the next read reloads them"""
+    global _catalog, _generation
+    with _lock:
+        _catalog = None
+        _generation += 1
+    forget('plan-catalog')
+
+
+def _plan_changed(key):
+    clear_plan_catalog()
+
+
+track(SubscriptionPlan, _plan_changed)
@@ -0,0 +1,92 @@
+"""
+Background deletion of subscription plans.
+
+Deleting a plan used to cascade to every subscription of it in the
+request's transaction. ``start_plan_deletion`` now deactivates the plan,
+so that nobody can subscribe to it any more, and enqueues ``delete_plan``,
+which works through its dependents in chunks (see ``jobs.chunks``):
+
+1. users whose ``subscription_plan`` it is are moved to the replacement
+   plan, or left without one, publishing the invalidations;
+2. its subscriptions, current and archived, are moved to the replacement
+   plan or deleted, publishing the invalidations and recording the history;
+3. the history intervals keep their ``plan_name`` and lose the reference;
+4. the plan itself is deleted.
+
+A job is keyed by its plan, so deleting a plan twice returns the same job,
+unless that job failed: then a new one is enqueued.
+"""
+
+from django.contrib.auth import get_user_model
+from django.db import router, transaction
+
+from invalidation.bus import publish_rows
+from jobs.chunks import first_chunk, raw_delete, run_in_chunks
+from jobs.queue import enqueue
+from .history import record, update_recorded
+from .models import ArchivedSubscription, SubscriptionInterval, SubscriptionPlan, UserSubscription
+
+
+def start_plan_deletion(plan, reassign_to=None):
+    """Deactivate ``plan`` and enqueue its deletion; return the job"""
+    with transaction.atomic():
+        if plan.is_active:
+            plan.is_active = False
+            plan.save(update_fields=['is_active', 'updated_at'])
+        return enqueue(
+            delete_plan, [plan.pk], {'reassign_to': reassign_to.pk if reassign_to else None},
+            key=f'delete-plan:{plan.pk}',
+        )
+
+
+def delete_plan(plan_id, reassign_to=None):
+    """Move or delete the dependents of a plan chunk by chunk, then the plan; return the progress"""
+    plan = SubscriptionPlan.objects.filter(pk=plan_id).first()
+    if plan is None:
+        return {'step': 'finished', 'done': {}}
+    using = router.db_for_write(UserSubscription)
+
+    def users(size):
+        with transaction.atomic(using=using):
+            pks = first_chunk(get_user_model().objects.filter(subscription_plan=plan_id), size)
+            chunk = get_user_model().objects.filter(pk__in=pks)
+            publish_rows(chunk)
+            chunk.update(subscription_plan_id=reassign_to)
+        return len(pks)
+
+    def subscriptions(size):
+        with transaction.atomic(using=using):
+            pks = first_chunk(UserSubscription.objects.select_for_update().filter(plan=plan_id), size)
+            chunk = UserSubscription.objects.filter(pk__in=pks)
+            publish_rows(chunk, 'user_id')
+            if reassign_to:
+                update_recorded(chunk, plan_id=reassign_to)
+            else:
+                raw_delete(UserSubscription, pks, using)
+                record(pks, using=using)
+        return len(pks)
+
+    def archived_subscriptions(size):
+        with transaction.atomic(using=using):
+            pks = first_chunk(ArchivedSubscription.objects.filter(plan=plan_id), size)
+            if reassign_to:
+                ArchivedSubscription.objects.filter(pk__in=pks).update(plan_id=reassign_to)
+            else:
+                raw_delete(ArchivedSubscription, pks, using)
+        return len(pks)
+
+    def history(size):
+        with transaction.atomic(using=using):
+            pks = first_chunk(SubscriptionInterval.objects.filter(plan=plan_id), size)
+            SubscriptionInterval.objects.filter(pk__in=pks).update(plan=None)
+        return len(pks)
+
+    return run_in_chunks(
+        [
+            ('users', users),
+            ('subscriptions', subscriptions),
+            ('archived_subscriptions', archived_subscriptions),
+            ('history', history),
+        ],
+        finish=plan.delete,
+    )
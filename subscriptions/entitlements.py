@@ -0,0 +1,118 @@
+"""
+Entitlement snapshots with stale-while-revalidate.
+
+Feature checks and ``my_subscription`` read the user's active subscription
+(the ``SUBSCRIPTION_READ`` columns) from a per-worker snapshot. A snapshot
+younger than ``ENTITLEMENTS['FRESH']`` seconds is used as is; an older one
+is still answered while a background refresh reloads it, up to
+``MAX_STALE`` seconds. Beyond that, and for users without a snapshot, the
+reader loads it from the database, once per user at a time: concurrent
+readers of a missing snapshot share one query (see medhashaala.coalescing).
+A change to a user's subscriptions evicts their snapshot, and a plan change
+all of them, on every worker (see invalidation.bus).
+
+Loads go through ``database_breaker``. While the database is unreachable
+they fail fast, and readers keep answering from the last known good
+snapshot until it is ``MAX_STALE`` seconds old.
+"""
+
+import threading
+import time
+from operator import attrgetter
+
+from django.conf import settings
+from django.utils import timezone
+
+from invalidation.bus import subscribe, track
+from medhashaala.coalescing import forget, single_flight
+from medhashaala.resilience import database_breaker, refresh_later
+from .models import SubscriptionPlan, UserSubscription
+from .queries import ACTIVE_SUBSCRIPTION_ROW
+
+DEFAULTS = {
+    'FRESH': 30,
+    'MAX_STALE': 900,
+    'MAX_ENTRIES': 50000,
+}
+
+_lock = threading.Lock()
+# str(user id) -> (values() row of the active subscription or None, monotonic load time)
+_snapshots = {}
+# Bumped by every eviction, so that a load that read the old rows is dropped
+_generation = 0
+
+
+def get_entitlement_setting(name):
+    """Return an ENTITLEMENTS setting, falling back to the default value"""
+    return getattr(settings, 'ENTITLEMENTS', {}).get(name, DEFAULTS[name])
+
+
+def _read(user_id):
+    with database_breaker.guard():
+        return ACTIVE_SUBSCRIPTION_ROW.first(user_id=user_id)
+
+
+def _load(user_id):
+    generation = _generation
+    row = single_flight(f'entitlement:{user_id}', lambda: _read(user_id))
+    with _lock:
+        if generation == _generation:
+            if len(_snapshots) >= get_entitlement_setting('MAX_ENTRIES'):
+                _snapshots.clear()
+            _snapshots[str(user_id)] = (row, time.monotonic())
+    return row
+
+
+def get_entitlement(user_id):
+    """
+    Return the ``values()`` row (``SUBSCRIPTION_READ.columns``) of the user's
+    active subscription, or None. Raises an ``UNAVAILABLE`` error when the
+    database cannot answer and there is no usable snapshot.
+    """
+    snapshot = _snapshots.get(str(user_id))
+    if snapshot is not None:
+        age = time.monotonic() - snapshot[1]
+        if age <= get_entitlement_setting('FRESH'):
+            return snapshot[0]
+        if age <= get_entitlement_setting('MAX_STALE'):
+            refresh_later(f'entitlement:{user_id}', lambda: _load(user_id))
+            return snapshot[0]
+    return _load(user_id)
+
+
+def is_active(row, now=None):
+    """Return ``UserSubscription.is_active`` for an entitlement row"""
+    if row is None or row['status'] != 'active':
+        return False
+    return row['end_date'] is None or (now or timezone.now()) <= row['end_date']
+
+
+def remaining_days(row, now=None):
+    """Return ``UserSubscription.get_remaining_days()`` for an entitlement row"""
+    if row is None or row['end_date'] is None:
+        return None
+    return max(0, (row['end_date'] - (now or timezone.now())).days)
+
+
+def evict(user_id=None):
+    """Forget the snapshot of a user, or of everyone"""
+    global _generation
+    with _lock:
+        _generation += 1
+        if user_id is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(str(user_id), None)
+    if user_id is None:
+        forget(prefix='entitlement:')
+    else:
+        forget(f'entitlement:{user_id}')
+
+
+def _plan_changed(plan_id):
+    # Snapshots embed the plan's fields
+    evict()
+
+
+track(UserSubscription, evict, key=attrgetter('user_id'))
+subscribe(SubscriptionPlan._meta.label_lower, _plan_changed)
@@ -0,0 +1,145 @@
+"""
+Append-only subscription history.
+
+``UserSubscription`` rows hold the current state only. Every transition
+(create, ``cancel``/``expire``/``renew``, any ``save()`` that changes
+``HISTORY_FIELDS``, the admin bulk actions, ``expire_subscriptions`` and
+deletion) also closes the open
+``SubscriptionInterval`` of the subscription and appends one for the new
+state, in the writer's transaction. Bulk updates go through
+``update_recorded``, which records the rows it changed.
+
+The history answers questions about the past without guessing from
+``updated_at``: ``plan_at(user, when)``, ``SubscriptionInterval.objects
+.at(when)`` / ``.active_at(when)`` and ``churn(start, end)``.
+
+An exclusion constraint keeps the intervals of a subscription from
+overlapping, and a GiST index on ``(user_id, tstzrange(valid_from,
+valid_to))`` serves the time-travel queries (see ``SubscriptionInterval``;
+the migration creates the ``btree_gist`` extension they need).
+"""
+
+from django.db import router, transaction
+from django.db.models.signals import post_delete
+from django.utils import timezone
+
+from .models import SubscriptionInterval, UserSubscription
+
+# Subscriptions recorded per batch of queries
+RECORD_BATCH = 500
+
+# Columns of UserSubscription copied into the history
+STATE = UserSubscription.HISTORY_FIELDS
+
+
+def record(subscription_ids, at=None, using=None):
+    """
+    Append the current state of the given subscriptions to their history,
+    closing their open intervals; deleted subscriptions only get theirs
+    closed. Unchanged subscriptions are left alone. Call it in the
+    transaction that made the change. Return the number of intervals added.
+    """
+    at = at or timezone.now()
+    using = using or router.db_for_write(SubscriptionInterval)
+    subscription_ids = list(subscription_ids)
+    added = 0
+    with transaction.atomic(using=using):
+        for start in range(0, len(subscription_ids), RECORD_BATCH):
+            added += _record_batch(subscription_ids[start:start + RECORD_BATCH], at, using)
+    return added
+
+
+def _record_batch(subscription_ids, at, using):
+    states = {
+        row['pk']: row
+        for row in UserSubscription.objects.using(using).filter(pk__in=subscription_ids).values(
+            'pk', *STATE, 'plan__name'
+        )
+    }
+    open_intervals = {
+        interval.subscription_id: interval
+        for interval in SubscriptionInterval.objects.using(using).select_for_update().current().filter(
+            subscription_id__in=subscription_ids
+        )
+    }
+    closed = []
+    added = []
+    for subscription_id in subscription_ids:
+        state = states.get(subscription_id)
+        interval = open_intervals.get(subscription_id)
+        if interval is not None and state is not None and all(getattr(interval, name) == state[name] for name in STATE):
+            continue
+        valid_from = at
+        if interval is not None:
+            # Never before the interval it follows, whatever the clocks of the workers say
+            valid_from = max(at, interval.valid_from)
+            interval.valid_to = valid_from
+            closed.append(interval)
+        if state is not None:
+            added.append(SubscriptionInterval(
+                subscription_id=subscription_id, plan_name=state['plan__name'], valid_from=valid_from,
+                **{name: state[name] for name in STATE}
+            ))
+    if closed:
+        SubscriptionInterval.objects.using(using).bulk_update(closed, ['valid_to'])
+    if added:
+        SubscriptionInterval.objects.using(using).bulk_create(added)
+    return len(added)
+
+
+def update_recorded(queryset, **changes):
+    """``queryset.update(**changes)``, recording the changed subscriptions; return the number updated"""
+    with transaction.atomic(using=queryset.db):
+        subscription_ids = list(queryset.values_list('pk', flat=True))
+        updated = UserSubscription.objects.using(queryset.db).filter(pk__in=subscription_ids).update(**changes)
+        record(subscription_ids, using=queryset.db)
+    return updated
+
+
+def backfill(at=None, using=None):
+    """Open an interval for every subscription without history (e.g. bulk-loaded ones); return how many"""
+    using = using or router.db_for_write(SubscriptionInterval)
+    missing = UserSubscription.objects.using(using).exclude(
+        pk__in=SubscriptionInterval.objects.using(using).values('subscription_id')
+    ).values_list('pk', flat=True)
+    return record(missing.iterator(), at=at, using=using)
+
+
+def history_of(user_id):
+    """Return every interval of a user's subscriptions, oldest first"""
+    return SubscriptionInterval.objects.filter(user_id=user_id)
+
+
+def plan_at(user_id, when):
+    """Return the name of the plan the user had at ``when``, or None if they had no active subscription"""
+    return SubscriptionInterval.objects.active_at(when).filter(user_id=user_id).values_list(
+        'plan_name', flat=True
+    ).first()
+
+
+def churn(start, end):
+    """
+    Return the users with an active subscription at ``start``, how many of
+    them had none at ``end``, and that share.
+    """
+    intervals = SubscriptionInterval.objects.all()
+    active_at_start = intervals.active_at(start).values('user_id')
+    retained = intervals.active_at(end).values('user_id')
+    users = active_at_start.distinct().count()
+    churned = active_at_start.exclude(user_id__in=retained).distinct().count()
+    return {
+        'start': start,
+        'end': end,
+        'active_at_start': users,
+        'churned': churned,
+        'churn_rate': churned / users if users else 0.0,
+    }
+
+
+def _subscription_deleted(sender, instance, using, **kwargs):
+    # Sent inside the deletion's transaction
+    record([instance.pk], using=using)
+
+
+post_delete.connect(_subscription_deleted, sender=UserSubscription, dispatch_uid='subscriptions.history.delete')
+
@@ -0,0 +1,67 @@
+"""
+Subscription lifecycle jobs, run by the ``run_jobs`` workers.
+
+``expire_subscriptions`` and ``send_renewal_reminders`` are scheduled in
+``JOBS['PERIODIC']``; the latter enqueues one ``send_renewal_reminder`` job
+per expiring subscription, keyed by subscription and end date so that each
+user is reminded once per term.
+"""
+
+import logging
+
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from invalidation.bus import publish_rows
+from jobs.queue import enqueue
+from .history import update_recorded
+from .models import UserSubscription
+
+logger = logging.getLogger(__name__)
+
+
+def expire_subscriptions():
+    """Mark active subscriptions past their end date as expired; return the count"""
+    now = timezone.now()
+    lapsed = UserSubscription.objects.filter(status='active', end_date__lt=now)
+    # unique_together ('user', 'status') allows one expired subscription per user
+    already_expired = UserSubscription.objects.filter(user=OuterRef('user'), status='expired')
+    expiring = lapsed.exclude(Exists(already_expired))
+    with transaction.atomic():
+        publish_rows(expiring, 'user_id')
+        expired = update_recorded(expiring, status='expired', updated_at=now)
+    skipped = lapsed.count()
+    if skipped:
+        logger.warning('%s lapsed subscription(s) not expired: the user already has an expired one', skipped)
+    return expired
+
+
+def send_renewal_reminders(days=7):
+    """Enqueue a reminder for every subscription ending within ``days``; return the count"""
+    count = 0
+    for pk, end_date in UserSubscription.objects.expiring_within(days).values_list('pk', 'end_date'):
+        enqueue(send_renewal_reminder, [pk], key=f'renewal-reminder:{pk}:{end_date:%Y%m%d}')
+        count += 1
+    return count
+
+
+def send_renewal_reminder(subscription_id):
+    """Email the owner of a subscription that is about to end"""
+    subscription = UserSubscription.objects.select_related('user', 'plan').filter(pk=subscription_id).first()
+    if subscription is None or not subscription.is_active or subscription.end_date is None:
+        # Renewed without an end date, cancelled or deleted since it was enqueued
+        return 'skipped'
+    user = subscription.user
+    if not user.email:
+        return 'no email'
+    send_mail(
+        f'Your {subscription.plan.name} subscription ends soon',
+        f'Hello {user.name or user.email},\n\n'
+        f'Your {subscription.plan.name} subscription ends on {subscription.end_date:%d %B %Y}. '
+        f'Renew it to keep access to your features.',
+        None,
+        [user.email],
+    )
+    return 'sent'
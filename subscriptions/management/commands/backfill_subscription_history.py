@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from subscriptions.history import backfill
+
+
+class Command(BaseCommand):
+    help = 'Open a history interval for every subscription without one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias (default: default)')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        added = backfill(using=using)
+        self.stdout.write(self.style.SUCCESS(f'Opened {added} history interval(s)'))
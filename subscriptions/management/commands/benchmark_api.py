@@ -0,0 +1,116 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from medhashaala.benchmark import (
+    BenchmarkRunner, HttpTransport, InProcessTransport, build_report, find_regressions, temporary_database
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the api.http request flows in-process or against a running server'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode', choices=['inprocess', 'http'], default='inprocess',
+            help='Drive the flows through the test client or over HTTP (default: inprocess)'
+        )
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server to benchmark in http mode')
+        parser.add_argument('--admin-email', help='Staff account used in http mode')
+        parser.add_argument('--admin-password', help='Password of the staff account used in http mode')
+        parser.add_argument('--concurrency', type=int, default=4, help='Concurrent client threads (default: 4)')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per endpoint (default: 50)')
+        parser.add_argument(
+            '--fast-passwords', action='store_true',
+            help='Use a cheap password hasher in inprocess mode to focus on the rest of the stack'
+        )
+        parser.add_argument('--output', help='Where to write the JSON report (default: benchmarks/results/)')
+        parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Allowed p95/throughput regression against the baseline as a fraction (default: 0.2)'
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be positive')
+
+        if options['mode'] == 'http':
+            if not options['admin_email'] or not options['admin_password']:
+                raise CommandError('http mode needs --admin-email and --admin-password')
+            runner = BenchmarkRunner(
+                lambda: HttpTransport(options['base_url']),
+                options['admin_email'], options['admin_password'],
+                concurrency=options['concurrency'], requests=options['requests'],
+            )
+            results = runner.run()
+        else:
+            results = self.run_in_process(options)
+
+        report = build_report(results, options['mode'], options['concurrency'], options['requests'])
+        self.print_report(report)
+
+        output = Path(options['output'] or Path(settings.BASE_DIR, 'benchmarks', 'results',
+                                                f"{report['meta']['commit']}-{options['mode']}.json"))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+        self.stdout.write(f'Report written to {output}')
+
+        if options['baseline']:
+            baseline = json.loads(Path(options['baseline']).read_text())
+            regressions = find_regressions(report, baseline, options['threshold'])
+            if regressions:
+                for regression in regressions:
+                    self.stdout.write(self.style.ERROR(regression))
+                raise CommandError(
+                    f'{len(regressions)} regression(s) above {options["threshold"]:.0%} '
+                    f'compared to {baseline["meta"]["commit"]}'
+                )
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def run_in_process(self, options):
+        """Run the flows against a throw-away test database"""
+        from django.test.utils import override_settings
+        from subscriptions.models import SubscriptionPlan
+        from django.contrib.auth import get_user_model
+
+        hashers = ['django.contrib.auth.hashers.MD5PasswordHasher'] if options['fast_passwords'] else settings.PASSWORD_HASHERS
+        # Keep the throttle in the measured path, but never refuse a request
+        unthrottled = '1000000/min'
+        rate_limits = {
+            **getattr(settings, 'RATE_LIMITS', {}),
+            'ANON': unthrottled, 'DEFAULT': unthrottled, 'ROLES': {}, 'FEATURES': {}, 'PLANS': {},
+        }
+        with temporary_database():
+            with override_settings(PASSWORD_HASHERS=hashers, RATE_LIMITS=rate_limits):
+                SubscriptionPlan.objects.create(
+                    name='Basic', features=['basic_access', 'limited_queries'], price='9.99', is_active=True
+                )
+                get_user_model().objects.create_superuser(
+                    email='bench-admin@example.com', name='Benchmark Admin', password='bench-admin-password'
+                )
+                runner = BenchmarkRunner(
+                    InProcessTransport,
+                    'bench-admin@example.com', 'bench-admin-password',
+                    concurrency=options['concurrency'], requests=options['requests'],
+                )
+                return runner.run()
+
+    def print_report(self, report):
+        meta = report['meta']
+        self.stdout.write(
+            f"Commit {meta['commit']} | mode {meta['mode']} | "
+            f"concurrency {meta['concurrency']} | {meta['requests']} requests per endpoint"
+        )
+        self.stdout.write('=' * 96)
+        self.stdout.write(
+            f"{'endpoint':36} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8}"
+        )
+        for name, result in report['endpoints'].items():
+            line = (
+                f"{name:36} {result['throughput_rps']:9.1f} {result['p50_ms']:9.2f} "
+                f"{result['p95_ms']:9.2f} {result['p99_ms']:9.2f} {result['errors']:8d}"
+            )
+            self.stdout.write(self.style.ERROR(line) if result['errors'] else line)
@@ -0,0 +1,64 @@
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from medhashaala.benchmark import temporary_database
+
+
+class Command(BaseCommand):
+    help = 'Compare the precompiled hot queries with the same lookups through the ORM, per call'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=2000, help='Lookups per round (default: 2000)')
+        parser.add_argument('--rounds', type=int, default=5, help='Rounds per variant; the fastest is reported (default: 5)')
+
+    def handle(self, *args, **options):
+        if options['calls'] < 1 or options['rounds'] < 1:
+            raise CommandError('--calls and --rounds must be positive')
+
+        with temporary_database():
+            call_command('seed_load_data', users=50, stdout=StringIO())
+            results = self.run(options['calls'], options['rounds'])
+
+        self.stdout.write(f"{options['calls']} lookups, best of {options['rounds']} rounds")
+        self.stdout.write(f"{'query':24} {'orm us':>9} {'prepared us':>12} {'speedup':>9}")
+        for name, (orm, prepared) in results.items():
+            self.stdout.write(f'{name:24} {orm:9.1f} {prepared:12.1f} {orm / prepared:8.1f}x')
+
+    def run(self, calls, rounds):
+        from accounts.queries import USER_BY_EMAIL, USER_BY_PHONE
+        from subscriptions.models import UserSubscription
+        from subscriptions.queries import ACTIVE_SUBSCRIPTION, ACTIVE_SUBSCRIPTION_ROW, PLAN_BY_ID
+
+        subscription = UserSubscription.objects.filter(status='active').select_related('user').first()
+        if subscription is None:
+            raise CommandError('The seeded data has no active subscription')
+        user = subscription.user
+        queries = {
+            'user by email': (USER_BY_EMAIL, {'email': user.email}),
+            'user by phone': (USER_BY_PHONE, {'phone': user.phone}),
+            'active subscription': (ACTIVE_SUBSCRIPTION, {'user_id': user.pk}),
+            'active subscription row': (ACTIVE_SUBSCRIPTION_ROW, {'user_id': user.pk}),
+            'plan by id': (PLAN_BY_ID, {'plan_id': subscription.plan_id}),
+        }
+
+        def best(function):
+            timings = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                for _ in range(calls):
+                    function()
+                timings.append(time.perf_counter() - started)
+            return min(timings) / calls * 1e6
+
+        results = {}
+        for name, (query, values) in queries.items():
+            if query.execute(**values) != list(query.queryset(**values)) or not query.execute(**values):
+                raise CommandError(f'{name}: the prepared query does not match the ORM')
+            results[name] = (
+                best(lambda: list(query.queryset(**values))),
+                best(lambda: query.execute(**values)),
+            )
+        return results
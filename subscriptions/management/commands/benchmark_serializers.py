@@ -0,0 +1,63 @@
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from medhashaala.benchmark import temporary_database
+
+
+class Command(BaseCommand):
+    help = 'Compare UserSubscriptionReadSerializer with its projection-based fast read path, per object'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=2000, help='Subscriptions rendered per round (default: 2000)')
+        parser.add_argument('--rounds', type=int, default=5, help='Rounds per variant; the fastest is reported (default: 5)')
+
+    def handle(self, *args, **options):
+        if options['objects'] < 1 or options['rounds'] < 1:
+            raise CommandError('--objects and --rounds must be positive')
+
+        with temporary_database():
+            # About 1.5 subscriptions per generated user
+            call_command('seed_load_data', users=options['objects'], stdout=StringIO())
+            results = self.run(options['objects'], options['rounds'])
+
+        self.stdout.write(f"{options['objects']} subscriptions, best of {options['rounds']} rounds")
+        self.stdout.write(f"{'variant':34} {'us/object':>10} {'speedup':>9}")
+        for name, (serializer, projection) in results.items():
+            self.stdout.write(f'{name + " (serializer)":34} {serializer:10.2f}')
+            self.stdout.write(f'{name + " (projection)":34} {projection:10.2f} {serializer / projection:8.1f}x')
+
+    def run(self, count, rounds):
+        from subscriptions.models import UserSubscription
+        from subscriptions.projections import SUBSCRIPTION_READ
+        from subscriptions.serializers import UserSubscriptionReadSerializer
+
+        queryset = UserSubscription.objects.all()[:count]
+        count = queryset.count()
+        instances = list(queryset.select_related('plan'))
+        rows = list(queryset.values(*SUBSCRIPTION_READ.columns))
+
+        expected = UserSubscriptionReadSerializer(instances, many=True).data
+        if [dict(item, plan=dict(item['plan'])) for item in expected] != SUBSCRIPTION_READ.render_many(queryset):
+            raise CommandError('The projection does not match the serializer output')
+
+        def best(function):
+            timings = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                function()
+                timings.append(time.perf_counter() - started)
+            return min(timings) / count * 1e6
+
+        return {
+            'render': (
+                best(lambda: UserSubscriptionReadSerializer(instances, many=True).data),
+                best(lambda: SUBSCRIPTION_READ.render_rows(rows)),
+            ),
+            'fetch + render': (
+                best(lambda: UserSubscriptionReadSerializer(queryset.select_related('plan'), many=True).data),
+                best(lambda: SUBSCRIPTION_READ.render_many(queryset)),
+            ),
+        }
@@ -0,0 +1,44 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from subscriptions.archive import COLUMNS, iter_subscriptions
+
+
+class Command(BaseCommand):
+    help = 'Export subscriptions as CSV, reading the current and the archived ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--archived', choices=['include', 'exclude', 'only'], default='include',
+            help='Whether to export archived subscriptions (default: include)'
+        )
+        parser.add_argument('--status', help='Only subscriptions with this status')
+        parser.add_argument('--user', help='Only the subscriptions of this user id')
+        parser.add_argument('--output', help='File to write (default: standard output)')
+
+    def handle(self, *args, **options):
+        filters = {}
+        if options['status']:
+            filters['status'] = options['status']
+        if options['user']:
+            filters['user_id'] = options['user']
+        rows = iter_subscriptions(
+            include_current=options['archived'] != 'only',
+            include_archived=options['archived'] != 'exclude',
+            **filters
+        )
+
+        output = open(options['output'], 'w', newline='') if options['output'] else self.stdout
+        try:
+            writer = csv.writer(output)
+            writer.writerow([*COLUMNS, 'archived'])
+            count = 0
+            for row, archived in rows:
+                writer.writerow([*(row[name] for name in COLUMNS), archived])
+                count += 1
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Exported {count} subscription(s) to {options['output']}"))
@@ -0,0 +1,34 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medhashaala.schema import artifact_path, generate_schema, write_schema_artifact
+
+
+class Command(BaseCommand):
+    help = 'Build the OpenAPI schema artifact served at /api/schema/, or check that it is up to date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='Artifact path (default: OPENAPI_SCHEMA["ARTIFACT"])')
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Fail if the artifact is missing or differs from a freshly generated schema'
+        )
+
+    def handle(self, *args, **options):
+        path = options['file'] or artifact_path()
+
+        if options['check']:
+            try:
+                current = Path(path).read_bytes()
+            except FileNotFoundError:
+                raise CommandError(f'OpenAPI schema artifact {path} does not exist')
+            if current != generate_schema():
+                raise CommandError(
+                    f'OpenAPI schema artifact {path} is stale; run "python manage.py openapi_schema"'
+                )
+            self.stdout.write(self.style.SUCCESS(f'OpenAPI schema artifact {path} is up to date'))
+            return
+
+        path = write_schema_artifact(path)
+        self.stdout.write(self.style.SUCCESS(f'Wrote OpenAPI schema to {path}'))
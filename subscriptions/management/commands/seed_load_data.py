@@ -0,0 +1,198 @@
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from subscriptions.models import SubscriptionPlan, UserSubscription
+
+User = get_user_model()
+
+LOAD_DOMAIN = 'load.medhashaala.test'
+
+FIRST_NAMES = [
+    'Aarav', 'Aditi', 'Arjun', 'Ananya', 'Dev', 'Diya', 'Ishaan', 'Kavya', 'Krishna', 'Meera',
+    'Neha', 'Nikhil', 'Pooja', 'Rahul', 'Riya', 'Rohan', 'Saanvi', 'Sai', 'Tanvi', 'Vihaan',
+]
+LAST_NAMES = [
+    'Agarwal', 'Bhat', 'Chopra', 'Das', 'Gupta', 'Iyer', 'Joshi', 'Kapoor', 'Kumar', 'Menon',
+    'Nair', 'Patel', 'Rao', 'Reddy', 'Shah', 'Sharma', 'Singh', 'Varma', 'Verma', 'Yadav',
+]
+
+PLANS = [
+    {'name': 'Basic', 'features': ['basic_access', 'limited_queries'], 'price': Decimal('0.00')},
+    {'name': 'Standard', 'features': ['basic_access', 'standard_queries', 'priority_support'],
+     'price': Decimal('9.99')},
+    {'name': 'Premium', 'features': ['basic_access', 'unlimited_queries', 'priority_support', 'advanced_features'],
+     'price': Decimal('19.99')},
+]
+
+
+@contextmanager
+def keep_explicit_timestamps(model):
+    """Let bulk_create store the generated auto_now/auto_now_add values"""
+    fields = [f for f in model._meta.concrete_fields if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic users and subscription histories for benchmarks and index work'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, required=True, help='Number of users to generate')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Users written per batch (default: 10000)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--start', type=int, default=0, help='Index of the first user, to append to earlier runs')
+        parser.add_argument('--password', default='loadtest-password', help='Password of every generated user')
+        parser.add_argument('--clear', action='store_true', help=f'Delete previously generated @{LOAD_DOMAIN} users first')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--users and --batch-size must be positive')
+
+        if options['clear']:
+            deleted, _ = User.objects.filter(email__endswith=f'@{LOAD_DOMAIN}').delete()
+            self.stdout.write(f'Deleted {deleted} previously generated rows')
+
+        plans = []
+        for plan_data in PLANS:
+            plan, _ = SubscriptionPlan.objects.get_or_create(
+                name=plan_data['name'],
+                defaults={**plan_data, 'is_active': True}
+            )
+            plans.append(plan)
+
+        use_copy = connection.vendor == 'postgresql'
+        self.stdout.write(
+            f"Generating {options['users']} users with seed {options['seed']} "
+            f"using {'COPY' if use_copy else 'bulk_create'}..."
+        )
+
+        namespace = uuid.uuid5(uuid.NAMESPACE_DNS, f"{options['seed']}.{LOAD_DOMAIN}")
+        now = timezone.now()
+        started = time.monotonic()
+        total_users = total_subscriptions = 0
+        end = options['start'] + options['users']
+
+        for batch_start in range(options['start'], end, options['batch_size']):
+            batch_end = min(batch_start + options['batch_size'], end)
+            # Hashing is the slowest step by far, so a batch shares one hash
+            password = make_password(options['password'])
+            rng = random.Random(f"{options['seed']}:{batch_start}")
+            users, subscriptions = self.generate_batch(
+                rng, namespace, range(batch_start, batch_end), plans, password, now
+            )
+
+            with transaction.atomic():
+                if use_copy:
+                    self.copy_rows(User, users)
+                    self.copy_rows(UserSubscription, subscriptions)
+                else:
+                    with keep_explicit_timestamps(User):
+                        User.objects.bulk_create([User(**row) for row in users])
+                    with keep_explicit_timestamps(UserSubscription):
+                        UserSubscription.objects.bulk_create(
+                            [UserSubscription(**row) for row in subscriptions]
+                        )
+
+            total_users += len(users)
+            total_subscriptions += len(subscriptions)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'{total_users} users, {total_subscriptions} subscriptions '
+                f'({(total_users + total_subscriptions) / elapsed:,.0f} rows/s)'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {total_users} users and {total_subscriptions} subscriptions '
+            f'in {time.monotonic() - started:.1f}s'
+        ))
+
+    def generate_batch(self, rng, namespace, indexes, plans, password, now):
+        """Return the user and subscription rows of one batch as field dicts"""
+        users = []
+        subscriptions = []
+        weights = [0.5, 0.3, 0.2]
+        for index in indexes:
+            first = rng.choice(FIRST_NAMES)
+            last = rng.choice(LAST_NAMES)
+            user_id = uuid.uuid5(namespace, str(index))
+            joined = now - timedelta(days=rng.uniform(1, 3 * 365))
+
+            # At most one subscription per status (unique user/status pair)
+            history = []
+            cursor = joined
+            for status in ('expired', 'cancelled'):
+                if rng.random() < (0.5 if status == 'expired' else 0.25):
+                    start = cursor + timedelta(days=rng.uniform(0, 30))
+                    length = timedelta(days=rng.choice([30, 90, 365]))
+                    end = min(start + length, now - timedelta(days=1))
+                    if end <= start:
+                        continue
+                    if status == 'cancelled':
+                        end = start + (end - start) * rng.uniform(0.1, 0.9)
+                    history.append((status, rng.choices(plans, weights)[0], start, end))
+                    cursor = end
+            active_plan = None
+            if rng.random() < 0.7:
+                active_plan = rng.choices(plans, weights)[0]
+                start = max(cursor, now - timedelta(days=rng.uniform(0, 180)))
+                end = None if rng.random() < 0.1 else now + timedelta(days=rng.uniform(1, 365))
+                history.append(('active', active_plan, start, end))
+
+            users.append({
+                'id': user_id,
+                'password': password,
+                'email': f'{first}.{last}.{index}@{LOAD_DOMAIN}'.lower(),
+                'phone': f'+91{9000000000 + index}',
+                'name': f'{first} {last}',
+                'role': 'user',
+                'subscription_plan_id': active_plan.id if active_plan else None,
+                'enabled_features': {},
+                'is_staff': False,
+                'is_active': True,
+                'is_superuser': False,
+                'date_joined': joined,
+                'last_login': None,
+            })
+            for status, plan, start, end in history:
+                subscriptions.append({
+                    'user_id': user_id,
+                    'plan_id': plan.id,
+                    'status': status,
+                    'start_date': start,
+                    'end_date': end,
+                    'created_at': start,
+                    'updated_at': end if end and status != 'active' else start,
+                })
+        return users, subscriptions
+
+    def copy_rows(self, model, rows):
+        """Stream rows into a table with PostgreSQL COPY"""
+        if not rows:
+            return
+        fields = [f for f in model._meta.concrete_fields if f.attname in rows[0]]
+        columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+        sql = f'COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN'
+        # psycopg adapts everything but JSON values natively
+        json_fields = {f.attname for f in fields if f.get_internal_type() == 'JSONField'}
+        with connection.cursor() as cursor:
+            with cursor.cursor.copy(sql) as copy:
+                for row in rows:
+                    copy.write_row([
+                        f.get_db_prep_save(row[f.attname], connection) if f.attname in json_fields else row[f.attname]
+                        for f in fields
+                    ])
@@ -0,0 +1,89 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from medhashaala.startup import parse_importtime, summarize_imports
+
+
+class Command(BaseCommand):
+    help = 'Measure worker startup: import time per package, AppConfig.ready cost and time to first response'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/metrics', help='Path of the first request (default: /metrics)')
+        parser.add_argument('--runs', type=int, default=3, help='Fresh interpreters to start; the median run is reported')
+        parser.add_argument('--top', type=int, default=15, help='Number of packages and imports to list')
+        parser.add_argument('--lean', action='store_true', help='Profile with DJANGO_LEAN_STARTUP=1')
+        parser.add_argument('--compare', action='store_true', help='Profile the default and the lean startup')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be positive')
+
+        modes = [False, True] if options['compare'] else [options['lean']]
+        results = [self.profile(lean, options) for lean in modes]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results if options['compare'] else results[0], indent=2))
+            return
+
+        for result in results:
+            self.report(result)
+        if options['compare']:
+            default, lean = results
+            saved = default['total_ms'] - lean['total_ms']
+            self.stdout.write(self.style.SUCCESS(
+                f"Lean startup: {lean['total_ms']:.1f}ms vs {default['total_ms']:.1f}ms "
+                f"({saved:+.1f}ms saved, {saved / default['total_ms']:.0%})"
+            ))
+
+    def profile(self, lean, options):
+        """Start ``runs`` fresh interpreters and return the median run"""
+        env = {**os.environ, 'DJANGO_LEAN_STARTUP': '1' if lean else '0'}
+        runs = []
+        for _ in range(options['runs']):
+            process = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-m', 'medhashaala.startup', '--path', options['path']],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            if process.returncode != 0:
+                raise CommandError(f'Startup failed:\n{process.stderr[-2000:]}')
+            result = json.loads(process.stdout)
+            result['imports'] = summarize_imports(parse_importtime(process.stderr), options['top'])
+            runs.append(result)
+
+        median = statistics.median_low([run['total_ms'] for run in runs])
+        result = next(run for run in runs if run['total_ms'] == median)
+        result['runs_ms'] = [run['total_ms'] for run in runs]
+        return result
+
+    def report(self, result):
+        imports = result['imports']
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{'Lean' if result['lean'] else 'Default'} startup: {result['total_ms']:.1f}ms "
+            f"to first response (GET {result['path']} -> {result['status']})"
+        ))
+        for name, value in result['phases_ms'].items():
+            self.stdout.write(f'  {name:<16} {value:8.1f}ms')
+
+        self.stdout.write(f"  Imports: {imports['modules']} modules, {imports['total_ms']:.1f}ms")
+        self.stdout.write('  Slowest packages (self time):')
+        for package, value in imports['packages_ms']:
+            self.stdout.write(f'    {package:<40} {value:8.1f}ms')
+        self.stdout.write('  Slowest imports (cumulative):')
+        for module, value in imports['imports_ms']:
+            self.stdout.write(f'    {module:<40} {value:8.1f}ms')
+
+        self.stdout.write('  AppConfig.ready:')
+        for label, value in sorted(result['ready_ms'].items(), key=lambda item: -item[1]):
+            self.stdout.write(f'    {label:<40} {value:8.1f}ms')
+
+        deferred = [module for module, loaded in result['loaded'].items() if not loaded]
+        if deferred:
+            self.stdout.write(f"  Not imported: {', '.join(deferred)}")
+        self.stdout.write('')
@@ -0,0 +1,317 @@
+"""
+Usage metering and quotas.
+
+``record_usage`` only adds to an in-memory counter of the worker; the
+counters are written behind as one batched upsert into ``UsageRecord``
+that adds to the stored monthly count. Each gunicorn worker runs a
+``Flusher`` thread (started by ``post_worker_init``) that flushes every
+``METERING['FLUSH_INTERVAL']`` seconds, busy or idle; ``record_usage``
+also flushes once ``MAX_PENDING`` keys are waiting or an interval passed
+without a flush (in processes without the thread), and ``worker_exit``
+flushes what is left. Counts not yet flushed when a worker is killed are
+lost, so a worker loses at most one interval of usage.
+
+Quotas come from ``METERING['QUOTAS']``: per metric, the limit of the
+first listed feature the user's plan has (None means unlimited, and a plan
+with none of the features gets 0). ``consume`` checks the remaining
+allowance against a per-worker snapshot of the stored count, refreshed
+every ``ALLOWANCE_TTL`` seconds and adjusted by the worker's own usage
+since. Usage of other workers that is unflushed or newer than the
+snapshot is not seen, so a user can overshoot the limit by at most what
+all workers serve them within ``FLUSH_INTERVAL + ALLOWANCE_TTL`` seconds.
+Snapshots of a user are evicted when their subscriptions or any plan change
+(see invalidation.bus).
+
+Views opt in with ``MeteredViewMixin``. None of the plan, subscription and
+account views do, so that an account can be managed whatever its quota;
+it is meant for the query endpoints the plans' ``*_queries`` features are
+sold for, which this service does not serve yet.
+"""
+
+import logging
+import threading
+import time
+from datetime import date
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router
+from django.utils import timezone
+from rest_framework import exceptions
+
+from invalidation.bus import subscribe, track
+from .catalog import get_plan
+from .models import SubscriptionPlan, UsageRecord, UserSubscription
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'FLUSH_INTERVAL': 10,
+    'MAX_PENDING': 10000,
+    'ALLOWANCE_TTL': 30,
+    'QUOTAS': {},
+}
+
+# Rows per upsert statement
+UPSERT_BATCH = 500
+
+# Keys of allowance snapshots kept per worker
+MAX_ALLOWANCES = 50000
+
+_lock = threading.Lock()
+# (user_id, metric, period) -> count not flushed yet
+_pending = {}
+# (user_id, metric, period) -> count recorded by this worker
+_recorded = {}
+# (user_id, metric, period) -> (limit, used, recorded at snapshot, monotonic time)
+_allowances = {}
+_last_flush = time.monotonic()
+_flusher = None
+
+
+class QuotaExceeded(exceptions.APIException):
+    status_code = 429
+    default_detail = 'Usage quota for this billing period exceeded.'
+    default_code = 'quota_exceeded'
+
+
+def get_metering_setting(name):
+    """Return a METERING setting, falling back to the default value"""
+    return getattr(settings, 'METERING', {}).get(name, DEFAULTS[name])
+
+
+def current_period(now=None):
+    """Return the first day of the current (UTC) month"""
+    now = now or timezone.now()
+    return date(now.year, now.month, 1)
+
+
+def next_period(period):
+    """Return the first day of the month after ``period``"""
+    return date(period.year + period.month // 12, period.month % 12 + 1, 1)
+
+
+def plan_limit(plan, metric):
+    """Return the quota of ``metric`` on a plan (None if unlimited)"""
+    quotas = get_metering_setting('QUOTAS').get(metric)
+    if quotas is None:
+        raise ValueError(f'No quota is defined for {metric!r}')
+    features = plan.features if plan and plan.features else []
+    for feature, limit in quotas.items():
+        if feature in features:
+            return limit
+    return 0
+
+
+def record_usage(user_id, metric, amount=1):
+    """Count usage in memory; the counters are flushed to the database every FLUSH_INTERVAL seconds"""
+    if not get_metering_setting('ENABLED'):
+        return
+    key = (user_id, metric, current_period())
+    with _lock:
+        _pending[key] = _pending.get(key, 0) + amount
+        _recorded[key] = _recorded.get(key, 0) + amount
+        due = (
+            len(_pending) >= get_metering_setting('MAX_PENDING')
+            or time.monotonic() - _last_flush >= get_metering_setting('FLUSH_INTERVAL')
+        )
+    if due:
+        flush()
+
+
+def flush():
+    """Write the pending counters with batched upserts; return the number of rows written"""
+    global _last_flush
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return 0
+    try:
+        _upsert(pending)
+    except Exception:
+        logger.exception('Could not flush %s usage counter(s); keeping them for the next flush', len(pending))
+        with _lock:
+            for key, count in pending.items():
+                _pending[key] = _pending.get(key, 0) + count
+        return 0
+    return len(pending)
+
+
+class Flusher(threading.Thread):
+    """Flush the pending counters every ``FLUSH_INTERVAL`` seconds until stopped"""
+
+    def __init__(self):
+        super().__init__(name='usage-flusher', daemon=True)
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        while not self.stopping.wait(get_metering_setting('FLUSH_INTERVAL')):
+            try:
+                flush()
+            finally:
+                # Hand the connection back (to the pool) between flushes
+                close_old_connections()
+
+
+def start_flusher():
+    """Start this process's flusher thread (once); return it, or None if metering is disabled"""
+    global _flusher
+    if not get_metering_setting('ENABLED'):
+        return None
+    with _lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = Flusher()
+            _flusher.start()
+        return _flusher
+
+
+def stop_flusher():
+    """Stop this process's flusher thread; the caller flushes what is left"""
+    global _flusher
+    with _lock:
+        flusher, _flusher = _flusher, None
+    if flusher is not None:
+        flusher.stop()
+        flusher.join(timeout=5)
+
+
+def _upsert(pending):
+    connection = connections[router.db_for_write(UsageRecord)]
+    opts = UsageRecord._meta
+    quote = connection.ops.quote_name
+    user_field = opts.get_field('user')
+    columns = [user_field.column, 'metric', 'period', 'count', 'updated_at']
+    now = opts.get_field('updated_at').get_db_prep_value(timezone.now(), connection)
+    table = quote(opts.db_table)
+    rows = [
+        [user_field.target_field.get_db_prep_value(user_id, connection), metric,
+         opts.get_field('period').get_db_prep_value(period, connection), count, now]
+        for (user_id, metric, period), count in pending.items()
+    ]
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH):
+            batch = rows[start:start + UPSERT_BATCH]
+            values = ', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(quote(column) for column in columns)}) VALUES {values} "
+                f"ON CONFLICT ({quote(user_field.column)}, {quote('metric')}, {quote('period')}) "
+                f"DO UPDATE SET {quote('count')} = {table}.{quote('count')} + EXCLUDED.{quote('count')}, "
+                f"{quote('updated_at')} = EXCLUDED.{quote('updated_at')}",
+                [value for row in batch for value in row],
+            )
+
+
+def _stored_usage(user_id, metric, period):
+    plan_id = UserSubscription.objects.active().filter(user_id=user_id).values_list('plan_id', flat=True).first()
+    limit = plan_limit(get_plan(plan_id) if plan_id else None, metric)
+    used = UsageRecord.objects.filter(user_id=user_id, metric=metric, period=period).values_list('count', flat=True).first()
+    return limit, used or 0
+
+
+def allowance(user_id, metric):
+    """Return ``(limit, remaining)`` for the current period; both None if unlimited"""
+    key = (user_id, metric, current_period())
+    snapshot = _allowances.get(key)
+    now = time.monotonic()
+    if snapshot is None or now - snapshot[3] > get_metering_setting('ALLOWANCE_TTL'):
+        limit, used = _stored_usage(user_id, metric, key[2])
+        with _lock:
+            if len(_allowances) >= MAX_ALLOWANCES:
+                _allowances.clear()
+                # Only needed to adjust snapshots; pending counts are kept
+                _recorded.clear()
+            snapshot = _allowances[key] = (limit, used + _pending.get(key, 0), _recorded.get(key, 0), now)
+    limit, used, recorded, _ = snapshot
+    if limit is None:
+        return None, None
+    used += _recorded.get(key, 0) - recorded
+    return limit, max(0, limit - used)
+
+
+def consume(user_id, metric, amount=1):
+    """Record usage, or raise QuotaExceeded when the allowance is used up"""
+    limit, remaining = allowance(user_id, metric)
+    if limit is not None and remaining < amount:
+        raise QuotaExceeded(f'The {metric} quota of {limit} per month is used up.')
+    record_usage(user_id, metric, amount)
+    return None if remaining is None else remaining - amount
+
+
+def usage_report(user_id, period=None):
+    """Return the usage, limit and remaining allowance of every metered metric"""
+    period = period or current_period()
+    flush()
+    plan_id = UserSubscription.objects.active().filter(user_id=user_id).values_list('plan_id', flat=True).first()
+    plan = get_plan(plan_id) if plan_id else None
+    used = dict(UsageRecord.objects.filter(user_id=user_id, period=period).values_list('metric', 'count'))
+    report = []
+    for metric in get_metering_setting('QUOTAS'):
+        limit = plan_limit(plan, metric)
+        count = used.get(metric, 0)
+        report.append({
+            'metric': metric,
+            'used': count,
+            'limit': limit,
+            'remaining': None if limit is None else max(0, limit - count),
+        })
+    return {
+        'period_start': period,
+        'period_end': next_period(period),
+        'plan': plan.name if plan else None,
+        'metrics': report,
+    }
+
+
+def _subscription_changed(user_id):
+    with _lock:
+        if user_id is None:
+            _allowances.clear()
+            return
+        for key in [key for key in _allowances if str(key[0]) == user_id]:
+            del _allowances[key]
+
+
+def _plan_changed(plan_id):
+    with _lock:
+        _allowances.clear()
+
+
+# A new subscription or plan changes the limit of a snapshot
+track(UserSubscription, _subscription_changed, key=attrgetter('user_id'))
+subscribe(SubscriptionPlan._meta.label_lower, _plan_changed)
+
+
+def reset():
+    """Forget the counters and snapshots of this process (unflushed counts are lost)"""
+    with _lock:
+        _pending.clear()
+        _recorded.clear()
+        _allowances.clear()
+
+
+class MeteredViewMixin:
+    """
+    Meter a view: ``metered_metric`` is checked against the caller's quota
+    before the handler runs and counted once it has succeeded.
+    """
+
+    metered_metric = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.metered_metric and request.user.is_authenticated:
+            limit, remaining = allowance(request.user.pk, self.metered_metric)
+            if limit is not None and remaining < 1:
+                raise QuotaExceeded(f'The {self.metered_metric} quota of {limit} per month is used up.')
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.metered_metric and request.user.is_authenticated and response.status_code < 400:
+            record_usage(request.user.pk, self.metered_metric)
+        return response
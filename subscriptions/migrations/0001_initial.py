@@ -0,0 +1,125 @@
+# Generated by Django 5.2.5 on 2026-10-19 04:48
+
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+import django.contrib.postgres.indexes
+import django.contrib.postgres.operations
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+import subscriptions.models
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # For the '=' of subinterval_no_overlap on a bigint column
+        django.contrib.postgres.operations.BtreeGistExtension(),
+        migrations.CreateModel(
+            name='SubscriptionPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(choices=[('Basic', 'Basic'), ('Standard', 'Standard'), ('Premium', 'Premium')], max_length=20, unique=True)),
+                ('features', models.JSONField(default=list, help_text='List of enabled features for this plan')),
+                ('price', models.DecimalField(decimal_places=2, help_text='Price in currency units', max_digits=10, validators=[django.core.validators.MinValueValidator(Decimal('0.00'))])),
+                ('is_active', models.BooleanField(default=True, help_text='Whether this plan is available for subscription')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Subscription Plan',
+                'verbose_name_plural': 'Subscription Plans',
+                'ordering': ['price'],
+                'base_manager_name': 'objects',
+            },
+        ),
+        migrations.CreateModel(
+            name='SubscriptionInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subscription_id', models.BigIntegerField(help_text='UserSubscription id; kept after the subscription is deleted')),
+                ('plan_name', models.CharField(max_length=20)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('expired', 'Expired'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('end_date', models.DateTimeField(blank=True, null=True)),
+                ('valid_from', models.DateTimeField()),
+                ('valid_to', models.DateTimeField(blank=True, help_text='Open while the state is current', null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subscription_history', to=settings.AUTH_USER_MODEL)),
+                ('plan', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='subscription_history', to='subscriptions.subscriptionplan')),
+            ],
+            options={
+                'verbose_name': 'Subscription Interval',
+                'verbose_name_plural': 'Subscription Intervals',
+                'ordering': ['valid_from', 'id'],
+                'indexes': [models.Index(fields=['subscription_id', 'valid_from'], name='subinterval_subscription_idx'), models.Index(fields=['user', 'valid_from'], name='subinterval_user_idx'), models.Index(fields=['status', 'valid_from'], name='subinterval_status_idx'), django.contrib.postgres.indexes.GistIndex(models.F('user'), subscriptions.models.TsTzRange('valid_from', 'valid_to', django.contrib.postgres.fields.ranges.RangeBoundary()), name='subinterval_user_range_gist')],
+                'constraints': [django.contrib.postgres.constraints.ExclusionConstraint(expressions=[('subscription_id', '='), (subscriptions.models.TsTzRange('valid_from', 'valid_to', django.contrib.postgres.fields.ranges.RangeBoundary()), '&&')], name='subinterval_no_overlap')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedSubscription',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('start_date', models.DateTimeField()),
+                ('end_date', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('expired', 'Expired'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_subscriptions', to=settings.AUTH_USER_MODEL)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_subscriptions', to='subscriptions.subscriptionplan')),
+            ],
+            options={
+                'verbose_name': 'Archived Subscription',
+                'verbose_name_plural': 'Archived Subscriptions',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'created_at'], name='archivedsub_user_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UsageRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=50)),
+                ('period', models.DateField(help_text='First day of the month')),
+                ('count', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_records', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Usage Record',
+                'verbose_name_plural': 'Usage Records',
+                'ordering': ['-period', 'metric'],
+                'indexes': [models.Index(fields=['period', 'metric'], name='usage_period_metric_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'metric', 'period'), name='usage_record_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserSubscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateTimeField(auto_now_add=True)),
+                ('end_date', models.DateTimeField(blank=True, help_text='Leave blank for unlimited subscription', null=True)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('expired', 'Expired'), ('cancelled', 'Cancelled')], default='active', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_subscriptions', to='subscriptions.subscriptionplan')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'User Subscription',
+                'verbose_name_plural': 'User Subscriptions',
+                'ordering': ['-created_at'],
+                'base_manager_name': 'objects',
+                'indexes': [models.Index(fields=['status', 'end_date'], name='usersub_status_end_date_idx'), models.Index(fields=['status', 'updated_at'], name='usersub_status_updated_idx')],
+                'unique_together': {('user', 'status')},
+            },
+        ),
+    ]
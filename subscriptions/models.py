@@ -1,8 +1,17 @@
-from django.db import models
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeBoundary, RangeOperators
+from django.contrib.postgres.indexes import GistIndex
+from django.db import models, router, transaction
+from django.db.models import Case, ExpressionWrapper, F, Func, Q, Value, When
+from django.db.models.functions import Greatest
 from django.conf import settings
 from django.core.validators import MinValueValidator
+from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal
 
+from medhashaala.identity_map import IdentityMapManager, IdentityMapQuerySet
+
 
 class SubscriptionPlan(models.Model):
     """Model for managing subscription plans"""
@@ -25,7 +34,11 @@ class SubscriptionPlan(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Primary-key lookups are answered once per request (see medhashaala.identity_map)
+    objects = IdentityMapManager()
+    
     class Meta:
+        base_manager_name = 'objects'
         ordering = ['price']
         verbose_name = "Subscription Plan"
         verbose_name_plural = "Subscription Plans"
@@ -51,6 +64,78 @@ class SubscriptionPlan(models.Model):
         return self.users.filter(subscriptions__status='active').distinct()
 
 
+class _DaysUntil(Func):
+    """Whole days from ``now`` until a datetime column (rounded down on PostgreSQL, towards zero on SQLite)"""
+    
+    output_field = models.IntegerField()
+    
+    def __init__(self, expression, now):
+        super().__init__(expression, Value(now, output_field=models.DateTimeField()))
+    
+    def as_sql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection,
+            template='CAST(FLOOR(EXTRACT(EPOCH FROM (%(expressions)s)) / 86400) AS integer)',
+            arg_joiner=' - ',
+            **extra_context
+        )
+    
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS integer)',
+            arg_joiner=') - julianday(',
+            **extra_context
+        )
+
+
+class UserSubscriptionQuerySet(IdentityMapQuerySet):
+    """
+    SQL equivalents of ``UserSubscription.is_active`` and ``get_remaining_days()``.
+    
+    Every method takes an optional ``now`` so that several calls can share
+    one point in time; it defaults to ``timezone.now()``.
+    """
+    
+    @staticmethod
+    def active_q(now=None):
+        """Q object matching subscriptions that are active and not past their end date"""
+        now = now or timezone.now()
+        return Q(status='active') & (Q(end_date__isnull=True) | Q(end_date__gte=now))
+    
+    def active(self, now=None):
+        """Subscriptions for which ``is_active`` is True"""
+        return self.filter(self.active_q(now))
+    
+    def inactive(self, now=None):
+        """Subscriptions for which ``is_active`` is False"""
+        return self.exclude(self.active_q(now))
+    
+    def expiring_within(self, period, now=None):
+        """Active subscriptions ending within ``period`` (a timedelta or a number of days)"""
+        now = now or timezone.now()
+        if not isinstance(period, timedelta):
+            period = timedelta(days=period)
+        return self.filter(status='active', end_date__gte=now, end_date__lte=now + period)
+    
+    def with_active_now(self, now=None):
+        """Annotate ``active_now``, the value of ``is_active`` computed in the database"""
+        return self.annotate(
+            active_now=ExpressionWrapper(self.active_q(now), output_field=models.BooleanField())
+        )
+    
+    def with_remaining_days(self, now=None):
+        """Annotate ``remaining_days`` as ``get_remaining_days()`` would return it"""
+        now = now or timezone.now()
+        return self.annotate(
+            remaining_days=Case(
+                When(end_date__isnull=True, then=Value(None)),
+                default=Greatest(_DaysUntil('end_date', now), Value(0)),
+                output_field=models.IntegerField(),
+            )
+        )
+
+
 class UserSubscription(models.Model):
     """Model for tracking user subscriptions"""
     
@@ -68,16 +153,67 @@ class UserSubscription(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = UserSubscriptionQuerySet.as_manager()
+    
+    # Columns whose changes are appended to the subscription history
+    HISTORY_FIELDS = ('user_id', 'plan_id', 'status', 'end_date')
+    
     class Meta:
+        base_manager_name = 'objects'
         ordering = ['-created_at']
         verbose_name = "User Subscription"
         verbose_name_plural = "User Subscriptions"
         # Ensure one active subscription per user
         unique_together = ['user', 'status']
+        indexes = [
+            # active() / expiring_within(): status equality, then an end_date range
+            models.Index(fields=['status', 'end_date'], name='usersub_status_end_date_idx'),
+            # Archival: terminal subscriptions unchanged since a cutoff
+            models.Index(fields=['status', 'updated_at'], name='usersub_status_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.name or self.user.email} - {self.plan.name} ({self.status})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._history_state = instance._get_history_state()
+        return instance
+    
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        # The fields may no longer be those last saved; record the next save
+        self._history_state = None
+    
+    def _get_history_state(self):
+        """The values of HISTORY_FIELDS, or None if some of them are deferred"""
+        if self.get_deferred_fields().intersection(self.HISTORY_FIELDS):
+            return None
+        return tuple(getattr(self, name) for name in self.HISTORY_FIELDS)
+    
+    def save(self, *args, **kwargs):
+        """Save, and append the new state to the subscription history in the same transaction if it changed"""
+        from .history import record
+        
+        update_fields = kwargs.get('update_fields')
+        state = self._get_history_state()
+        # Rows written elsewhere than where they were loaded from are always recorded
+        stored = not kwargs.get('force_insert') and kwargs.get('using') in (None, self._state.db)
+        unchanged = stored and state is not None and state == getattr(self, '_history_state', None)
+        if update_fields is not None and not unchanged:
+            unchanged = {self._meta.get_field(name).attname for name in update_fields}.isdisjoint(self.HISTORY_FIELDS)
+        if unchanged:
+            super().save(*args, **kwargs)
+            return
+        
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            record([self.pk], using=using)
+        # Only the saved fields are known to be stored
+        self._history_state = state if update_fields is None else None
+    
     @property
     def is_active(self):
         """Check if subscription is currently active"""
@@ -85,14 +221,12 @@ class UserSubscription(models.Model):
             return False
         if self.end_date is None:
             return True
-        from django.utils import timezone
         return timezone.now() <= self.end_date
     
     def get_remaining_days(self):
         """Get remaining days for subscription (None if unlimited)"""
         if self.end_date is None:
             return None
-        from django.utils import timezone
         remaining = self.end_date - timezone.now()
         return max(0, remaining.days)
     
@@ -112,3 +246,161 @@ class UserSubscription(models.Model):
         if end_date:
             self.end_date = end_date
         self.save(update_fields=['status', 'end_date', 'updated_at'])
+
+
+class UsageRecord(models.Model):
+    """Metered usage of a user per metric and monthly period (see subscriptions.metering)"""
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='usage_records')
+    metric = models.CharField(max_length=50)
+    period = models.DateField(help_text="First day of the month")
+    count = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-period', 'metric']
+        verbose_name = "Usage Record"
+        verbose_name_plural = "Usage Records"
+        constraints = [
+            # Target of the write-behind upsert
+            models.UniqueConstraint(fields=['user', 'metric', 'period'], name='usage_record_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'metric'], name='usage_period_metric_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} {self.metric} {self.period:%Y-%m}: {self.count}"
+
+
+class _Covers(Func):
+    """
+    ``valid_from <= when < valid_to``, with a NULL ``valid_to`` open-ended.
+    On PostgreSQL a ``tstzrange`` containment, which the GiST index on the
+    interval range serves (see subscriptions.history).
+    """
+    
+    output_field = models.BooleanField()
+    
+    def __init__(self, when):
+        super().__init__(F('valid_from'), F('valid_to'), Value(when, output_field=models.DateTimeField()))
+    
+    def as_sql(self, compiler, connection, **extra_context):
+        (start, start_params), (end, end_params), (when, when_params) = [
+            compiler.compile(expression) for expression in self.get_source_expressions()
+        ]
+        return (
+            f'({start} <= {when} AND ({end} IS NULL OR {end} > {when}))',
+            [*start_params, *when_params, *end_params, *end_params, *when_params],
+        )
+    
+    def as_postgresql(self, compiler, connection, **extra_context):
+        (start, start_params), (end, end_params), (when, when_params) = [
+            compiler.compile(expression) for expression in self.get_source_expressions()
+        ]
+        return f"tstzrange({start}, {end}, '[)') @> {when}", [*start_params, *end_params, *when_params]
+
+
+class SubscriptionIntervalQuerySet(models.QuerySet):
+    """Time-travel queries over the subscription history"""
+    
+    def at(self, when):
+        """Intervals in effect at ``when``"""
+        return self.filter(_Covers(when))
+    
+    def active_at(self, when):
+        """Intervals in which the subscription was active at ``when`` (``is_active`` as of then)"""
+        return self.at(when).filter(Q(status='active') & (Q(end_date__isnull=True) | Q(end_date__gte=when)))
+    
+    def current(self):
+        """Intervals still open: the present state of every subscription"""
+        return self.filter(valid_to__isnull=True)
+
+
+class TsTzRange(Func):
+    """tstzrange(lower, upper, '[)'); an upper bound of NULL leaves the range open"""
+    
+    function = 'TSTZRANGE'
+    output_field = DateTimeRangeField()
+
+
+class SubscriptionInterval(models.Model):
+    """
+    One state of a subscription over ``[valid_from, valid_to)``.
+    
+    The history is append-only: a transition closes the open interval of the
+    subscription and adds a new one (see subscriptions.history); rows are
+    never rewritten otherwise. Intervals outlive their subscription and plan.
+    """
+    
+    subscription_id = models.BigIntegerField(help_text="UserSubscription id; kept after the subscription is deleted")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='subscription_history')
+    plan = models.ForeignKey(
+        SubscriptionPlan, on_delete=models.SET_NULL, null=True, blank=True, related_name='subscription_history'
+    )
+    plan_name = models.CharField(max_length=20)
+    status = models.CharField(max_length=20, choices=UserSubscription.STATUS_CHOICES)
+    end_date = models.DateTimeField(null=True, blank=True)
+    valid_from = models.DateTimeField()
+    valid_to = models.DateTimeField(null=True, blank=True, help_text="Open while the state is current")
+    
+    objects = SubscriptionIntervalQuerySet.as_manager()
+    
+    class Meta:
+        ordering = ['valid_from', 'id']
+        verbose_name = "Subscription Interval"
+        verbose_name_plural = "Subscription Intervals"
+        indexes = [
+            models.Index(fields=['subscription_id', 'valid_from'], name='subinterval_subscription_idx'),
+            models.Index(fields=['user', 'valid_from'], name='subinterval_user_idx'),
+            models.Index(fields=['status', 'valid_from'], name='subinterval_status_idx'),
+            # Serves the time-travel queries of a user
+            GistIndex('user', TsTzRange('valid_from', 'valid_to', RangeBoundary()), name='subinterval_user_range_gist'),
+        ]
+        constraints = [
+            # The intervals of a subscription never overlap (needs btree_gist)
+            ExclusionConstraint(
+                name='subinterval_no_overlap',
+                expressions=[
+                    ('subscription_id', RangeOperators.EQUAL),
+                    (TsTzRange('valid_from', 'valid_to', RangeBoundary()), RangeOperators.OVERLAPS),
+                ],
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.subscription_id} {self.plan_name} {self.status} [{self.valid_from:%Y-%m-%d %H:%M}, {self.valid_to or ''})"
+
+
+class ArchivedSubscription(models.Model):
+    """
+    A subscription moved out of ``UserSubscription`` once it had been expired
+    or cancelled for longer than the retention window (see
+    subscriptions.archive). It keeps the id and columns of the original row.
+    """
+    
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_subscriptions')
+    plan = models.ForeignKey(SubscriptionPlan, on_delete=models.CASCADE, related_name='archived_subscriptions')
+    start_date = models.DateTimeField()
+    end_date = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=UserSubscription.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Archived Subscription"
+        verbose_name_plural = "Archived Subscriptions"
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='archivedsub_user_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.name or self.user.email} - {self.plan.name} ({self.status}, archived)"
+    
+    # Only terminal subscriptions are archived
+    is_active = False
+    
+    get_remaining_days = UserSubscription.get_remaining_days
@@ -0,0 +1,252 @@
+"""
+Projection-based fast read path for hot serializers.
+
+A ``Projection`` is compiled once from a read-only ModelSerializer: every
+field becomes a column of a single ``values()`` query (nested serializers
+become joined ``plan__*`` columns) plus a converter that renders the value
+exactly as the DRF field would. Rendering a row is then a handful of
+function calls, without model instances, field deep copies or per-field
+``to_representation`` dispatch.
+
+Values computed on the model (``is_active``, ``remaining_days``,
+``feature_count``) have no column; they are registered in ``COMPUTED``
+with the columns they need and a function of those values.
+
+``for_request`` returns the variant for a request's ``?fields=`` and
+``?expand=`` parameters (see ``subscriptions.sparse``), compiled once per
+distinct combination.
+"""
+
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.settings import ISO_8601, api_settings
+
+from medhashaala.metrics import serializing
+from .models import SubscriptionPlan, UserSubscription
+from .serializers import UserSubscriptionReadSerializer
+from .sparse import sparse_params
+
+# Sparse variants kept per projection
+MAX_VARIANTS = 128
+
+
+def _is_active(now, status, end_date):
+    return status == 'active' and (end_date is None or now <= end_date)
+
+
+def _remaining_days(now, end_date):
+    return None if end_date is None else max(0, (end_date - now).days)
+
+
+def _feature_count(now, features):
+    return len(features) if features else 0
+
+
+# model -> property -> (columns, function(now, *values))
+COMPUTED = {
+    UserSubscription: {
+        'is_active': (('status', 'end_date'), _is_active),
+        'remaining_days': (('end_date',), _remaining_days),
+    },
+    SubscriptionPlan: {
+        'feature_count': (('features',), _feature_count),
+    },
+}
+
+
+def _datetime_converter(field):
+    if getattr(field, 'format', api_settings.DATETIME_FORMAT) not in (ISO_8601, 'iso-8601'):
+        return None
+
+    def convert(value, tz):
+        if value is None:
+            return None
+        if value.tzinfo is not None and value.tzinfo is not tz:
+            value = value.astimezone(tz)
+        value = value.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return convert
+
+
+def _decimal_converter(field):
+    if not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING) or field.localize:
+        return None
+    quantum = Decimal(1).scaleb(-field.decimal_places)
+
+    def convert(value, tz):
+        if value is None:
+            return None
+        return '{:f}'.format(value.quantize(quantum, rounding=field.rounding))
+
+    return convert
+
+
+def _plain(value, tz):
+    return value
+
+
+# DRF fields whose to_representation returns the database value unchanged
+PLAIN_FIELDS = (
+    serializers.IntegerField, serializers.CharField, serializers.BooleanField,
+    serializers.JSONField, serializers.ReadOnlyField,
+)
+
+
+class Projection:
+    """
+    Fast, read-only equivalent of ``serializer_class(instance).data``.
+
+    Usage::
+
+        SUBSCRIPTION_READ.first(UserSubscription.objects.filter(user=user))
+        SUBSCRIPTION_READ.render_many(queryset)
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._compiled = None
+        self._variants = {}
+
+    @property
+    def columns(self):
+        return self.compile()[0]
+
+    def compile(self):
+        """Build (once) the column list and the renderer of a row"""
+        if self._compiled is None:
+            self._compiled = self._compile_root(self.serializer_class())
+        return self._compiled
+
+    def _compile_root(self, serializer):
+        columns = []
+        render = self._compile_serializer(serializer, '', columns)
+        return tuple(dict.fromkeys(columns)), render
+
+    def for_request(self, request):
+        """Return the projection of the fields a request asks for"""
+        key = sparse_params(request)
+        if key == ('', ''):
+            return self
+        variant = self._variants.get(key)
+        if variant is None:
+            variant = Projection(self.serializer_class)
+            # Unknown fields raise a ValidationError here, before anything is cached
+            variant._compiled = self._compile_root(self.serializer_class(context={'request': request}))
+            if len(self._variants) >= MAX_VARIANTS:
+                self._variants.clear()
+            self._variants[key] = variant
+        return variant
+
+    def _compile_serializer(self, serializer, prefix, columns):
+        model = serializer.Meta.model
+        computed = COMPUTED.get(model, {})
+        entries = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.BaseSerializer):
+                if getattr(field, 'many', False):
+                    raise ImproperlyConfigured(f'{name}: to-many relations cannot be projected')
+                nested_prefix = f'{prefix}{field.source}__'
+                pk_key = nested_prefix + field.Meta.model._meta.pk.attname
+                columns.append(pk_key)
+                nested = self._compile_serializer(field, nested_prefix, columns)
+                entries.append((name, self._nested_getter(pk_key, nested)))
+                continue
+            if field.source in computed:
+                needed, function = computed[field.source]
+                keys = [prefix + column for column in needed]
+                columns.extend(keys)
+                entries.append((name, self._computed_getter(keys, function)))
+                continue
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                missing = field.source_attrs == [field.source] and not hasattr(model, field.source)
+                if missing and not field.required and field.default is empty:
+                    # DRF leaves out optional fields missing from the instance
+                    if field.allow_null:
+                        entries.append((name, lambda row, now, tz: None))
+                    continue
+                raise ImproperlyConfigured(
+                    f'{model.__name__}.{field.source} is neither a field nor registered in COMPUTED'
+                )
+            key = prefix + model_field.attname
+            columns.append(key)
+            entries.append((name, self._column_getter(key, self._converter(name, field))))
+        entries = tuple(entries)
+
+        def render(row, now, tz):
+            return {name: getter(row, now, tz) for name, getter in entries}
+
+        return render
+
+    @staticmethod
+    def _converter(name, field):
+        if isinstance(field, serializers.DateTimeField):
+            converter = _datetime_converter(field)
+        elif isinstance(field, serializers.DecimalField):
+            converter = _decimal_converter(field)
+        elif isinstance(field, serializers.ChoiceField):
+            # String choices are rendered as they are stored
+            converter = _plain if all(isinstance(key, str) for key in field.choices) else None
+        elif isinstance(field, PLAIN_FIELDS + (serializers.PrimaryKeyRelatedField,)):
+            converter = _plain
+        else:
+            converter = None
+        if converter is None:
+            raise ImproperlyConfigured(f'{name}: {type(field).__name__} cannot be projected')
+        return converter
+
+    @staticmethod
+    def _column_getter(key, converter):
+        if converter is _plain:
+            return lambda row, now, tz: row[key]
+        return lambda row, now, tz: converter(row[key], tz)
+
+    @staticmethod
+    def _nested_getter(pk_key, render):
+        return lambda row, now, tz: None if row[pk_key] is None else render(row, now, tz)
+
+    @staticmethod
+    def _computed_getter(keys, function):
+        return lambda row, now, tz: function(now, *[row[key] for key in keys])
+
+    @staticmethod
+    def _clock():
+        tz = timezone.get_current_timezone()
+        # Database values are in datetime.timezone.utc; skip converting them to an equal zone
+        if getattr(tz, 'key', None) == 'UTC':
+            tz = dt_timezone.utc
+        return timezone.now(), tz
+
+    def render(self, row):
+        """Render one ``values()`` row"""
+        with serializing():
+            return self.compile()[1](row, *self._clock())
+
+    def render_rows(self, rows):
+        """Render ``values()`` rows"""
+        rows = list(rows)
+        with serializing():
+            render = self.compile()[1]
+            now, tz = self._clock()
+            return [render(row, now, tz) for row in rows]
+
+    def render_many(self, queryset):
+        """Fetch the projected columns of a queryset and render every row"""
+        return self.render_rows(queryset.values(*self.columns))
+
+    def first(self, queryset):
+        """Render the first row of a queryset, or return None"""
+        row = queryset.values(*self.columns).first()
+        return None if row is None else self.render(row)
+
+
+SUBSCRIPTION_READ = Projection(UserSubscriptionReadSerializer)
@@ -0,0 +1,24 @@
+"""
+Precompiled hot queries of the subscriptions app (see medhashaala.prepared).
+"""
+
+from medhashaala.prepared import PreparedQuery
+from .models import SubscriptionPlan, UserSubscription
+from .projections import SUBSCRIPTION_READ
+
+# A user has at most one active subscription (unique together with the status)
+ACTIVE_SUBSCRIPTION = PreparedQuery(
+    lambda user_id: UserSubscription.objects.filter(user_id=user_id, status='active')[:1],
+    user_id=UserSubscription._meta.get_field('user'),
+)
+# The same, as the values() row that entitlement snapshots keep
+ACTIVE_SUBSCRIPTION_ROW = PreparedQuery(
+    lambda user_id: UserSubscription.objects.filter(user_id=user_id, status='active').values(
+        *SUBSCRIPTION_READ.columns
+    )[:1],
+    user_id=UserSubscription._meta.get_field('user'),
+)
+PLAN_BY_ID = PreparedQuery(
+    lambda plan_id: SubscriptionPlan.objects.filter(pk=plan_id).order_by()[:1],
+    plan_id=SubscriptionPlan._meta.pk,
+)
@@ -1,11 +1,28 @@
 from rest_framework import serializers
-from .models import SubscriptionPlan, UserSubscription
+from medhashaala.metrics import TimedSerializerMixin
+from .models import ArchivedSubscription, SubscriptionInterval, SubscriptionPlan, UserSubscription
+from .sparse import SparseFieldsMixin
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
-class SubscriptionPlanSerializer(serializers.ModelSerializer):
+class RemainingDaysField(serializers.IntegerField):
+    """
+    ``remaining_days`` (None if unlimited): the ``with_remaining_days()``
+    annotation, or ``get_remaining_days()`` for instances loaded without it
+    """
+    
+    def __init__(self, **kwargs):
+        super().__init__(read_only=True, allow_null=True, **kwargs)
+    
+    def get_attribute(self, instance):
+        if 'remaining_days' in instance.__dict__:
+            return instance.remaining_days
+        return instance.get_remaining_days()
+
+
+class SubscriptionPlanSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for SubscriptionPlan model"""
     
     feature_count = serializers.ReadOnlyField()
@@ -17,6 +34,8 @@ class SubscriptionPlanSerializer(serializers.ModelSerializer):
             'feature_count', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+        # Columns read by fields that are not model fields (?fields=)
+        sparse_sources = {'feature_count': ['features']}
     
     def validate_features(self, value):
         """Validate that features is a list"""
@@ -31,14 +50,23 @@ class SubscriptionPlanSerializer(serializers.ModelSerializer):
         return value
 
 
-class UserSubscriptionSerializer(serializers.ModelSerializer):
+class UserSummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Compact user representation for ?expand=user"""
+    
+    class Meta:
+        model = User
+        fields = ['id', 'email', 'phone', 'name', 'role']
+        read_only_fields = fields
+
+
+class UserSubscriptionSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for UserSubscription model"""
     
     user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
     plan = SubscriptionPlanSerializer(read_only=True)
     plan_id = serializers.IntegerField(write_only=True)
     is_active = serializers.ReadOnlyField()
-    remaining_days = serializers.ReadOnlyField()
+    remaining_days = RemainingDaysField()
     
     class Meta:
         model = UserSubscription
@@ -47,17 +75,23 @@ class UserSubscriptionSerializer(serializers.ModelSerializer):
             'status', 'is_active', 'remaining_days', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'start_date', 'created_at', 'updated_at']
+        sparse_sources = {'is_active': ['status', 'end_date'], 'remaining_days': ['end_date']}
+        # ?expand=user nests the user instead of its id
+        expandable_fields = {
+            'user': ('subscriptions.serializers.UserSummarySerializer', {'read_only': True}),
+        }
     
     def validate(self, data):
         """Custom validation for user subscription"""
         # Check if plan exists and is active
+        from .queries import PLAN_BY_ID
+        
         plan_id = data.get('plan_id')
-        try:
-            plan = SubscriptionPlan.objects.get(id=plan_id)
-            if not plan.is_active:
-                raise serializers.ValidationError("Cannot subscribe to inactive plan")
-        except SubscriptionPlan.DoesNotExist:
+        plan = PLAN_BY_ID.first(plan_id=plan_id)
+        if plan is None:
             raise serializers.ValidationError("Invalid plan ID")
+        if not plan.is_active:
+            raise serializers.ValidationError("Cannot subscribe to inactive plan")
         
         # Check for existing active subscription
         user = data.get('user')
@@ -74,12 +108,12 @@ class UserSubscriptionSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class UserSubscriptionReadSerializer(serializers.ModelSerializer):
+class UserSubscriptionReadSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Read-only serializer for user's own subscription"""
     
     plan = SubscriptionPlanSerializer(read_only=True)
     is_active = serializers.ReadOnlyField()
-    remaining_days = serializers.ReadOnlyField()
+    remaining_days = RemainingDaysField()
     
     class Meta:
         model = UserSubscription
@@ -88,3 +122,32 @@ class UserSubscriptionReadSerializer(serializers.ModelSerializer):
             'is_active', 'remaining_days', 'created_at'
         ]
         read_only_fields = fields
+        sparse_sources = {'is_active': ['status', 'end_date'], 'remaining_days': ['end_date']}
+
+
+class SubscriptionIntervalSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializer for one interval of the subscription history"""
+    
+    class Meta:
+        model = SubscriptionInterval
+        fields = [
+            'id', 'subscription_id', 'user', 'plan', 'plan_name',
+            'status', 'end_date', 'valid_from', 'valid_to'
+        ]
+        read_only_fields = fields
+
+
+class ArchivedSubscriptionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Read-only serializer for archived subscriptions, with the fields of UserSubscriptionSerializer"""
+    
+    plan = SubscriptionPlanSerializer(read_only=True)
+    is_active = serializers.ReadOnlyField()
+    remaining_days = RemainingDaysField()
+    
+    class Meta:
+        model = ArchivedSubscription
+        fields = [
+            'id', 'user', 'plan', 'start_date', 'end_date', 
+            'status', 'is_active', 'remaining_days', 'created_at', 'updated_at', 'archived_at'
+        ]
+        read_only_fields = fields
@@ -0,0 +1,150 @@
+"""
+Sparse fieldsets and expandable relations for read requests.
+
+``?fields=id,status,plan.name`` keeps only the listed fields; a dotted name
+selects fields of a nested serializer. ``?expand=user`` renders a relation
+from ``Meta.expandable_fields`` as a nested object (instead of its primary
+key, or in addition to the default fields). Only safe-method requests are
+affected, so writes keep every input field.
+
+``sparse_query()`` reports which relations to join and which columns to
+load for the fields that remain, and ``SparseQuerysetMixin`` applies it to
+a view's queryset: no plan join when the plan is not rendered, and only the
+rendered columns. Fields that are not model fields declare the columns
+they read in ``Meta.sparse_sources``.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def sparse_params(request):
+    """Return the raw (fields, expand) query parameters of a read request"""
+    if request is None or request.method not in SAFE_METHODS:
+        return '', ''
+    return request.query_params.get('fields', ''), request.query_params.get('expand', '')
+
+
+def parse_fields(value):
+    """Turn ``'id,plan.name'`` into ``{'id': {}, 'plan': {'name': {}}}``"""
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for part in path.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def _prune(fields, tree, path=''):
+    unknown = sorted(set(tree) - set(fields))
+    if unknown:
+        raise serializers.ValidationError(
+            {'fields': [f"Unknown field(s): {', '.join(path + name for name in unknown)}"]}
+        )
+    for name in list(fields):
+        if name not in tree:
+            del fields[name]
+    for name, subtree in tree.items():
+        if not subtree:
+            continue
+        nested = getattr(fields[name], 'child', fields[name])
+        if not isinstance(nested, serializers.Serializer):
+            raise serializers.ValidationError({'fields': [f'{path}{name} has no nested fields']})
+        _prune(nested.fields, subtree, f'{path}{name}.')
+
+
+class SparseFieldsMixin:
+    """Serializer support for ``?fields=`` and ``?expand=`` (see module docstring)"""
+
+    def _is_root(self):
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self._is_root():
+            return fields
+        requested, expand = sparse_params(self.context.get('request'))
+
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        names = {name.strip() for name in expand.split(',') if name.strip()}
+        unknown = sorted(names - set(expandable))
+        if unknown:
+            raise serializers.ValidationError({'expand': [f"Cannot expand: {', '.join(unknown)}"]})
+        for name in names:
+            serializer_path, kwargs = expandable[name]
+            fields[name] = import_string(serializer_path)(**kwargs)
+
+        if requested:
+            _prune(fields, parse_fields(requested))
+        return fields
+
+    def sparse_query(self):
+        """
+        Return ``(relations, columns)`` needed to render the current fields.
+
+        ``relations`` are forward relations to ``select_related``; ``columns``
+        is the argument list for ``only()``, or None when a field reads
+        something that is not declared.
+        """
+        relations = []
+        columns = []
+        complete = _collect(self, '', relations, columns)
+        return relations, (columns if complete else None)
+
+
+def _collect(serializer, prefix, relations, columns):
+    serializer = getattr(serializer, 'child', serializer)
+    model = serializer.Meta.model
+    sources = getattr(serializer.Meta, 'sparse_sources', {})
+    columns.append(prefix + model._meta.pk.name)
+    complete = True
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if name in sources:
+            for path in sources[name]:
+                parts = path.split('__')
+                for depth in range(1, len(parts)):
+                    relation = prefix + '__'.join(parts[:depth])
+                    relations.append(relation)
+                    columns.append(relation)
+                columns.append(prefix + path)
+            continue
+        if isinstance(field, serializers.BaseSerializer):
+            if isinstance(field, serializers.ListSerializer):
+                # To-many relations are prefetched by the view
+                continue
+            relations.append(prefix + field.source)
+            columns.append(prefix + field.source)
+            complete = _collect(field, f'{prefix}{field.source}__', relations, columns) and complete
+            continue
+        try:
+            model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            if field.source_attrs == [field.source] and not hasattr(model, field.source):
+                # Not rendered (DRF skips optional attributes the instance lacks)
+                continue
+            complete = False
+            continue
+        columns.append(prefix + field.source)
+    return complete
+
+
+class SparseQuerysetMixin:
+    """View support for loading only what a sparse serializer renders"""
+
+    def sparse_queryset(self, queryset, serializer=None):
+        """Narrow ``queryset`` to the requested fields; unchanged without ?fields= / ?expand="""
+        if sparse_params(self.request) == ('', ''):
+            return queryset
+        relations, columns = (serializer or self.get_serializer()).sparse_query()
+        queryset = queryset.select_related(None)
+        if relations:
+            queryset = queryset.select_related(*dict.fromkeys(relations))
+        if columns is not None:
+            queryset = queryset.only(*dict.fromkeys(columns))
+        return queryset
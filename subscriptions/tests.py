@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, modify_settings, override_settings
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
@@ -389,3 +389,2206 @@ class SubscriptionPlanTestCase(TestCase):
         
         # Check that the user can access their plan
         self.assertEqual(self.user.subscription_plan, self.basic_plan)
+
+
+class ReplicaRoutingTest(TestCase):
+    """Test cases for the read-replica database router"""
+    
+    def setUp(self):
+        """Set up test data"""
+        from medhashaala import db_router
+        
+        self.db_router = db_router
+        self.router = db_router.ReplicaRouter()
+        
+        self.admin_user = User.objects.create_user(
+            email='admin@example.com',
+            name='Admin User',
+            password='adminpass123',
+            is_staff=True,
+            is_superuser=True
+        )
+        
+        # Creating the user above pinned this thread to the primary
+        db_router.reset_state()
+        db_router.clear_health_cache()
+    
+    def tearDown(self):
+        self.db_router.reset_state()
+        self.db_router.clear_health_cache()
+    
+    def test_reads_use_primary_outside_replica_views(self):
+        """Test that reads go to the primary unless a replica view enabled replicas"""
+        with self.settings(DATABASE_REPLICAS={'ALIASES': ['replica']}):
+            self.assertEqual(self.router.db_for_read(SubscriptionPlan), 'default')
+    
+    def test_reads_use_healthy_replica(self):
+        """Test that replica reads go to a healthy replica"""
+        from unittest import mock
+        
+        with self.settings(DATABASE_REPLICAS={'ALIASES': ['replica']}), \
+                mock.patch.object(self.db_router, 'measure_replica_lag', return_value=0.5):
+            self.db_router.use_replicas()
+            self.assertEqual(self.router.db_for_read(SubscriptionPlan), 'replica')
+    
+    def test_write_pins_reads_to_primary(self):
+        """Test that reads after a write in the same request use the primary"""
+        from unittest import mock
+        
+        with self.settings(DATABASE_REPLICAS={'ALIASES': ['replica']}), \
+                mock.patch.object(self.db_router, 'measure_replica_lag', return_value=0):
+            self.db_router.use_replicas()
+            self.assertEqual(self.router.db_for_write(SubscriptionPlan), 'default')
+            self.assertEqual(self.router.db_for_read(SubscriptionPlan), 'default')
+    
+    def test_lagging_or_unreachable_replica_falls_back_to_primary(self):
+        """Test that unhealthy replicas are skipped"""
+        from unittest import mock
+        
+        with self.settings(DATABASE_REPLICAS={'ALIASES': ['replica'], 'MAX_LAG_SECONDS': 10}):
+            self.db_router.use_replicas()
+            with mock.patch.object(self.db_router, 'measure_replica_lag', return_value=60):
+                self.assertEqual(self.router.db_for_read(SubscriptionPlan), 'default')
+            
+            # 'replica' is not a configured connection, so the check fails
+            self.db_router.reset_state()
+            self.db_router.clear_health_cache()
+            self.db_router.use_replicas()
+            self.assertEqual(self.router.db_for_read(SubscriptionPlan), 'default')
+    
+    def test_write_request_sets_pin_cookie(self):
+        """Test that a write request pins the client to the primary"""
+        from django.test import Client
+        
+        client = Client()
+        client.force_login(self.admin_user)
+        
+        response = client.get('/api/plans/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('db_primary_pin', response.cookies)
+        
+        response = client.post(
+            '/api/plans/',
+            {'name': 'Basic', 'features': ['feature1'], 'price': '9.99'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.cookies['db_primary_pin']['max-age'], 5)
+        
+        # A pinned client's next unsafe request only renews the pin if it writes
+        response = client.post('/api/plans/', {'name': ''}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('db_primary_pin', response.cookies)
+
+
+class DatabaseConnectionTest(TestCase):
+    """Test cases for database connection warm-up and statistics"""
+    
+    def test_warm_up_connections(self):
+        """Test that warm-up opens the default connection"""
+        from medhashaala.db_connections import warm_up_connections
+        
+        self.assertEqual(warm_up_connections(['default']), {'default': True})
+    
+    def test_warm_up_retries_with_backoff(self):
+        """Test that warm-up retries while the database is unavailable"""
+        from unittest import mock
+        from django.db import OperationalError, connections
+        from medhashaala import db_connections
+        
+        connection = connections['default']
+        real_cursor = connection.cursor
+        failures = [OperationalError('waking up'), OperationalError('waking up')]
+        
+        def flaky_cursor(*args, **kwargs):
+            if failures:
+                raise failures.pop()
+            return real_cursor(*args, **kwargs)
+        
+        with mock.patch.object(connection, 'cursor', side_effect=flaky_cursor), \
+                mock.patch.object(db_connections.time, 'sleep') as sleep:
+            result = db_connections.warm_up_connections(['default'], attempts=3, backoff=0.5)
+        
+        self.assertEqual(result, {'default': True})
+        self.assertEqual(sleep.call_count, 2)
+        self.assertGreaterEqual(sleep.call_args_list[1][0][0], 1.0)
+    
+    def test_project_pool_options(self):
+        """Test that Django's PostgreSQL backend builds a pool from the project settings"""
+        import copy
+        from django.db.utils import ConnectionHandler, load_backend
+        from medhashaala import settings as project_settings
+        
+        try:
+            from psycopg_pool import ConnectionPool
+        except ImportError:
+            self.skipTest('psycopg_pool is not installed')
+        
+        database = ConnectionHandler({'default': copy.deepcopy(project_settings.DATABASES['default'])}).settings['default']
+        # Under an alias of its own, since pools are shared per alias
+        wrapper = load_backend(database['ENGINE']).DatabaseWrapper(database, alias='pooled')
+        pool = wrapper.pool
+        self.addCleanup(wrapper.close_pool)
+        
+        self.assertIsInstance(pool, ConnectionPool)
+        self.assertEqual((pool.min_size, pool.max_size), (1, 4))
+        self.assertEqual(pool._check, ConnectionPool.check_connection)
+    
+    def test_connection_stats_endpoint(self):
+        """Test that connection statistics are exposed to admins only"""
+        from django.test import Client
+        
+        user = User.objects.create_user(email='test@example.com', name='Test User', password='testpass123')
+        admin_user = User.objects.create_user(
+            email='admin@example.com', name='Admin User', password='adminpass123', is_staff=True
+        )
+        client = Client()
+        
+        client.force_login(user)
+        self.assertEqual(client.get('/api/admin/db-connections/').status_code, 403)
+        
+        client.force_login(admin_user)
+        response = client.get('/api/admin/db-connections/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('connections_opened', response.json()['default'])
+
+
+class RequestMetricsTest(TestCase):
+    """Test cases for per-route request metrics"""
+    
+    def setUp(self):
+        """Set up test data"""
+        from medhashaala import metrics
+        
+        self.metrics = metrics
+        metrics.reset()
+        
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            name='Test User',
+            password='testpass123'
+        )
+        SubscriptionPlan.objects.create(
+            name='Basic',
+            features=['feature1'],
+            price=Decimal('9.99'),
+            is_active=True
+        )
+    
+    def test_records_route_latency_and_sql(self):
+        """Test that requests are recorded per resolved route"""
+        from django.test import Client
+        
+        client = Client()
+        client.force_login(self.user)
+        response = client.get('/api/plans/')
+        
+        record = self.metrics.snapshot()[('plan-list', 'GET')]
+        self.assertEqual(record[self.metrics.COUNT], 1)
+        self.assertEqual(record[self.metrics.STATUSES], {'200': 1})
+        self.assertGreater(record[self.metrics.QUERIES], 0)
+        self.assertGreater(record[self.metrics.SERIALIZE_TIME], 0)
+        self.assertGreater(record[self.metrics.RENDER_TIME], 0)
+        self.assertEqual(record[self.metrics.BYTES], len(response.content))
+    
+    def test_nested_serialization_counts_once(self):
+        """Test that serialization nested in another one is not counted twice"""
+        import time
+        
+        self.metrics.take_serialize_time()
+        started = time.perf_counter()
+        with self.metrics.serializing():
+            with self.metrics.serializing():
+                time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        self.assertLessEqual(self.metrics.take_serialize_time(), elapsed)
+        self.assertEqual(self.metrics.take_serialize_time(), 0)
+    
+    def test_metrics_endpoint_renders_prometheus_text(self):
+        """Test the /metrics endpoint"""
+        from django.test import Client
+        
+        client = Client()
+        client.force_login(self.user)
+        client.get('/api/plans/')
+        
+        # Without a token metrics are only served in DEBUG
+        self.assertEqual(client.get('/metrics').status_code, 403)
+        with self.settings(DEBUG=True):
+            response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('# TYPE medhashaala_http_request_duration_seconds histogram', body)
+        self.assertIn(
+            'medhashaala_http_request_duration_seconds_count{route="plan-list",method="GET"} 1', body
+        )
+        self.assertIn('medhashaala_http_requests_total{route="plan-list",method="GET",status="200"} 1', body)
+        self.assertIn('medhashaala_serialize_seconds_total{route="plan-list",method="GET"}', body)
+        
+        with self.settings(METRICS={'TOKEN': 'secret'}):
+            self.assertEqual(client.get('/metrics').status_code, 401)
+            response = client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+    
+    def test_multiprocess_totals_are_merged(self):
+        """Test that totals published by other workers are included"""
+        import json
+        import tempfile
+        from pathlib import Path
+        
+        self.metrics.record_request('plan-list', 'GET', 200, 0.02, queries=2)
+        with tempfile.TemporaryDirectory() as directory:
+            other = self.metrics._new_record()
+            other[self.metrics.COUNT] = 3
+            other[self.metrics.QUERIES] = 6
+            other[self.metrics.STATUSES] = {'200': 3}
+            Path(directory, '99999.json').write_text(json.dumps([['plan-list', 'GET', other]]))
+            
+            with self.settings(METRICS={'MULTIPROCESS_DIR': directory}):
+                totals = self.metrics.collect()
+        
+        record = totals[('plan-list', 'GET')]
+        self.assertEqual(record[self.metrics.COUNT], 4)
+        self.assertEqual(record[self.metrics.QUERIES], 8)
+        self.assertEqual(record[self.metrics.STATUSES], {'200': 4})
+
+
+class BenchmarkReportTest(TestCase):
+    """Test cases for the API benchmark report helpers"""
+    
+    def test_in_process_server_error_is_a_status(self):
+        """Test that a failing view is reported as a 500, not raised into the run"""
+        from unittest import mock
+        from django.db import OperationalError
+        from rest_framework_simplejwt.tokens import AccessToken
+        from medhashaala.benchmark import InProcessTransport
+        
+        user = User.objects.create_user(email='test@example.com', name='Test User', password='testpass123')
+        token = str(AccessToken.for_user(user))
+        with mock.patch('subscriptions.views.SubscriptionPlanViewSet.list', side_effect=OperationalError('locked')), \
+                self.assertLogs('django.request', 'ERROR'):
+            status, _ = InProcessTransport().request('GET', '/api/plans/', token=token)
+        self.assertEqual(status, 500)
+    
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        from medhashaala.benchmark import percentile
+        
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+    
+    def test_find_regressions(self):
+        """Test that only changes above the threshold are regressions"""
+        from medhashaala.benchmark import find_regressions
+        
+        baseline = {'endpoints': {
+            'plan-list': {'p95_ms': 10.0, 'throughput_rps': 100.0},
+            'jwt-create': {'p95_ms': 50.0, 'throughput_rps': 20.0},
+        }}
+        report = {'endpoints': {
+            'plan-list': {'p95_ms': 11.0, 'throughput_rps': 95.0},
+            'jwt-create': {'p95_ms': 80.0, 'throughput_rps': 12.0},
+            'user-me': {'p95_ms': 5.0, 'throughput_rps': 200.0},
+        }}
+        
+        regressions = find_regressions(report, baseline, threshold=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(all(regression.startswith('jwt-create') for regression in regressions))
+
+
+class SeedLoadDataCommandTest(TestCase):
+    """Test cases for the seed_load_data management command"""
+    
+    def seed(self, **options):
+        from io import StringIO
+        from django.core.management import call_command
+        
+        call_command('seed_load_data', stdout=StringIO(), **options)
+        users = User.objects.filter(email__endswith='@load.medhashaala.test')
+        return list(users.order_by('email').values_list('id', 'email', 'phone', 'subscription_plan__name'))
+    
+    def test_generates_users_and_histories(self):
+        """Test that users get unique identities and valid subscription histories"""
+        users = self.seed(users=60, batch_size=25)
+        
+        self.assertEqual(len(users), 60)
+        self.assertEqual(len({email for _, email, _, _ in users}), 60)
+        self.assertEqual(len({phone for _, _, phone, _ in users}), 60)
+        self.assertEqual(SubscriptionPlan.objects.count(), 3)
+        
+        statuses = set(UserSubscription.objects.values_list('status', flat=True))
+        self.assertEqual(statuses, {'active', 'expired', 'cancelled'})
+        for subscription in UserSubscription.objects.exclude(status='active'):
+            self.assertLess(subscription.end_date, timezone.now())
+            self.assertEqual(subscription.created_at, subscription.start_date)
+        
+        # Users point at the plan of their active subscription
+        for subscription in UserSubscription.objects.filter(status='active').select_related('user'):
+            self.assertEqual(subscription.user.subscription_plan_id, subscription.plan_id)
+        
+        # One shared hash per batch
+        self.assertEqual(User.objects.filter(email__endswith='@load.medhashaala.test')
+                         .values('password').distinct().count(), 3)
+    
+    def test_same_seed_gives_same_data(self):
+        """Test that generation is deterministic for a fixed seed"""
+        first = self.seed(users=20, seed=7)
+        second = self.seed(users=20, seed=7, clear=True)
+        self.assertEqual(first, second)
+        
+        self.seed(users=10, seed=7, start=20)
+        self.assertEqual(User.objects.filter(email__endswith='@load.medhashaala.test').count(), 30)
+
+
+# Query and payload budgets per endpoint, checked at every dataset size in
+# QUERY_BUDGET_SIZES. 'queries' is the maximum number of SQL queries for the
+# request and must not grow with the number of rows on the page. The
+# response may be at most 'base_bytes' plus 'bytes_per_row' for every row.
+QUERY_BUDGET_SIZES = (1, 5, 20)
+
+QUERY_BUDGETS = {
+    # name: (method, url, client, queries, base_bytes, bytes_per_row)
+    'plan-list': ('get', '/api/plans/', 'user', 4, 100, 250),
+    'plan-list-admin': ('get', '/api/plans/', 'admin', 4, 100, 250),
+    'user-subscription-list': ('get', '/api/user-subscriptions/', 'user', 3, 0, 420),
+    'user-subscription-my-subscription': ('get', '/api/user-subscriptions/my_subscription/', 'user', 3, 0, 420),
+    'admin-subscription-list': ('get', '/api/admin/subscriptions/', 'admin', 4, 100, 560),
+    'customuser-list': ('get', '/api/auth/users/', 'admin', 5, 100, 620),
+    'customuser-me': ('get', '/api/auth/users/me/', 'user', 4, 0, 600),
+    'admin-changelist-usersubscription': ('get', '/admin/subscriptions/usersubscription/', 'admin', 6, 19000, 700),
+    'admin-changelist-subscriptionplan': ('get', '/admin/subscriptions/subscriptionplan/', 'admin', 5, 18000, 700),
+    'admin-changelist-customuser': ('get', '/admin/accounts/customuser/', 'admin', 6, 19000, 900),
+}
+
+
+class QueryBudgetTest(TestCase):
+    """Performance tests enforcing the per-endpoint budgets in QUERY_BUDGETS"""
+    
+    def setUp(self):
+        """Set up test data"""
+        from django.test import Client
+        
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            name='Test User',
+            password='testpass123'
+        )
+        self.admin_user = User.objects.create_user(
+            email='admin@example.com',
+            name='Admin User',
+            password='adminpass123',
+            is_staff=True,
+            is_superuser=True
+        )
+        self.plans = [
+            SubscriptionPlan.objects.create(name=name, features=features, price=Decimal(price), is_active=True)
+            for name, features, price in [
+                ('Basic', ['basic_access'], '1.00'),
+                ('Standard', ['basic_access', 'standard_queries'], '9.99'),
+                ('Premium', ['basic_access', 'unlimited_queries', 'priority_support'], '19.99'),
+            ]
+        ]
+        self.user.subscription_plan = self.plans[0]
+        self.user.save()
+        UserSubscription.objects.create(user=self.user, plan=self.plans[0], status='active')
+        
+        self.clients = {'user': Client(), 'admin': Client()}
+        self.clients['user'].force_login(self.user)
+        self.clients['admin'].force_login(self.admin_user)
+        self.rows = 2
+        # Workers load the plan catalog at warm-up (throttling reads it)
+        from .catalog import load_plan_catalog
+        load_plan_catalog()
+    
+    def grow_dataset(self, size):
+        """Add users with subscription histories until there are ``size`` of them"""
+        while self.rows < size:
+            self.rows += 1
+            plan = self.plans[self.rows % len(self.plans)]
+            user = User.objects.create_user(
+                email=f'user{self.rows}@example.com',
+                name=f'User {self.rows}',
+                password='testpass123',
+                subscription_plan=plan
+            )
+            UserSubscription.objects.create(user=user, plan=plan, status='active')
+            UserSubscription.objects.create(user=user, plan=self.plans[0], status='expired')
+    
+    def capture_queries(self, call):
+        """Run ``call`` and return its response and the SQL it ran, with stack traces"""
+        import traceback
+        from django.conf import settings
+        from django.db import connection
+        
+        queries = []
+        base_dir = str(settings.BASE_DIR)
+        
+        def record(execute, sql, params, many, context):
+            stack = [
+                frame for frame in traceback.extract_stack()[:-1]
+                if frame.filename.startswith(base_dir)
+                and not frame.filename.endswith(('/tests.py', '/manage.py'))
+            ]
+            queries.append((sql, ''.join(traceback.format_list(stack[-4:]))))
+            return execute(sql, params, many, context)
+        
+        with connection.execute_wrapper(record):
+            response = call()
+        return response, queries
+    
+    def format_queries(self, queries):
+        return '\n'.join(
+            f'{number}. {sql}\n{stack}' for number, (sql, stack) in enumerate(queries, start=1)
+        )
+    
+    def count_rows(self, response):
+        """Return the number of objects rendered in a response"""
+        if response['Content-Type'] != 'application/json':
+            # Admin changelist: one selection checkbox per row
+            return response.content.count(b'name="_selected_action"')
+        data = response.json()
+        if isinstance(data, dict) and 'results' in data:
+            return len(data['results'])
+        if isinstance(data, list):
+            return len(data)
+        return 1
+    
+    def test_query_budgets(self):
+        """Test every endpoint against its query and payload budget at several sizes"""
+        from .entitlements import evict as evict_entitlements
+        
+        results = {}
+        for size in QUERY_BUDGET_SIZES:
+            self.grow_dataset(size)
+            for name, (method, url, client, max_queries, base_bytes, bytes_per_row) in QUERY_BUDGETS.items():
+                with self.subTest(endpoint=name, size=size):
+                    # Measure the cold path: entitlement snapshots would hide its queries
+                    evict_entitlements()
+                    response, queries = self.capture_queries(
+                        lambda: getattr(self.clients[client], method)(url)
+                    )
+                    self.assertEqual(response.status_code, 200)
+                    self.assertLessEqual(
+                        len(queries), max_queries,
+                        f'{name} ran {len(queries)} queries (budget {max_queries}) '
+                        f'with {size} rows:\n{self.format_queries(queries)}'
+                    )
+                    if name in results:
+                        self.assertEqual(
+                            len(queries), results[name],
+                            f'{name} ran {results[name]} queries before and {len(queries)} '
+                            f'with {size} rows:\n{self.format_queries(queries)}'
+                        )
+                    results[name] = len(queries)
+                    
+                    rows = self.count_rows(response)
+                    max_bytes = base_bytes + bytes_per_row * rows
+                    self.assertLessEqual(
+                        len(response.content), max_bytes,
+                        f'{name} returned {len(response.content)} bytes for {rows} rows '
+                        f'(budget {base_bytes} + {bytes_per_row} per row)'
+                    )
+
+
+class OpenAPISchemaTest(TestCase):
+    """Test cases for the prebuilt OpenAPI schema"""
+    
+    def setUp(self):
+        """Set up test data"""
+        import tempfile
+        from pathlib import Path
+        from medhashaala import schema
+        
+        self.schema = schema
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.artifact = Path(directory.name, 'openapi-schema.json')
+        schema.clear_schema_cache()
+        self.addCleanup(schema.clear_schema_cache)
+    
+    def test_schema_served_with_etag(self):
+        """Test that the schema is served from the artifact with an ETag"""
+        from django.test import Client
+        
+        self.artifact.write_bytes(b'{"openapi": "3.0.3"}')
+        client = Client()
+        with self.settings(OPENAPI_SCHEMA={'ARTIFACT': self.artifact}):
+            response = client.get('/api/schema/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b'{"openapi": "3.0.3"}')
+            etag = response['ETag']
+            
+            response = client.get('/api/schema/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+    
+    def test_schema_generated_once_when_artifact_missing(self):
+        """Test the lazy per-process fallback"""
+        from unittest import mock
+        
+        with self.settings(OPENAPI_SCHEMA={'ARTIFACT': self.artifact}), \
+                mock.patch.object(self.schema, 'generate_schema', return_value=b'{}') as generate:
+            self.schema.load_schema()
+            self.schema.load_schema()
+        self.assertEqual(generate.call_count, 1)
+        
+        self.schema.clear_schema_cache()
+        with self.settings(OPENAPI_SCHEMA={'ARTIFACT': self.artifact, 'GENERATE_ON_MISS': False}):
+            with self.assertRaises(FileNotFoundError):
+                self.schema.load_schema()
+    
+    def test_check_command_detects_stale_artifact(self):
+        """Test building and checking the artifact"""
+        from io import StringIO
+        from django.core.management import CommandError, call_command
+        
+        call_command('openapi_schema', file=str(self.artifact), stdout=StringIO())
+        self.assertIn(b'/api/plans/', self.artifact.read_bytes())
+        call_command('openapi_schema', file=str(self.artifact), check=True, stdout=StringIO())
+        
+        self.artifact.write_bytes(self.artifact.read_bytes().replace(b'/api/plans/', b'/api/old-plans/'))
+        with self.assertRaises(CommandError):
+            call_command('openapi_schema', file=str(self.artifact), check=True, stdout=StringIO())
+
+
+class StartupProfileTest(TestCase):
+    """Test cases for the startup profile and lean startup"""
+    
+    def test_parse_importtime(self):
+        """Test parsing -X importtime output"""
+        from medhashaala.startup import parse_importtime, summarize_imports
+        
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       300 |        300 |   rest_framework.fields\n'
+            'import time:      1200 |       1500 | rest_framework.serializers\n'
+            'import time:       500 |        500 | yaml\n'
+        )
+        entries = parse_importtime(output)
+        self.assertEqual(entries[0], ('rest_framework.fields', 300, 300, 1))
+        self.assertEqual(len(entries), 3)
+        
+        summary = summarize_imports(entries)
+        self.assertEqual(summary['total_ms'], 2.0)
+        self.assertEqual(summary['packages_ms'][0], ('rest_framework', 1.5))
+        self.assertEqual(summary['imports_ms'], [('rest_framework.serializers', 1.5), ('yaml', 0.5)])
+    
+    def test_lean_startup_defers_admin_and_schema_inspector(self):
+        """Test profiling a lean worker start in a fresh interpreter"""
+        import json
+        from io import StringIO
+        from django.core.management import call_command
+        
+        out = StringIO()
+        call_command('startup_profile', lean=True, runs=1, json=True, stdout=out)
+        result = json.loads(out.getvalue())
+        
+        self.assertTrue(result['lean'])
+        self.assertEqual(result['status'], '200 OK')
+        self.assertEqual(
+            set(result['phases_ms']), {'settings', 'apps', 'urlconf', 'middleware', 'first_response'}
+        )
+        self.assertIn('admin', result['ready_ms'])
+        self.assertFalse(result['loaded']['django.contrib.auth.admin'])
+        self.assertFalse(result['loaded']['drf_spectacular.openapi'])
+        self.assertGreater(result['imports']['modules'], 0)
+    
+    def test_lazy_auto_schema(self):
+        """Test that the placeholder inspector switches to drf_spectacular's once it is loaded"""
+        import sys
+        from unittest import mock
+        from drf_spectacular.openapi import AutoSchema
+        from medhashaala.schema import LazyAutoSchema
+        
+        self.assertIsInstance(LazyAutoSchema(), AutoSchema)
+        with mock.patch.dict(sys.modules):
+            del sys.modules['drf_spectacular.openapi']
+            self.assertNotIsInstance(LazyAutoSchema(), AutoSchema)
+
+
+def failing_warmup_step():
+    raise RuntimeError('database asleep')
+
+
+class WarmupTest(TestCase):
+    """Test cases for worker warm-up and readiness"""
+    
+    def setUp(self):
+        """Set up test data"""
+        from medhashaala import warmup
+        
+        self.warmup = warmup
+        warmup.reset()
+        self.addCleanup(warmup.reset)
+        SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('0.00'))
+    
+    def test_warm_up_then_ready(self):
+        """Test that every step runs and the worker reports ready"""
+        from django.test import Client
+        
+        client = Client()
+        self.assertTrue(self.warmup.warm_up())
+        
+        response = client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        steps = response.json()['steps']
+        self.assertGreater(steps['medhashaala.warmup.load_urlconfs']['result'], 10)
+        self.assertEqual(steps['medhashaala.warmup.build_serializers']['result'], 6)
+        self.assertEqual(steps['medhashaala.warmup.open_connections']['result'], {'default': True})
+        self.assertEqual(steps['subscriptions.catalog.load_plan_catalog']['result'], 1)
+    
+    def test_not_ready_until_warm_up_succeeds(self):
+        """Test the readiness gate when a step fails"""
+        from unittest import mock
+        from django.test import Client
+        
+        client = Client()
+        warmup_settings = {'STEPS': ['subscriptions.tests.failing_warmup_step']}
+        with self.settings(WARMUP=warmup_settings), \
+                mock.patch.object(self.warmup, 'ensure_warm_up') as ensure_warm_up:
+            response = client.get('/readyz')
+            self.assertEqual(response.status_code, 503)
+            ensure_warm_up.assert_called_once()
+            
+            with self.assertLogs('medhashaala.warmup', 'ERROR'):
+                self.assertFalse(self.warmup.warm_up())
+            response = client.get('/readyz')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(
+                response.json()['steps']['subscriptions.tests.failing_warmup_step']['error'], 'database asleep'
+            )
+
+
+class PlanCatalogTest(TestCase):
+    """Test cases for the in-process plan catalog"""
+    
+    def setUp(self):
+        """Set up test data"""
+        from subscriptions import catalog
+        
+        self.catalog = catalog
+        self.plan = SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('0.00'))
+        self.user = User.objects.create_user(email='catalog@example.com', password='testpass123')
+        UserSubscription.objects.create(user=self.user, plan=self.plan, status='active')
+        catalog.clear_plan_catalog()
+    
+    def test_entitlement_checks_use_catalog(self):
+        """Test that plans are read from memory once loaded"""
+        self.assertEqual(self.catalog.load_plan_catalog(), 1)
+        with self.assertNumQueries(1):
+            self.assertTrue(has_feature_access(self.user, 'feature1'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.catalog.get_plan(self.plan.pk), self.plan)
+    
+    def test_saving_plan_clears_catalog(self):
+        """Test that plan changes are picked up"""
+        self.catalog.load_plan_catalog()
+        self.plan.features = ['feature1', 'feature2']
+        self.plan.save()
+        self.assertTrue(has_feature_access(self.user, 'feature2'))
+        
+        other = SubscriptionPlan.objects.create(name='Premium', features=[], price=Decimal('19.99'))
+        self.assertEqual(self.catalog.get_plan(other.pk), other)
+
+
+class ProjectionEquivalenceTest(TestCase):
+    """Test cases checking the projection read path against UserSubscriptionReadSerializer"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.plans = [
+            SubscriptionPlan.objects.create(name='Basic', features=[], price=Decimal('0.00')),
+            SubscriptionPlan.objects.create(
+                name='Premium', features=['feature1', 'feature2'], price=Decimal('1234.50'), is_active=False
+            ),
+        ]
+        now = timezone.now()
+        for index, (status, end_date) in enumerate([
+            ('active', None),
+            ('active', now + timedelta(days=10, hours=3)),
+            ('active', now - timedelta(minutes=1)),
+            ('expired', now - timedelta(days=40)),
+            ('cancelled', now + timedelta(days=2)),
+        ]):
+            user = User.objects.create_user(email=f'projection{index}@example.com', password='testpass123')
+            UserSubscription.objects.create(
+                user=user, plan=self.plans[index % 2], status=status, end_date=end_date
+            )
+    
+    def assertSameOutput(self, queryset):
+        from rest_framework.renderers import JSONRenderer
+        from subscriptions.projections import SUBSCRIPTION_READ
+        from subscriptions.serializers import UserSubscriptionReadSerializer
+        
+        expected = UserSubscriptionReadSerializer(queryset.select_related('plan'), many=True).data
+        projected = SUBSCRIPTION_READ.render_many(queryset)
+        self.assertEqual(len(projected), 5)
+        # Same keys, key order, values and JSON types
+        self.assertEqual(JSONRenderer().render(projected), JSONRenderer().render(expected))
+    
+    def test_same_output_as_serializer(self):
+        """Test every status, end date and price shape"""
+        from unittest import mock
+        
+        frozen = timezone.now()
+        with mock.patch('django.utils.timezone.now', return_value=frozen):
+            self.assertSameOutput(UserSubscription.objects.all())
+    
+    def test_same_output_in_other_time_zone(self):
+        """Test that datetimes are rendered in the current time zone"""
+        from unittest import mock
+        
+        frozen = timezone.now()
+        with mock.patch('django.utils.timezone.now', return_value=frozen), timezone.override('Asia/Kolkata'):
+            self.assertSameOutput(UserSubscription.objects.all())
+    
+    def test_my_subscription_endpoint(self):
+        """Test that the endpoint serves the projected subscription"""
+        from django.test import Client
+        from subscriptions.serializers import UserSubscriptionReadSerializer
+        
+        subscription = UserSubscription.objects.filter(end_date__isnull=True).get()
+        client = Client()
+        client.force_login(subscription.user)
+        with self.assertNumQueries(3):
+            response = client.get('/api/user-subscriptions/my_subscription/')
+        self.assertEqual(response.status_code, 200)
+        expected = UserSubscriptionReadSerializer(subscription).data
+        self.assertEqual(response.json(), {**expected, 'plan': dict(expected['plan'])})
+    
+    def test_unsupported_field(self):
+        """Test that fields without a column or known computation are rejected"""
+        from django.core.exceptions import ImproperlyConfigured
+        from rest_framework import serializers
+        from subscriptions.projections import Projection
+        
+        class MethodSerializer(serializers.ModelSerializer):
+            label = serializers.SerializerMethodField()
+            
+            class Meta:
+                model = UserSubscription
+                fields = ['id', 'label']
+            
+            def get_label(self, obj):
+                return str(obj)
+        
+        with self.assertRaises(ImproperlyConfigured):
+            Projection(MethodSerializer).compile()
+
+
+class SparseFieldsTest(TestCase):
+    """Test cases for ?fields= and ?expand= on plans, subscriptions and users"""
+    
+    def setUp(self):
+        """Set up test data"""
+        from django.test import Client
+        
+        self.plan = SubscriptionPlan.objects.create(
+            name='Basic', features=['basic_access'], price=Decimal('9.99'), is_active=True
+        )
+        self.user = User.objects.create_user(email='user@example.com', name='User', password='testpass123')
+        self.user.subscription_plan = self.plan
+        self.user.save()
+        self.admin_user = User.objects.create_user(
+            email='admin@example.com', name='Admin', password='adminpass123', is_staff=True, is_superuser=True
+        )
+        self.subscription = UserSubscription.objects.create(
+            user=self.user, plan=self.plan, status='active', end_date=timezone.now() + timedelta(days=30)
+        )
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.admin_client = Client()
+        self.admin_client.force_login(self.admin_user)
+    
+    def test_fields_on_own_subscription(self):
+        """Test that only the requested fields are rendered"""
+        response = self.client.get('/api/user-subscriptions/my_subscription/?fields=status,plan.name')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'active', 'plan': {'name': 'Basic'}})
+        
+        response = self.client.get('/api/user-subscriptions/?fields=id,is_active')
+        self.assertEqual(response.json(), {'id': self.subscription.id, 'is_active': True})
+    
+    def test_fields_skip_plan_join(self):
+        """Test that the plan is neither joined nor loaded when it is not rendered"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.admin_client.get('/api/admin/subscriptions/?fields=id,status,end_date')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'status', 'end_date'})
+        select = [query['sql'] for query in queries.captured_queries if 'subscriptions_usersubscription' in query['sql']][-1]
+        self.assertNotIn('JOIN', select)
+        self.assertNotIn('start_date', select)
+    
+    def test_expand_user(self):
+        """Test that an expandable relation is rendered as a nested object"""
+        response = self.admin_client.get('/api/admin/subscriptions/?expand=user')
+        self.assertEqual(response.status_code, 200)
+        user = response.json()['results'][0]['user']
+        self.assertEqual(user['email'], 'user@example.com')
+        self.assertEqual(set(user), {'id', 'email', 'phone', 'name', 'role'})
+        
+        response = self.admin_client.get('/api/admin/subscriptions/?expand=user&fields=id,user.email')
+        self.assertEqual(response.json()['results'][0], {'id': self.subscription.id, 'user': {'email': 'user@example.com'}})
+    
+    def test_unknown_fields_rejected(self):
+        """Test that unknown fields and relations answer 400"""
+        response = self.client.get('/api/plans/?fields=id,secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.json())
+        response = self.client.get('/api/user-subscriptions/my_subscription/?expand=plan')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('expand', response.json())
+    
+    def test_plan_fields(self):
+        """Test sparse plan listings"""
+        response = self.client.get('/api/plans/?fields=name,feature_count')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [{'name': 'Basic', 'feature_count': 1}])
+    
+    def test_users_fields_and_expand(self):
+        """Test sparse user profiles and the expanded subscription history"""
+        response = self.client.get('/api/auth/users/me/?fields=id,email')
+        self.assertEqual(response.json(), {'id': str(self.user.id), 'email': 'user@example.com'})
+        
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/auth/users/me/?expand=subscriptions&fields=email,subscriptions.status')
+        self.assertEqual(response.json(), {'email': 'user@example.com', 'subscriptions': [{'status': 'active'}]})
+        
+        response = self.admin_client.get('/api/auth/users/?fields=email,subscription_plan_name')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn({'email': 'user@example.com', 'subscription_plan_name': 'Basic'}, response.json()['results'])
+    
+    def test_writes_ignore_fields(self):
+        """Test that ?fields= does not drop input fields of a write"""
+        response = self.admin_client.post(
+            '/api/plans/?fields=id',
+            {'name': 'Premium', 'features': ['basic_access'], 'price': '5.00', 'is_active': True},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['name'], 'Premium')
+
+
+class SubscriptionQuerySetTest(TestCase):
+    """Test cases for the SQL-side is_active / remaining_days queries"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.plan = SubscriptionPlan.objects.create(
+            name='Basic', features=['basic_access'], price=Decimal('9.99'), is_active=True
+        )
+        self.now = timezone.now()
+        shapes = [
+            ('active', None),
+            ('active', timedelta(days=3, hours=2)),
+            ('active', timedelta(days=20)),
+            ('active', timedelta(hours=5)),
+            ('active', -timedelta(days=2)),
+            ('expired', timedelta(days=5)),
+            ('cancelled', None),
+        ]
+        self.subscriptions = []
+        for index, (status, offset) in enumerate(shapes):
+            user = User.objects.create_user(email=f'user{index}@example.com', name=f'User {index}', password='testpass123')
+            self.subscriptions.append(UserSubscription.objects.create(
+                user=user, plan=self.plan, status=status,
+                end_date=None if offset is None else self.now + offset
+            ))
+        self.admin_user = User.objects.create_user(
+            email='admin@example.com', name='Admin', password='adminpass123', is_staff=True, is_superuser=True
+        )
+    
+    def test_annotations_match_properties(self):
+        """Test that active_now and remaining_days agree with the Python properties"""
+        from unittest import mock
+        
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            rows = UserSubscription.objects.with_active_now(self.now).with_remaining_days(self.now)
+            for subscription in rows:
+                self.assertEqual(subscription.active_now, subscription.is_active, subscription.end_date)
+                self.assertEqual(subscription.remaining_days, subscription.get_remaining_days(), subscription.end_date)
+    
+    def test_active_and_inactive(self):
+        """Test filtering on is_active in SQL"""
+        active = {subscription.pk for subscription in self.subscriptions if subscription.is_active}
+        self.assertEqual(set(UserSubscription.objects.active().values_list('pk', flat=True)), active)
+        self.assertEqual(
+            set(UserSubscription.objects.inactive().values_list('pk', flat=True)),
+            {subscription.pk for subscription in self.subscriptions} - active
+        )
+    
+    def test_expiring_within(self):
+        """Test that only active subscriptions ending in the window are returned"""
+        expiring = UserSubscription.objects.expiring_within(7, now=self.now)
+        self.assertEqual(set(expiring), {self.subscriptions[1], self.subscriptions[3]})
+        self.assertEqual(UserSubscription.objects.expiring_within(timedelta(days=30), now=self.now).count(), 3)
+    
+    def test_api_filters(self):
+        """Test ?active= and ?expires_within= on the admin listing"""
+        from django.test import Client
+        
+        client = Client()
+        client.force_login(self.admin_user)
+        response = client.get('/api/admin/subscriptions/?active=true')
+        self.assertEqual(response.json()['count'], 4)
+        response = client.get('/api/admin/subscriptions/?active=false')
+        self.assertEqual(response.json()['count'], 3)
+        response = client.get('/api/admin/subscriptions/?expires_within=7')
+        self.assertEqual(
+            {item['id'] for item in response.json()['results']},
+            {self.subscriptions[1].id, self.subscriptions[3].id}
+        )
+        response = client.get('/api/admin/subscriptions/?expires_within=soon')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('expires_within', response.json())
+    
+    def test_api_remaining_days(self):
+        """Test that the admin listing renders remaining_days computed in SQL"""
+        from unittest import mock
+        from django.test import Client
+        
+        client = Client()
+        client.force_login(self.admin_user)
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            with mock.patch.object(UserSubscription, 'get_remaining_days', side_effect=AssertionError):
+                response = client.get('/api/admin/subscriptions/')
+            expected = {subscription.id: subscription.get_remaining_days() for subscription in self.subscriptions}
+        self.assertEqual(
+            {item['id']: item['remaining_days'] for item in response.json()['results']},
+            expected
+        )
+        # Writes render the saved instance without the annotation
+        subscription = self.subscriptions[2]
+        response = client.post(f'/api/admin/subscriptions/{subscription.id}/cancel/')
+        self.assertEqual(response.json()['remaining_days'], subscription.get_remaining_days())
+    
+    def test_admin_changelist_filters(self):
+        """Test the admin filters and the sortable is_active column"""
+        from django.test import Client
+        
+        client = Client()
+        client.force_login(self.admin_user)
+        for query in ('currently_active=yes', 'expires_within=7', 'o=4'):
+            response = client.get(f'/admin/subscriptions/usersubscription/?{query}')
+            self.assertEqual(response.status_code, 200, query)
+        response = client.get('/admin/subscriptions/usersubscription/?expires_within=7')
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+
+METERING_TEST_SETTINGS = {
+    'ENABLED': True,
+    'FLUSH_INTERVAL': 3600,
+    'MAX_PENDING': 10000,
+    'ALLOWANCE_TTL': 3600,
+    'QUOTAS': {'queries': {'unlimited_queries': None, 'standard_queries': 5, 'limited_queries': 3}},
+}
+
+
+@override_settings(METERING=METERING_TEST_SETTINGS)
+class MeteringTest(TestCase):
+    """Test cases for write-behind usage metering and quotas"""
+    
+    def setUp(self):
+        """Set up test data"""
+        from subscriptions import metering
+        from subscriptions.catalog import clear_plan_catalog
+        
+        metering.reset()
+        clear_plan_catalog()
+        self.basic = SubscriptionPlan.objects.create(
+            name='Basic', features=['basic_access', 'limited_queries'], price=Decimal('0.00')
+        )
+        self.premium = SubscriptionPlan.objects.create(
+            name='Premium', features=['basic_access', 'unlimited_queries'], price=Decimal('19.99')
+        )
+        self.user = User.objects.create_user(email='user@example.com', name='User', password='testpass123')
+        self.other = User.objects.create_user(email='other@example.com', name='Other', password='testpass123')
+        self.admin_user = User.objects.create_user(
+            email='admin@example.com', name='Admin', password='adminpass123', is_staff=True, is_superuser=True
+        )
+        UserSubscription.objects.create(user=self.user, plan=self.basic, status='active')
+        UserSubscription.objects.create(user=self.other, plan=self.premium, status='active')
+    
+    def tearDown(self):
+        from subscriptions import metering
+        
+        metering.reset()
+    
+    def test_write_behind(self):
+        """Test that usage is counted in memory and flushed as increments"""
+        from subscriptions.metering import flush, record_usage
+        from subscriptions.models import UsageRecord
+        
+        with self.assertNumQueries(0):
+            for _ in range(50):
+                record_usage(self.user.pk, 'queries')
+            record_usage(self.other.pk, 'queries', 7)
+        with self.assertNumQueries(1):
+            self.assertEqual(flush(), 2)
+        record_usage(self.user.pk, 'queries', 2)
+        flush()
+        counts = dict(UsageRecord.objects.values_list('user__email', 'count'))
+        self.assertEqual(counts, {'user@example.com': 52, 'other@example.com': 7})
+    
+    def test_flush_interval(self):
+        """Test that recording flushes once the interval has passed"""
+        from subscriptions.metering import record_usage
+        from subscriptions.models import UsageRecord
+        
+        with self.settings(METERING={**METERING_TEST_SETTINGS, 'FLUSH_INTERVAL': 0}):
+            record_usage(self.user.pk, 'queries')
+        self.assertEqual(UsageRecord.objects.get().count, 1)
+    
+    def test_flusher_flushes_idle_worker(self):
+        """Test that the flusher thread flushes every interval without further usage"""
+        import threading
+        from unittest import mock
+        from subscriptions import metering
+        
+        flushed = threading.Event()
+        with self.settings(METERING={**METERING_TEST_SETTINGS, 'FLUSH_INTERVAL': 0.01}), \
+                mock.patch.object(metering, 'flush', side_effect=flushed.set), \
+                mock.patch.object(metering, 'close_old_connections'):
+            flusher = metering.start_flusher()
+            self.assertIs(metering.start_flusher(), flusher)
+            try:
+                self.assertTrue(flushed.wait(5))
+            finally:
+                metering.stop_flusher()
+        self.assertFalse(flusher.is_alive())
+    
+    def test_quota(self):
+        """Test the plan limits and that consuming past the quota is refused"""
+        from subscriptions.metering import QuotaExceeded, allowance, consume
+        
+        self.assertEqual(allowance(self.user.pk, 'queries'), (3, 3))
+        self.assertEqual(allowance(self.other.pk, 'queries'), (None, None))
+        self.assertEqual(allowance(self.admin_user.pk, 'queries'), (0, 0))
+        
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                consume(self.user.pk, 'queries')
+        with self.assertRaises(QuotaExceeded):
+            consume(self.user.pk, 'queries')
+        for _ in range(100):
+            consume(self.other.pk, 'queries')
+    
+    def test_bounded_overshoot(self):
+        """Test that usage of other workers is seen once the snapshot expires"""
+        from subscriptions import metering
+        from subscriptions.models import UsageRecord
+        
+        self.assertEqual(metering.allowance(self.user.pk, 'queries'), (3, 3))
+        # Another worker flushed two calls
+        UsageRecord.objects.create(user=self.user, metric='queries', period=metering.current_period(), count=2)
+        metering.consume(self.user.pk, 'queries')
+        self.assertEqual(metering.allowance(self.user.pk, 'queries'), (3, 2))
+        
+        metering._allowances.clear()
+        self.assertEqual(metering.allowance(self.user.pk, 'queries'), (3, 0))
+    
+    def test_usage_report_endpoint(self):
+        """Test the usage report of the current user and the admin totals"""
+        from django.test import Client
+        from subscriptions.metering import record_usage
+        
+        record_usage(self.user.pk, 'queries', 2)
+        client = Client()
+        client.force_login(self.user)
+        response = client.get('/api/usage/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['plan'], 'Basic')
+        self.assertEqual(data['metrics'], [{'metric': 'queries', 'used': 2, 'limit': 3, 'remaining': 1}])
+        self.assertEqual(client.get(f'/api/usage/?user={self.other.pk}').status_code, 403)
+        
+        admin_client = Client()
+        admin_client.force_login(self.admin_user)
+        response = admin_client.get(f'/api/usage/?user={self.other.pk}')
+        self.assertEqual(response.json()['metrics'][0]['limit'], None)
+        response = admin_client.get('/api/admin/usage/')
+        self.assertEqual(response.json()['metrics'], {'queries': {'total': 2, 'users': 1}})
+        self.assertEqual(admin_client.get('/api/admin/usage/?period=2026').status_code, 400)
+    
+    def test_metered_view(self):
+        """Test that a metered view answers 429 once the quota is used up"""
+        from rest_framework.response import Response
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from rest_framework.views import APIView
+        from subscriptions.metering import MeteredViewMixin
+        
+        class QueryView(MeteredViewMixin, APIView):
+            metered_metric = 'queries'
+            
+            def get(self, request):
+                return Response({'ok': True})
+        
+        factory = APIRequestFactory()
+        statuses = []
+        for _ in range(4):
+            request = factory.get('/query')
+            force_authenticate(request, user=self.user)
+            statuses.append(QueryView.as_view()(request).status_code)
+        self.assertEqual(statuses, [200, 200, 200, 429])
+
+
+RATE_LIMIT_TEST_SETTINGS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    'ANON': '2/min',
+    'DEFAULT': '5/min',
+    'ROLES': {'super_admin': None, 'staff': '100/min'},
+    'FEATURES': {'api_access': '1000/min'},
+    'PLANS': {'Basic': '3/min', 'Premium': '50/min'},
+    'LOCAL_BATCH': 10,
+    'LOCAL_THRESHOLD': 0.5,
+}
+
+
+@override_settings(RATE_LIMITS=RATE_LIMIT_TEST_SETTINGS)
+class RateLimitTest(TestCase):
+    """Test cases for plan-aware sliding-window rate limiting"""
+    
+    def setUp(self):
+        """Set up test data"""
+        from django.core.cache import cache
+        from subscriptions import throttling
+        
+        throttling.reset()
+        cache.clear()
+        self.basic = SubscriptionPlan.objects.create(name='Basic', features=['basic_access'], price=Decimal('0.00'))
+        self.premium = SubscriptionPlan.objects.create(
+            name='Premium', features=['basic_access', 'api_access'], price=Decimal('19.99')
+        )
+        self.user = User.objects.create_user(
+            email='user@example.com', name='User', password='testpass123', subscription_plan=self.basic
+        )
+    
+    def test_rate_for(self):
+        """Test that the rate follows the role, then the plan's features and name"""
+        from django.contrib.auth.models import AnonymousUser
+        from subscriptions.throttling import rate_for
+        
+        self.assertEqual(rate_for(AnonymousUser()), '2/min')
+        self.assertEqual(rate_for(self.user), '3/min')
+        self.user.subscription_plan = self.premium
+        self.assertEqual(rate_for(self.user), '1000/min')
+        self.user.subscription_plan = None
+        self.assertEqual(rate_for(self.user), '5/min')
+        self.user.is_staff = True
+        self.assertEqual(rate_for(self.user), '100/min')
+        self.user.role = 'super_admin'
+        self.assertIsNone(rate_for(self.user))
+    
+    @override_settings(RATE_LIMITS={**RATE_LIMIT_TEST_SETTINGS, 'LOCAL_BATCH': 1})
+    def test_sliding_window(self):
+        """Test that the previous window counts in proportion to its overlap"""
+        from subscriptions.throttling import hit
+        
+        start = 6000 * 60.0
+        results = [hit('rl:test', 10, 60, now=start + index) for index in range(11)]
+        self.assertEqual([allowed for allowed, *_ in results], [True] * 10 + [False])
+        self.assertEqual(results[9][1], 0)
+        # Refused in the first window: wait for the next one, then until enough has slid out
+        self.assertEqual(results[10][3], 56)
+        
+        # Half way through the next window half of the 10 requests still count
+        middle = start + 90
+        results = [hit('rl:test', 10, 60, now=middle) for _ in range(6)]
+        self.assertEqual([allowed for allowed, *_ in results], [True] * 5 + [False])
+        self.assertEqual(results[5][3], 6)
+    
+    def test_local_batches(self):
+        """Test that requests far below the limit are pushed to the cache in batches"""
+        from unittest import mock
+        from django.core.cache import cache
+        from subscriptions.throttling import hit
+        
+        start = 6000 * 60.0
+        with mock.patch.object(cache, 'incr', wraps=cache.incr) as incr:
+            for index in range(30):
+                self.assertTrue(hit('rl:batched', 1000, 60, now=start + index)[0])
+        # The first request, then one push per 10
+        self.assertEqual(incr.call_count, 3)
+        self.assertEqual(cache.get('rl:batched:6000'), 21)
+    
+    def test_throttled_api(self):
+        """Test that the API answers 429 with Retry-After and rate-limit headers"""
+        from django.test import Client
+        
+        client = Client()
+        client.force_login(self.user)
+        responses = [client.get('/api/plans/') for _ in range(4)]
+        self.assertEqual([response.status_code for response in responses], [200, 200, 200, 429])
+        self.assertEqual(responses[0]['X-RateLimit-Limit'], '3')
+        self.assertEqual(responses[0]['X-RateLimit-Remaining'], '2')
+        self.assertEqual(responses[2]['X-RateLimit-Remaining'], '0')
+        self.assertGreaterEqual(int(responses[3]['Retry-After']), 1)
+        self.assertIn('X-RateLimit-Reset', responses[3])
+        
+        # Anonymous clients are limited per IP
+        anonymous = [Client().post('/api/auth/jwt/create/', {}) for _ in range(3)]
+        self.assertEqual([response.status_code for response in anonymous], [400, 400, 429])
+    
+    def test_fast_path_overhead(self):
+        """Test that counting a request locally takes microseconds"""
+        import time
+        from subscriptions.throttling import hit
+        
+        hit('rl:bench', 10 ** 9, 3600)
+        calls = 20000
+        started = time.perf_counter()
+        for _ in range(calls):
+            hit('rl:bench', 10 ** 9, 3600)
+        per_call = (time.perf_counter() - started) / calls
+        self.assertLess(per_call, 50e-6, f'{per_call * 1e6:.1f} µs per request')
+
+
+CIRCUIT_TEST_SETTINGS = {'FAILURE_THRESHOLD': 2, 'RESET_TIMEOUT': 60, 'REFRESH_THREADS': 1}
+
+
+@override_settings(DATABASE_CIRCUIT=CIRCUIT_TEST_SETTINGS)
+class EntitlementFallbackTest(TestCase):
+    """Test cases for serving entitlements while the database is unreachable"""
+    
+    def setUp(self):
+        """Set up test data"""
+        from accounts.authentication import forget_user
+        from medhashaala.resilience import database_breaker
+        from subscriptions.entitlements import evict
+        
+        database_breaker.reset()
+        evict()
+        forget_user()
+        self.plan = SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('9.99'))
+        self.user = User.objects.create_user(
+            email='user@example.com', name='User', password='testpass123', subscription_plan=self.plan
+        )
+        UserSubscription.objects.create(user=self.user, plan=self.plan, end_date=timezone.now() + timedelta(days=10))
+    
+    def tearDown(self):
+        from medhashaala.resilience import database_breaker
+        
+        database_breaker.reset()
+    
+    def get(self, user, path='/api/user-subscriptions/my_subscription/'):
+        from django.test import Client
+        from rest_framework_simplejwt.tokens import AccessToken
+        
+        return Client().get(path, HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+    
+    def test_circuit_breaker(self):
+        """Test that the breaker opens after repeated connection errors and probes again later"""
+        from django.db import OperationalError
+        from medhashaala.resilience import CircuitBreaker, CircuitOpenError
+        
+        breaker = CircuitBreaker('test')
+        with self.assertRaises(ValueError), breaker.guard():
+            raise ValueError('not a connection error')
+        with self.assertLogs('medhashaala.resilience', 'WARNING'):
+            for _ in range(2):
+                with self.assertRaises(OperationalError), breaker.guard():
+                    raise OperationalError('connection refused')
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        calls = []
+        with self.assertRaises(CircuitOpenError), breaker.guard():
+            calls.append(1)
+        self.assertEqual(calls, [])
+        
+        with self.settings(DATABASE_CIRCUIT={**CIRCUIT_TEST_SETTINGS, 'RESET_TIMEOUT': 0}):
+            with breaker.guard():
+                self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+    
+    def test_outage_served_from_snapshot(self):
+        """Test that known users keep their entitlements while the breaker is open"""
+        from medhashaala.resilience import database_breaker
+        
+        response = self.get(self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_active'])
+        
+        database_breaker.record_failure()
+        with self.assertLogs('medhashaala.resilience', 'WARNING'):
+            database_breaker.record_failure()
+        with self.assertNumQueries(0):
+            outage = self.get(self.user)
+            self.assertTrue(has_feature_access(self.user, 'feature1'))
+            self.assertFalse(has_feature_access(self.user, 'feature2'))
+        self.assertEqual(outage.status_code, 200)
+        self.assertEqual(outage.json(), response.json())
+        
+        # Users this worker has not seen, and snapshots past MAX_STALE, fail fast
+        stranger = User.objects.create_user(email='new@example.com', name='New', password='testpass123')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(stranger).status_code, 503)
+        with self.settings(ENTITLEMENTS={'MAX_STALE': -1}):
+            self.assertEqual(self.get(self.user).status_code, 503)
+    
+    def test_changes_evict_snapshots(self):
+        """Test that subscription changes are not hidden by the snapshot"""
+        self.assertTrue(has_feature_access(self.user, 'feature1'))
+        UserSubscription.objects.filter(user=self.user).get().cancel()
+        self.assertFalse(has_feature_access(self.user, 'feature1'))
+
+
+class StaleWhileRevalidateTest(TransactionTestCase):
+    """Test cases for background refreshes of stale snapshots"""
+    
+    def setUp(self):
+        """Set up test data"""
+        from subscriptions.catalog import clear_plan_catalog
+        from subscriptions.entitlements import evict
+        
+        evict()
+        clear_plan_catalog()
+        self.plan = SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('9.99'))
+        self.user = User.objects.create_user(email='user@example.com', name='User', password='testpass123')
+        UserSubscription.objects.create(user=self.user, plan=self.plan)
+    
+    @override_settings(ENTITLEMENTS={'FRESH': 0, 'MAX_STALE': 900}, PLAN_CATALOG={'TTL': 0, 'MAX_STALE': 3600})
+    def test_stale_snapshot_refreshed_in_background(self):
+        """Test that stale snapshots are answered at once and reloaded in the background"""
+        from medhashaala.resilience import wait_for_refreshes
+        from subscriptions.catalog import get_plans
+        from subscriptions.entitlements import get_entitlement
+        
+        self.assertTrue(has_feature_access(self.user, 'feature1'))
+        # Changes that publish no invalidation event
+        UserSubscription.objects.filter(user=self.user).update(status='cancelled')
+        SubscriptionPlan.objects.filter(pk=self.plan.pk).update(features=['feature2'])
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(get_entitlement(self.user.pk)['status'], 'active')
+            self.assertEqual(get_plans()[self.plan.pk].features, ['feature1'])
+        wait_for_refreshes()
+        self.assertIsNone(get_entitlement(self.user.pk))
+        self.assertEqual(get_plans()[self.plan.pk].features, ['feature2'])
+
+
+class SingleFlightTest(TransactionTestCase):
+    """Test cases for coalescing concurrent cache misses"""
+    
+    THREADS = 16
+    
+    def setUp(self):
+        """Set up test data"""
+        from django.core.cache import caches
+        from medhashaala import coalescing
+        from subscriptions.catalog import clear_plan_catalog
+        from subscriptions.entitlements import evict
+        
+        self.plan = SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('9.99'))
+        self.user = User.objects.create_user(email='user@example.com', name='User', password='testpass123')
+        UserSubscription.objects.create(user=self.user, plan=self.plan)
+        evict()
+        clear_plan_catalog()
+        coalescing.reset()
+        caches[coalescing.get_single_flight_setting('CACHE')].clear()
+    
+    def stampede(self, function, table):
+        """Call ``function`` from THREADS threads at once; return the results and the queries on ``table``"""
+        import threading
+        import time
+        from django.db import connection
+        
+        barrier = threading.Barrier(self.THREADS)
+        lock = threading.Lock()
+        results = []
+        queries = []
+        
+        def slow_query(execute, sql, params, many, context):
+            if table in sql:
+                with lock:
+                    queries.append(sql)
+                # Keep the load in flight while the other threads miss
+                time.sleep(0.1)
+            return execute(sql, params, many, context)
+        
+        def request():
+            try:
+                with connection.execute_wrapper(slow_query):
+                    barrier.wait()
+                    result = function()
+                with lock:
+                    results.append(result)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=request) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        return results, queries
+    
+    def test_catalog_stampede_runs_one_query(self):
+        """Test that concurrent misses of the plan catalog share one query"""
+        from medhashaala.coalescing import single_flight_stats
+        from subscriptions.catalog import get_plans
+        
+        results, queries = self.stampede(get_plans, SubscriptionPlan._meta.db_table)
+        
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(results), self.THREADS)
+        self.assertTrue(all(plans[self.plan.pk].name == 'Basic' for plans in results))
+        self.assertEqual(single_flight_stats()['loads'], 1)
+        self.assertEqual(single_flight_stats()['coalesced'], self.THREADS - 1)
+    
+    def test_entitlement_stampede_runs_one_query(self):
+        """Test that concurrent misses of a user's entitlements share one query"""
+        from subscriptions.entitlements import get_entitlement
+        
+        results, queries = self.stampede(lambda: get_entitlement(self.user.pk), UserSubscription._meta.db_table)
+        
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([row['status'] for row in results], ['active'] * self.THREADS)
+    
+    def test_waiters_share_the_error(self):
+        """Test that callers waiting for a failing load get its error without loading again"""
+        import threading
+        from medhashaala.coalescing import single_flight, single_flight_stats
+        
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        errors = []
+        
+        def loader():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            raise RuntimeError('database is down')
+        
+        def request():
+            try:
+                single_flight('failing', loader)
+            except RuntimeError as exc:
+                errors.append(exc)
+        
+        leader = threading.Thread(target=request)
+        leader.start()
+        started.wait(5)
+        waiters = [threading.Thread(target=request) for _ in range(3)]
+        for thread in waiters:
+            thread.start()
+        while single_flight_stats()['coalesced'] < len(waiters):
+            threading.Event().wait(0.005)
+        release.set()
+        for thread in [leader] + waiters:
+            thread.join(5)
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(errors), 4)
+    
+    def test_forget_starts_a_new_load(self):
+        """Test that callers arriving after an invalidation do not join the load in flight"""
+        import threading
+        from medhashaala.coalescing import forget, single_flight
+        
+        started = threading.Event()
+        release = threading.Event()
+        
+        def old_loader():
+            started.set()
+            release.wait(5)
+            return 'old'
+        
+        results = []
+        leader = threading.Thread(target=lambda: results.append(single_flight('key', old_loader, shared=True)))
+        leader.start()
+        started.wait(5)
+        forget('key')
+        
+        self.assertEqual(single_flight('key', lambda: 'new', shared=True), 'new')
+        release.set()
+        leader.join(5)
+        self.assertEqual(results, ['old'])
+        # The detached load did not share its result
+        self.assertEqual(single_flight('key', lambda: 'newer', shared=True), 'newer')
+    
+    @override_settings(SINGLE_FLIGHT={'CACHE': 'ratelimit', 'LOCK_WAIT': 2, 'POLL_INTERVAL': 0.01})
+    def test_workers_share_the_locked_load(self):
+        """Test that a worker waits for the result of the worker holding the lock"""
+        import threading
+        from django.core.cache import caches
+        from medhashaala.coalescing import single_flight, single_flight_stats
+        
+        cache = caches['ratelimit']
+        # Another worker is loading
+        cache.add('sf:shared-key:lock', 'other-worker', 5)
+        threading.Timer(0.05, lambda: cache.set('sf:shared-key:result', 'from other worker', 2)).start()
+        
+        self.assertEqual(single_flight('shared-key', lambda: 'loaded here', shared=True), 'from other worker')
+        self.assertEqual(single_flight_stats()['shared'], 1)
+        self.assertEqual(single_flight_stats()['loads'], 0)
+    
+    @override_settings(SINGLE_FLIGHT={'CACHE': 'ratelimit', 'LOCK_WAIT': 2, 'POLL_INTERVAL': 0.01})
+    def test_worker_loads_when_the_lock_is_released_without_result(self):
+        """Test that a worker loads itself when the lock holder fails"""
+        import threading
+        from django.core.cache import caches
+        from medhashaala.coalescing import single_flight
+        
+        cache = caches['ratelimit']
+        cache.add('sf:shared-key:lock', 'other-worker', 5)
+        threading.Timer(0.05, lambda: cache.delete('sf:shared-key:lock')).start()
+        
+        self.assertEqual(single_flight('shared-key', lambda: 'loaded here', shared=True), 'loaded here')
+
+
+class IdentityMapTest(TestCase):
+    """Test cases for the request-scoped identity map"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.plan = SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('9.99'))
+        self.user = User.objects.create_user(
+            email='user@example.com', name='User', password='testpass123', subscription_plan=self.plan
+        )
+        self.subscription = UserSubscription.objects.create(user=self.user, plan=self.plan)
+    
+    def tearDown(self):
+        from medhashaala import identity_map
+        
+        identity_map.deactivate()
+    
+    def test_pk_lookups_return_one_instance(self):
+        """Test that lookups by primary key and foreign keys load each row once"""
+        from medhashaala import identity_map
+        
+        identity_map.activate()
+        with self.assertNumQueries(3):
+            user = User.objects.get(pk=self.user.pk)
+            self.assertIs(User.objects.get(id=str(self.user.pk)), user)
+            subscription = user.current_subscription
+            self.assertIs(user.current_subscription, subscription)
+            self.assertIs(subscription.plan, user.subscription_plan)
+            self.assertIs(UserSubscription.objects.get(pk=self.subscription.pk), subscription)
+            self.assertIs(subscription.user, user)
+    
+    def test_other_lookups_are_not_cached(self):
+        """Test that filtered and partial lookups still query the database"""
+        from medhashaala import identity_map
+        
+        identity_map.activate()
+        User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(3):
+            User.objects.get(email='user@example.com')
+            User.objects.filter(is_active=True).get(pk=self.user.pk)
+            User.objects.only('email').get(pk=self.user.pk)
+    
+    def test_writes_invalidate(self):
+        """Test that saves and bulk updates drop the entries of their model"""
+        from medhashaala import identity_map
+        
+        identity_map.activate()
+        plan = SubscriptionPlan.objects.get(pk=self.plan.pk)
+        SubscriptionPlan.objects.filter(pk=self.plan.pk).update(features=['feature2'])
+        self.assertEqual(SubscriptionPlan.objects.get(pk=self.plan.pk).features, ['feature2'])
+        
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.current_subscription, self.subscription)
+        self.subscription.cancel()
+        self.assertIsNone(user.current_subscription)
+        UserSubscription.objects.create(user=self.user, plan=plan)
+        self.assertIsNotNone(user.current_subscription)
+    
+    def test_inactive_outside_requests(self):
+        """Test that nothing is cached without an active map"""
+        with self.assertNumQueries(2):
+            user = User.objects.get(pk=self.user.pk)
+            self.assertIsNot(User.objects.get(pk=self.user.pk), user)
+    
+    def test_profile_request_loads_each_row_once(self):
+        """Test that /users/me/ loads the user, plan and subscription once each"""
+        from django.db import connection
+        from django.test import Client
+        from django.test.utils import CaptureQueriesContext
+        from rest_framework_simplejwt.tokens import AccessToken
+        from .catalog import load_plan_catalog
+        
+        # Throttling reads the plan catalog; workers load it at warm-up
+        load_plan_catalog()
+        
+        def profile():
+            with CaptureQueriesContext(connection) as queries:
+                response = Client().get('/api/auth/users/me/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['current_subscription']['plan_name'], 'Basic')
+            return [query['sql'] for query in queries]
+        
+        queries = profile()
+        self.assertEqual(len(queries), len(set(queries)))
+        with modify_settings(MIDDLEWARE={'remove': ['medhashaala.middleware.IdentityMapMiddleware']}):
+            self.assertEqual(len(profile()), len(queries) + 1)
+
+
+class PreparedQueryTest(TestCase):
+    """Test cases for the precompiled hot queries"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.plan = SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('9.99'))
+        self.user = User.objects.create_user(
+            email='user@example.com', phone='+919000000001', name='User', password='testpass123',
+            subscription_plan=self.plan
+        )
+        User.objects.create_user(email='other@example.com', name='Other', password='testpass123')
+        self.subscription = UserSubscription.objects.create(
+            user=self.user, plan=self.plan, end_date=timezone.now() + timedelta(days=30)
+        )
+        UserSubscription.objects.create(user=self.user, plan=self.plan, status='expired')
+    
+    def queries(self):
+        from accounts.queries import USER_BY_EMAIL, USER_BY_PHONE
+        from .queries import ACTIVE_SUBSCRIPTION, ACTIVE_SUBSCRIPTION_ROW, PLAN_BY_ID
+        
+        return [
+            (USER_BY_EMAIL, {'email': 'user@example.com'}),
+            (USER_BY_PHONE, {'phone': '+919000000001'}),
+            (ACTIVE_SUBSCRIPTION, {'user_id': self.user.pk}),
+            (ACTIVE_SUBSCRIPTION, {'user_id': str(self.user.pk)}),
+            (ACTIVE_SUBSCRIPTION_ROW, {'user_id': self.user.pk}),
+            (PLAN_BY_ID, {'plan_id': self.plan.pk}),
+        ]
+    
+    def state(self, result):
+        """Field values of instances (or the rows) as the ORM would load them"""
+        return [
+            {key: value for key, value in vars(item).items() if key != '_state'} if hasattr(item, '_state') else item
+            for item in result
+        ]
+    
+    def test_results_match_the_orm(self):
+        """Test that prepared queries load the same values, with the same types, as the ORM"""
+        for query, values in self.queries():
+            with self.subTest(values=values):
+                expected = list(query.queryset(**values))
+                with self.assertNumQueries(1):
+                    result = query.execute(**values)
+                self.assertEqual(len(result), 1)
+                self.assertEqual(self.state(result), self.state(expected))
+                self.assertEqual(
+                    [type(value) for value in self.state(result)[0].values()],
+                    [type(value) for value in self.state(expected)[0].values()],
+                )
+    
+    def test_no_match(self):
+        """Test that lookups without a match return nothing"""
+        from accounts.queries import USER_BY_EMAIL
+        from .queries import ACTIVE_SUBSCRIPTION
+        
+        self.assertIsNone(USER_BY_EMAIL.first(email='missing@example.com'))
+        self.subscription.cancel()
+        self.assertIsNone(ACTIVE_SUBSCRIPTION.first(user_id=self.user.pk))
+    
+    def test_none_uses_the_orm(self):
+        """Test that None is looked up as NULL, as the ORM does"""
+        from accounts.queries import USER_BY_PHONE
+        
+        self.assertEqual(USER_BY_PHONE.first(phone=None).email, 'other@example.com')
+    
+    def test_compiled_once(self):
+        """Test that the SQL is compiled once per database"""
+        from unittest import mock
+        from .queries import PLAN_BY_ID
+        
+        PLAN_BY_ID.execute(plan_id=self.plan.pk)
+        with mock.patch.object(type(PLAN_BY_ID), '_compile') as compile_query:
+            PLAN_BY_ID.execute(plan_id=self.plan.pk)
+        compile_query.assert_not_called()
+    
+    @override_settings(PREPARED_QUERIES={'ENABLED': False})
+    def test_disabled_falls_back_to_the_orm(self):
+        """Test that the ORM runs the lookups when prepared queries are disabled"""
+        from unittest import mock
+        from .queries import PLAN_BY_ID
+        
+        with mock.patch.object(type(PLAN_BY_ID), 'compile') as compile_query, self.assertNumQueries(1):
+            self.assertEqual(PLAN_BY_ID.first(plan_id=self.plan.pk), self.plan)
+        compile_query.assert_not_called()
+    
+    def test_login_uses_prepared_lookup(self):
+        """Test that logging in with an email or a phone number still works"""
+        from django.test import Client
+        
+        for login in ({'email': 'user@example.com'}, {'phone': '+919000000001'}):
+            response = Client().post('/api/auth/jwt/create/', dict(login, password='testpass123'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['user']['email'], 'user@example.com')
+        response = Client().post('/api/auth/jwt/create/', {'email': 'user@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SubscriptionHistoryTest(TestCase):
+    """Test cases for the append-only subscription history"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.basic = SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('9.99'))
+        self.premium = SubscriptionPlan.objects.create(name='Premium', features=['feature1'], price=Decimal('29.99'))
+        self.user = User.objects.create_user(email='user@example.com', name='User', password='testpass123')
+        self.admin_user = User.objects.create_user(
+            email='admin@example.com', name='Admin User', password='adminpass123', is_staff=True, is_superuser=True
+        )
+    
+    def states(self, user=None):
+        from .models import SubscriptionInterval
+        
+        return [
+            (interval.plan_name, interval.status, interval.valid_to is None)
+            for interval in SubscriptionInterval.objects.filter(user=user or self.user)
+        ]
+    
+    def test_transitions_append_intervals(self):
+        """Test that creating, renewing and cancelling a subscription each close one interval and open the next"""
+        from .history import history_of
+        
+        subscription = UserSubscription.objects.create(user=self.user, plan=self.basic)
+        subscription.renew(end_date=timezone.now() + timedelta(days=30))
+        subscription.plan = self.premium
+        subscription.save()
+        subscription.cancel()
+        self.assertEqual(self.states(), [
+            ('Basic', 'active', False),
+            ('Basic', 'active', False),
+            ('Premium', 'active', False),
+            ('Premium', 'cancelled', True),
+        ])
+        intervals = list(history_of(self.user.pk))
+        for previous, following in zip(intervals, intervals[1:]):
+            self.assertEqual(previous.valid_to, following.valid_from)
+        self.assertEqual({interval.subscription_id for interval in intervals}, {subscription.pk})
+    
+    def test_unchanged_save_adds_nothing(self):
+        """Test that saving a subscription without a change to its state keeps the open interval"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import SubscriptionInterval
+        
+        subscription = UserSubscription.objects.create(user=self.user, plan=self.basic)
+        with CaptureQueriesContext(connection) as queries:
+            subscription.save()
+            UserSubscription.objects.get(pk=subscription.pk).save()
+            UserSubscription.objects.get(pk=subscription.pk).save(update_fields=['updated_at'])
+        # The history is neither read nor written
+        self.assertFalse([query for query in queries if SubscriptionInterval._meta.db_table in query['sql']])
+        self.assertEqual(self.states(), [('Basic', 'active', True)])
+    
+    def test_intervals_never_overlap(self):
+        """Test that the database rejects an interval overlapping another one of the subscription"""
+        from django.db import IntegrityError, transaction
+        from .models import SubscriptionInterval
+        
+        subscription = UserSubscription.objects.create(user=self.user, plan=self.basic)
+        current = SubscriptionInterval.objects.get(subscription_id=subscription.pk)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SubscriptionInterval.objects.create(
+                subscription_id=subscription.pk, user=self.user, plan=self.basic, plan_name='Basic', status='cancelled',
+                valid_from=current.valid_from + timedelta(hours=1),
+            )
+        # Another subscription's intervals may overlap it
+        other = UserSubscription.objects.create(user=self.user, plan=self.premium, status='expired')
+        self.assertEqual(SubscriptionInterval.objects.filter(subscription_id=other.pk).count(), 1)
+    
+    def test_plan_at(self):
+        """Test that plan_at answers with the plan the user had at past times"""
+        from .history import plan_at
+        
+        before = timezone.now()
+        subscription = UserSubscription.objects.create(user=self.user, plan=self.basic)
+        on_basic = timezone.now()
+        subscription.plan = self.premium
+        subscription.save()
+        on_premium = timezone.now()
+        subscription.cancel()
+        
+        self.assertIsNone(plan_at(self.user.pk, before))
+        self.assertEqual(plan_at(self.user.pk, on_basic), 'Basic')
+        self.assertEqual(plan_at(self.user.pk, on_premium), 'Premium')
+        self.assertIsNone(plan_at(self.user.pk, timezone.now()))
+    
+    def test_active_at_respects_end_date(self):
+        """Test that a subscription past its end date is not active at later times, though never expired"""
+        from .models import SubscriptionInterval
+        
+        UserSubscription.objects.create(user=self.user, plan=self.basic, end_date=timezone.now() + timedelta(days=10))
+        later = timezone.now() + timedelta(days=20)
+        self.assertEqual(SubscriptionInterval.objects.at(later).count(), 1)
+        self.assertEqual(SubscriptionInterval.objects.active_at(later).count(), 0)
+        self.assertEqual(SubscriptionInterval.objects.active_at(timezone.now()).count(), 1)
+    
+    def test_bulk_updates_are_recorded(self):
+        """Test that the admin actions, the expiry job and replacing a subscription record the history"""
+        from django.test import Client
+        from .jobs import expire_subscriptions
+        from .utils import create_user_subscription
+        
+        subscription = create_user_subscription(self.user, self.basic, end_date=timezone.now() + timedelta(days=30))
+        replacement = create_user_subscription(self.user, self.premium, end_date=timezone.now() - timedelta(days=1))
+        self.assertEqual(self.states(), [
+            ('Basic', 'active', False),
+            ('Basic', 'cancelled', True),
+            ('Premium', 'active', True),
+        ])
+        
+        self.assertEqual(expire_subscriptions(), 1)
+        self.assertEqual(self.states()[-1], ('Premium', 'expired', True))
+        
+        client = Client()
+        client.force_login(self.admin_user)
+        response = client.post('/admin/subscriptions/usersubscription/', {
+            'action': 'activate_subscriptions', '_selected_action': [subscription.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.states()[-1], ('Basic', 'active', True))
+        self.assertEqual(len(self.states()), 5)
+        self.assertNotEqual(subscription.pk, replacement.pk)
+    
+    def test_delete_closes_interval(self):
+        """Test that deleting a subscription closes its open interval and keeps its history"""
+        from .history import plan_at
+        
+        subscription = UserSubscription.objects.create(user=self.user, plan=self.basic)
+        during = timezone.now()
+        subscription.delete()
+        self.assertEqual(self.states(), [('Basic', 'active', False)])
+        self.assertEqual(plan_at(self.user.pk, during), 'Basic')
+    
+    def test_churn(self):
+        """Test that churn counts the users active at the start without a subscription at the end"""
+        from .history import churn
+        
+        other = User.objects.create_user(email='other@example.com', name='Other', password='testpass123')
+        leaving = UserSubscription.objects.create(user=self.user, plan=self.basic)
+        UserSubscription.objects.create(user=other, plan=self.basic)
+        start = timezone.now()
+        leaving.cancel()
+        report = churn(start, timezone.now())
+        self.assertEqual(report['active_at_start'], 2)
+        self.assertEqual(report['churned'], 1)
+        self.assertEqual(report['churn_rate'], 0.5)
+    
+    def test_backfill(self):
+        """Test that backfill opens an interval for subscriptions without history"""
+        from .history import backfill
+        from .models import SubscriptionInterval
+        
+        UserSubscription.objects.create(user=self.user, plan=self.basic)
+        SubscriptionInterval.objects.all().delete()
+        self.assertEqual(backfill(), 1)
+        self.assertEqual(backfill(), 0)
+        self.assertEqual(self.states(), [('Basic', 'active', True)])
+    
+    def test_admin_history_endpoint(self):
+        """Test that admins can list the intervals in force at a time and the churn"""
+        from django.test import Client
+        from .models import SubscriptionInterval
+        
+        subscription = UserSubscription.objects.create(user=self.user, plan=self.basic)
+        during = timezone.now()
+        subscription.cancel()
+        
+        client = Client()
+        client.force_login(self.admin_user)
+        response = client.get('/api/admin/subscription-history/', {'user': self.user.pk, 'at': during.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['plan_name'], row['status']) for row in response.json()['results']], [('Basic', 'active')]
+        )
+        response = client.get('/api/admin/subscription-history/', {'at': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        interval = SubscriptionInterval.objects.filter(user=self.user).first()
+        response = client.get(f'/api/admin/subscription-history/{interval.pk}/', {'user': 'not-a-uuid'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'user': ['Not a valid id']})
+        response = client.get('/api/admin/subscription-history/churn/', {'start': during.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['churned'], 1)
+        
+        client.force_login(self.user)
+        self.assertEqual(client.get('/api/admin/subscription-history/').status_code, 403)
+
+
+class SubscriptionArchiveTest(TestCase):
+    """Test cases for moving old terminal subscriptions to the archive"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.plan = SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('9.99'))
+        self.user = User.objects.create_user(email='user@example.com', name='User', password='testpass123')
+        self.admin_user = User.objects.create_user(
+            email='admin@example.com', name='Admin User', password='adminpass123', is_staff=True
+        )
+        self.old_expired = UserSubscription.objects.create(user=self.user, plan=self.plan, status='expired')
+        self.old_cancelled = UserSubscription.objects.create(user=self.user, plan=self.plan, status='cancelled')
+        self.active = UserSubscription.objects.create(user=self.user, plan=self.plan)
+        UserSubscription.objects.filter(pk__in=[self.old_expired.pk, self.old_cancelled.pk]).update(
+            updated_at=timezone.now() - timedelta(days=365)
+        )
+    
+    def test_moves_old_terminal_subscriptions(self):
+        """Test that only expired and cancelled subscriptions past the retention window are archived"""
+        from .archive import archive_subscriptions
+        from .models import ArchivedSubscription
+        
+        recent = User.objects.create_user(email='recent@example.com', name='Recent', password='testpass123')
+        UserSubscription.objects.create(user=recent, plan=self.plan, status='cancelled')
+        
+        self.assertEqual(archive_subscriptions(), 2)
+        self.assertEqual(
+            set(UserSubscription.objects.values_list('status', flat=True)), {'active', 'cancelled'}
+        )
+        archived = ArchivedSubscription.objects.get(pk=self.old_expired.pk)
+        self.assertEqual(
+            (archived.user_id, archived.plan_id, archived.status, archived.created_at),
+            (self.user.pk, self.plan.pk, 'expired', self.old_expired.created_at),
+        )
+        self.assertEqual(archive_subscriptions(), 0)
+    
+    def test_batches_and_follow_up_job(self):
+        """Test that a run stops after MAX_BATCHES batches and enqueues the rest"""
+        from jobs.models import Job
+        from .archive import archive_subscriptions
+        from .models import ArchivedSubscription
+        
+        with override_settings(SUBSCRIPTION_ARCHIVE={'BATCH_SIZE': 1, 'MAX_BATCHES': 1, 'PAUSE': 0}):
+            self.assertEqual(archive_subscriptions(), 1)
+            self.assertEqual(Job.objects.filter(task='subscriptions.archive.archive_subscriptions').count(), 1)
+            self.assertEqual(archive_subscriptions(max_batches=5), 1)
+        self.assertEqual(ArchivedSubscription.objects.count(), 2)
+    
+    def test_history_is_kept(self):
+        """Test that archiving a subscription does not close its history"""
+        from .archive import archive_subscriptions
+        from .models import SubscriptionInterval
+        
+        archive_subscriptions()
+        self.assertEqual(
+            SubscriptionInterval.objects.current().get(subscription_id=self.old_expired.pk).status, 'expired'
+        )
+    
+    def test_admin_api_reads_both_tables(self):
+        """Test that the admin listing includes archived subscriptions on request, and retrieves them by id"""
+        from django.test import Client
+        from .archive import archive_subscriptions
+        
+        archive_subscriptions()
+        client = Client()
+        client.force_login(self.admin_user)
+        
+        response = client.get('/api/admin/subscriptions/')
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.active.pk])
+        
+        response = client.get('/api/admin/subscriptions/', {'archived': 'include'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(
+            [(row['id'], row['archived']) for row in response.json()['results']],
+            [(self.active.pk, False), (self.old_cancelled.pk, True), (self.old_expired.pk, True)],
+        )
+        self.assertEqual(response.json()['results'][1]['plan']['name'], 'Basic')
+        
+        response = client.get('/api/admin/subscriptions/', {'archived': 'only', 'active': 'true'})
+        self.assertEqual(response.json()['count'], 0)
+        response = client.get('/api/admin/subscriptions/', {'archived': 'sometimes'})
+        self.assertEqual(response.status_code, 400)
+        
+        response = client.get(f'/api/admin/subscriptions/{self.old_expired.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['archived'])
+        self.assertEqual(client.get('/api/admin/subscriptions/999999/').status_code, 404)
+    
+    def test_admin_changelist_reads_both_tables(self):
+        """Test the archived filter of the subscription change list"""
+        from django.test import Client
+        from .archive import archive_subscriptions
+        from .models import ArchivedSubscription
+        
+        archive_subscriptions()
+        self.admin_user.is_superuser = True
+        self.admin_user.save(update_fields=['is_superuser'])
+        client = Client()
+        client.force_login(self.admin_user)
+        url = '/admin/subscriptions/usersubscription/'
+        
+        response = client.get(url)
+        self.assertEqual(list(response.context['cl'].result_list), [self.active])
+        
+        response = client.get(url, {'archived': 'include'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertEqual(
+            [(row.pk, isinstance(row, ArchivedSubscription)) for row in response.context['cl'].result_list],
+            [(self.active.pk, False), (self.old_cancelled.pk, True), (self.old_expired.pk, True)],
+        )
+        self.assertContains(response, f'/admin/subscriptions/archivedsubscription/{self.old_expired.pk}/change/')
+        
+        response = client.get(url, {'archived': 'include', 'status': 'expired'})
+        self.assertEqual([row.pk for row in response.context['cl'].result_list], [self.old_expired.pk])
+        response = client.get(url, {'archived': 'include', 'status__exact': 'cancelled', 'q': 'user@example.com'})
+        self.assertEqual([row.pk for row in response.context['cl'].result_list], [self.old_cancelled.pk])
+        response = client.get(url, {'archived': 'only', 'currently_active': 'yes'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+        response = client.get(url, {'archived': 'only'})
+        self.assertEqual(
+            [row.pk for row in response.context['cl'].result_list], [self.old_cancelled.pk, self.old_expired.pk]
+        )
+    
+    def test_export_reads_both_tables(self):
+        """Test that export_subscriptions writes current and archived subscriptions"""
+        import csv
+        from io import StringIO
+        from django.core.management import call_command
+        from .archive import archive_subscriptions
+        
+        archive_subscriptions()
+        output = StringIO()
+        call_command('export_subscriptions', stdout=output)
+        rows = list(csv.DictReader(StringIO(output.getvalue())))
+        self.assertEqual(
+            sorted((int(row['id']), row['archived']) for row in rows),
+            [(self.old_expired.pk, 'True'), (self.old_cancelled.pk, 'True'), (self.active.pk, 'False')],
+        )
+        output = StringIO()
+        call_command('export_subscriptions', archived='exclude', stdout=output)
+        self.assertEqual(len(list(csv.DictReader(StringIO(output.getvalue())))), 1)
+
+
+@override_settings(JOBS={'CHUNK_SIZE': 2, 'CHUNK_PAUSE': 0})
+class PlanDeletionTest(TestCase):
+    """Test cases for deleting plans in the background"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.plan = SubscriptionPlan.objects.create(name='Basic', features=['feature1'], price=Decimal('9.99'))
+        self.other_plan = SubscriptionPlan.objects.create(name='Premium', features=['feature1'], price=Decimal('29.99'))
+        self.admin_user = User.objects.create_user(
+            email='admin@example.com', name='Admin User', password='adminpass123', is_staff=True, is_superuser=True
+        )
+        self.users = [
+            User.objects.create_user(
+                email=f'user{index}@example.com', name='User', password='testpass123', subscription_plan=self.plan
+            )
+            for index in range(3)
+        ]
+        for user in self.users:
+            UserSubscription.objects.create(user=user, plan=self.plan)
+        UserSubscription.objects.create(user=self.users[0], plan=self.plan, status='expired')
+        self.client.force_login(self.admin_user)
+    
+    def run_jobs(self):
+        from jobs.queue import Worker
+        
+        Worker(name='w', poll_interval=0).run(burst=True)
+    
+    def test_delete_returns_job_and_deletes_in_chunks(self):
+        """Test that DELETE deactivates the plan at once and a job deletes its subscriptions, then the plan"""
+        from jobs.models import Job
+        from .history import plan_at
+        
+        during = timezone.now()
+        response = self.client.delete(f'/api/plans/{self.plan.pk}/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Location'], response.json()['status_url'])
+        self.plan.refresh_from_db()
+        self.assertFalse(self.plan.is_active)
+        self.assertEqual(UserSubscription.objects.count(), 4)
+        
+        self.run_jobs()
+        job = Job.objects.get(pk=response.json()['job'])
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(
+            job.progress['done'], {'users': 3, 'subscriptions': 4, 'archived_subscriptions': 0, 'history': 4}
+        )
+        self.assertFalse(SubscriptionPlan.objects.filter(pk=self.plan.pk).exists())
+        self.assertFalse(UserSubscription.objects.exists())
+        self.assertFalse(User.objects.filter(subscription_plan__isnull=False).exists())
+        # The history remembers the plan by name
+        self.assertEqual(plan_at(self.users[0].pk, during), 'Basic')
+        
+        status_response = self.client.get(response.json()['status_url'])
+        self.assertEqual(status_response.json()['progress']['step'], 'finished')
+    
+    def test_delete_twice_returns_same_job(self):
+        """Test that a second DELETE of a plan being deleted returns the same job"""
+        first = self.client.delete(f'/api/plans/{self.plan.pk}/')
+        second = self.client.delete(f'/api/plans/{self.plan.pk}/')
+        self.assertEqual(first.json()['job'], second.json()['job'])
+    
+    def test_admin_delete_starts_job(self):
+        """Test that the admin deletes a plan in the background, and retries after the job failed"""
+        from jobs.models import Job
+        
+        response = self.client.post(f'/admin/subscriptions/subscriptionplan/{self.plan.pk}/delete/', {'post': 'yes'})
+        self.assertRedirects(response, '/admin/subscriptions/subscriptionplan/')
+        self.plan.refresh_from_db()
+        self.assertFalse(self.plan.is_active)
+        job = Job.objects.get(key=f'delete-plan:{self.plan.pk}')
+        self.assertEqual(job.status, Job.QUEUED)
+        
+        Job.objects.filter(pk=job.pk).update(status=Job.FAILED)
+        response = self.client.post('/admin/subscriptions/subscriptionplan/', {
+            'action': 'delete_selected', '_selected_action': [self.plan.pk], 'post': 'yes',
+        })
+        self.assertEqual(response.status_code, 302)
+        retry = Job.objects.get(key=f'delete-plan:{self.plan.pk}')
+        self.assertNotEqual(retry.pk, job.pk)
+        self.assertEqual(retry.status, Job.QUEUED)
+        self.run_jobs()
+        self.assertFalse(SubscriptionPlan.objects.filter(pk=self.plan.pk).exists())
+    
+    def test_reassigned_users_are_invalidated(self):
+        """Test that users moved to another plan are dropped from the per-worker caches"""
+        from django.test import Client
+        from rest_framework_simplejwt.tokens import AccessToken
+        from accounts import authentication
+        from .deletion import delete_plan
+        
+        user = self.users[0]
+        response = Client().get('/api/auth/users/me/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(str(user.pk), authentication._known_users)
+        
+        delete_plan(self.plan.pk, reassign_to=self.other_plan.pk)
+        self.assertNotIn(str(user.pk), authentication._known_users)
+    
+    def test_reassign_subscriptions(self):
+        """Test that ?reassign_to= moves the subscriptions and users to another plan"""
+        from .models import SubscriptionInterval
+        
+        response = self.client.delete(f'/api/plans/{self.plan.pk}/?reassign_to={self.other_plan.pk}')
+        self.assertEqual(response.status_code, 202)
+        self.run_jobs()
+        self.assertFalse(SubscriptionPlan.objects.filter(pk=self.plan.pk).exists())
+        self.assertEqual(UserSubscription.objects.filter(plan=self.other_plan).count(), 4)
+        self.assertEqual(User.objects.filter(subscription_plan=self.other_plan).count(), 3)
+        self.assertEqual(
+            set(SubscriptionInterval.objects.current().values_list('plan_name', flat=True)), {'Premium'}
+        )
+        
+        for target in (self.plan.pk, 'abc', 999999):
+            response = self.client.delete(f'/api/plans/{self.other_plan.pk}/?reassign_to={target}')
+            self.assertEqual(response.status_code, 400)
+    
+    def test_admin_delete_runs_in_background(self):
+        """Test that deleting a plan in the admin deactivates it and schedules the job"""
+        from jobs.models import Job
+        
+        url = f'/admin/subscriptions/subscriptionplan/{self.plan.pk}/delete/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post(url, {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.plan.refresh_from_db()
+        self.assertFalse(self.plan.is_active)
+        self.assertTrue(Job.objects.filter(key=f'delete-plan:{self.plan.pk}').exists())
+        self.run_jobs()
+        self.assertFalse(SubscriptionPlan.objects.filter(pk=self.plan.pk).exists())
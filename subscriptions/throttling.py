@@ -0,0 +1,199 @@
+"""
+Plan-aware rate limiting.
+
+``PlanRateThrottle`` limits each caller by the first match of:
+``RATE_LIMITS['ROLES']`` (role, or ``'staff'`` for staff users), the
+``FEATURES`` of the user's plan, the plan's name in ``PLANS``, then
+``DEFAULT`` for users without a plan and ``ANON`` (per client IP) for
+anonymous requests. A rate is ``'<requests>/<sec|min|hour|day>'``; None
+means unlimited.
+
+Counts are kept in the ``RATE_LIMITS['CACHE']`` cache, shared by every
+worker when it is Redis, as a sliding-window counter: one counter per fixed
+window, with the previous window's count weighted by how much of it still
+overlaps the sliding window. Increments are atomic (``cache.incr``).
+
+Each worker adds up requests locally and pushes them to the shared counter
+in batches of ``LOCAL_BATCH``, as long as the estimated count is below
+``LOCAL_THRESHOLD`` of the limit; closer to the limit every request goes to
+the shared store. So most requests cost no cache round trip, and a client
+can overshoot the limit by at most ``LOCAL_BATCH - 1`` requests per worker.
+"""
+
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from .catalog import get_plan
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    'ANON': '60/min',
+    'DEFAULT': '60/min',
+    'ROLES': {},
+    'FEATURES': {},
+    'PLANS': {},
+    'LOCAL_BATCH': 10,
+    'LOCAL_THRESHOLD': 0.5,
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Keys of local counters kept per worker
+MAX_COUNTERS = 50000
+
+_lock = threading.Lock()
+# key -> [window, shared count seen, local count not pushed, previous window count or None]
+_counters = {}
+
+
+def get_rate_limit_setting(name):
+    """Return a RATE_LIMITS setting, falling back to the default value"""
+    return getattr(settings, 'RATE_LIMITS', {}).get(name, DEFAULTS[name])
+
+
+def parse_rate(rate):
+    """Return ``(requests, seconds)`` of a rate like ``'120/min'``, or None if unlimited"""
+    if rate is None:
+        return None
+    requests, period = rate.split('/')
+    return int(requests), PERIODS[period[0]]
+
+
+def rate_for(user):
+    """Return the rate string that applies to ``user``"""
+    if not user or not user.is_authenticated:
+        return get_rate_limit_setting('ANON')
+    roles = get_rate_limit_setting('ROLES')
+    if user.role in roles:
+        return roles[user.role]
+    if user.is_staff and 'staff' in roles:
+        return roles['staff']
+    plan = get_plan(user.subscription_plan_id) if user.subscription_plan_id else None
+    if plan is not None:
+        features = get_rate_limit_setting('FEATURES')
+        for feature in plan.features or ():
+            if feature in features:
+                return features[feature]
+        plans = get_rate_limit_setting('PLANS')
+        if plan.name in plans:
+            return plans[plan.name]
+    return get_rate_limit_setting('DEFAULT')
+
+
+def _incr(cache, key, delta, timeout):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # No counter yet; if another worker creates it first, add to theirs
+        if cache.add(key, delta, timeout):
+            return delta
+        return cache.incr(key, delta)
+
+
+def _push(key, window, period, delta, fetch_previous):
+    cache = caches[get_rate_limit_setting('CACHE')]
+    shared = _incr(cache, f'{key}:{window}', delta, period * 2)
+    previous = cache.get(f'{key}:{window - 1}', 0) if fetch_previous else None
+    return shared, previous
+
+
+def _estimate(previous, current, elapsed):
+    return previous * (1 - elapsed) + current
+
+
+def _retry_after(limit, period, previous, current, elapsed):
+    """Seconds until one more request fits in the sliding window"""
+    if current >= limit:
+        # Wait for the next window, until enough of this one has slid out
+        return period * (1 - elapsed) + period * (1 - (limit - 1) / current)
+    return period * ((1 - (limit - current - 1) / previous) - elapsed) if previous else 0
+
+
+def hit(key, limit, period, now=None):
+    """
+    Count a request against ``limit`` requests per ``period`` seconds.
+
+    Return ``(allowed, remaining, reset, retry_after)``; a refused request is
+    not counted. ``reset`` is the number of seconds until the current window ends.
+    """
+    now = time.time() if now is None else now
+    window = int(now // period)
+    elapsed = now / period - window
+    reset_in = period * (1 - elapsed)
+    batch = get_rate_limit_setting('LOCAL_BATCH')
+
+    with _lock:
+        state = _counters.get(key)
+        stale = None
+        if state is None or state[0] != window:
+            if state is not None and state[2]:
+                stale = state
+            if len(_counters) >= MAX_COUNTERS:
+                _counters.clear()
+            state = _counters[key] = [window, 0, 0, None]
+        previous = state[3]
+        if previous is not None:
+            estimate = _estimate(previous, state[1] + state[2] + 1, elapsed)
+            if state[2] + 1 < batch and estimate <= limit * get_rate_limit_setting('LOCAL_THRESHOLD'):
+                # Fast path: well below the limit, count locally
+                state[2] += 1
+                return True, max(0, limit - math.ceil(estimate)), reset_in, 0
+        delta = state[2] + 1
+        state[2] = 0
+
+    if stale is not None:
+        # Requests of the last window other workers still need to see
+        _push(key, stale[0], period, stale[2], False)
+    shared, fetched = _push(key, window, period, delta, previous is None)
+
+    with _lock:
+        if fetched is not None:
+            state[3] = previous = fetched
+        state[1] = max(state[1], shared)
+    estimate = _estimate(previous, shared, elapsed)
+    if estimate > limit:
+        caches[get_rate_limit_setting('CACHE')].decr(f'{key}:{window}')
+        with _lock:
+            state[1] = max(0, state[1] - 1)
+        return False, 0, reset_in, max(1, math.ceil(_retry_after(limit, period, previous, shared - 1, elapsed)))
+    return True, max(0, limit - math.ceil(estimate)), reset_in, 0
+
+
+def reset():
+    """Forget the local counters of this process (counts not pushed yet are lost)"""
+    with _lock:
+        _counters.clear()
+
+
+class PlanRateThrottle(BaseThrottle):
+    """Throttle requests by the caller's role and subscription plan"""
+
+    def __init__(self):
+        self.retry_after = None
+
+    def allow_request(self, request, view):
+        if not get_rate_limit_setting('ENABLED'):
+            return True
+        rate = parse_rate(rate_for(request.user))
+        if rate is None:
+            return True
+        limit, period = rate
+        if request.user and request.user.is_authenticated:
+            key = f'rl:user:{request.user.pk}'
+        else:
+            key = f'rl:anon:{self.get_ident(request)}'
+        allowed, remaining, reset_in, retry_after = hit(key, limit, period)
+        # Read by RateLimitHeadersMiddleware
+        request._request.rate_limit = (limit, remaining, math.ceil(reset_in))
+        if not allowed:
+            self.retry_after = retry_after
+        return allowed
+
+    def wait(self):
+        return self.retry_after
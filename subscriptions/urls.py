@@ -1,15 +1,20 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import SubscriptionPlanViewSet, UserSubscriptionViewSet
+from .views import (
+    AdminSubscriptionHistoryViewSet, AdminUsageViewSet, SubscriptionPlanViewSet, UsageViewSet, UserSubscriptionViewSet,
+)
 
 # Create router for ViewSets
 router = DefaultRouter()
 router.register(r'plans', SubscriptionPlanViewSet, basename='plan')
 router.register(r'user-subscriptions', UserSubscriptionViewSet, basename='user-subscription')
+router.register(r'usage', UsageViewSet, basename='usage')
 
 # Admin-specific router
 admin_router = DefaultRouter()
 admin_router.register(r'subscriptions', UserSubscriptionViewSet, basename='admin-subscription')
+admin_router.register(r'usage', AdminUsageViewSet, basename='admin-usage')
+admin_router.register(r'subscription-history', AdminSubscriptionHistoryViewSet, basename='admin-subscription-history')
 
 app_name = 'subscriptions'
 
@@ -1,6 +1,11 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.utils import timezone
+from .catalog import get_plan
+from .entitlements import get_entitlement, is_active, remaining_days
+from .history import update_recorded
 from .models import UserSubscription
+from .queries import ACTIVE_SUBSCRIPTION
 
 User = get_user_model()
 
@@ -19,19 +24,16 @@ def has_feature_access(user, feature_name):
     if not user or not user.is_authenticated:
         return False
     
-    try:
-        subscription = UserSubscription.objects.get(
-            user=user, 
-            status='active'
-        )
-        
-        # Check if subscription is still valid
-        if not subscription.is_active:
-            return False
-            
-        return feature_name in subscription.plan.features
-    except UserSubscription.DoesNotExist:
+    # Served from the entitlement snapshot, even while the database is down
+    subscription = get_entitlement(user.pk)
+    
+    # Check if subscription is still valid
+    if not is_active(subscription):
         return False
+    
+    plan = get_plan(subscription['plan__id'])
+    features = plan.features if plan else subscription['plan__features']
+    return feature_name in (features or [])
 
 
 def get_user_subscription(user):
@@ -47,13 +49,7 @@ def get_user_subscription(user):
     if not user or not user.is_authenticated:
         return None
     
-    try:
-        return UserSubscription.objects.get(
-            user=user, 
-            status='active'
-        )
-    except UserSubscription.DoesNotExist:
-        return None
+    return ACTIVE_SUBSCRIPTION.first(user_id=user.pk)
 
 
 def get_user_plan(user):
@@ -66,8 +62,10 @@ def get_user_plan(user):
     Returns:
         SubscriptionPlan instance or None if no active subscription
     """
-    subscription = get_user_subscription(user)
-    return subscription.plan if subscription else None
+    if not user or not user.is_authenticated:
+        return None
+    subscription = get_entitlement(user.pk)
+    return get_plan(subscription['plan__id']) if subscription else None
 
 
 def get_user_features(user):
@@ -94,11 +92,9 @@ def is_subscription_expired(user):
     Returns:
         bool: True if subscription is expired, False otherwise
     """
-    subscription = get_user_subscription(user)
-    if not subscription:
+    if not user or not user.is_authenticated:
         return True
-    
-    return not subscription.is_active
+    return not is_active(get_entitlement(user.pk))
 
 
 def get_subscription_remaining_days(user):
@@ -111,11 +107,9 @@ def get_subscription_remaining_days(user):
     Returns:
         int or None: Number of remaining days, None if unlimited
     """
-    subscription = get_user_subscription(user)
-    if not subscription:
+    if not user or not user.is_authenticated:
         return None
-    
-    return subscription.get_remaining_days()
+    return remaining_days(get_entitlement(user.pk))
 
 
 def can_upgrade_subscription(user, target_plan):
@@ -180,19 +174,17 @@ def create_user_subscription(user, plan, end_date=None, status='active'):
     Returns:
         UserSubscription: Created subscription instance
     """
-    # Cancel any existing active subscription
-    UserSubscription.objects.filter(
-        user=user, 
-        status='active'
-    ).update(status='cancelled')
-    
-    # Create new subscription
-    return UserSubscription.objects.create(
-        user=user,
-        plan=plan,
-        end_date=end_date,
-        status=status
-    )
+    with transaction.atomic():
+        # Cancel any existing active subscription
+        update_recorded(UserSubscription.objects.filter(user=user, status='active'), status='cancelled')
+        
+        # Create new subscription
+        return UserSubscription.objects.create(
+            user=user,
+            plan=plan,
+            end_date=end_date,
+            status=status
+        )
 
 
 def cancel_user_subscription(user):
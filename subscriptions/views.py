@@ -1,11 +1,29 @@
-from rest_framework import viewsets, status, permissions
+from rest_framework import viewsets, status, permissions, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.shortcuts import get_object_or_404
+from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
-from .models import SubscriptionPlan, UserSubscription
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Count, Sum
+from django.http import Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import datetime, timedelta
+from jobs.views import accepted
+from medhashaala.resilience import UNAVAILABLE, DatabaseUnavailable
+from .archive import CombinedSubscriptions
+from .deletion import start_plan_deletion
+from .entitlements import get_entitlement
+from .history import churn
+from .metering import current_period, flush as flush_usage, usage_report
+from .models import ArchivedSubscription, SubscriptionInterval, SubscriptionPlan, UsageRecord, UserSubscription
+from .projections import SUBSCRIPTION_READ
+from .sparse import SparseQuerysetMixin
 from .serializers import (
+    ArchivedSubscriptionSerializer,
+    SubscriptionIntervalSerializer,
     SubscriptionPlanSerializer, 
     UserSubscriptionSerializer, 
     UserSubscriptionReadSerializer
@@ -27,7 +45,7 @@ class IsAdminOrReadOnly(permissions.BasePermission):
         return request.user.is_staff
 
 
-class SubscriptionPlanViewSet(viewsets.ModelViewSet):
+class SubscriptionPlanViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing subscription plans.
     
@@ -35,7 +53,8 @@ class SubscriptionPlanViewSet(viewsets.ModelViewSet):
     - GET /api/plans/{id}/ - Retrieve specific plan (all users)
     - POST /api/plans/ - Create new plan (admin only)
     - PUT/PATCH /api/plans/{id}/ - Update plan (admin only)
-    - DELETE /api/plans/{id}/ - Delete plan (admin only)
+    - DELETE /api/plans/{id}/ - Deactivate the plan and delete it in the background (admin only, 202);
+      ?reassign_to=<plan id> moves its subscriptions and users to that plan instead of deleting them
     """
     
     queryset = SubscriptionPlan.objects.all()
@@ -46,10 +65,23 @@ class SubscriptionPlanViewSet(viewsets.ModelViewSet):
         """Filter plans based on user permissions"""
         if self.request.user.is_staff:
             # Admin users can see all plans
-            return SubscriptionPlan.objects.all()
+            queryset = SubscriptionPlan.objects.all()
         else:
             # Regular users can only see active plans
-            return SubscriptionPlan.objects.filter(is_active=True)
+            queryset = SubscriptionPlan.objects.filter(is_active=True)
+        return self.sparse_queryset(queryset)
+    
+    def destroy(self, request, *args, **kwargs):
+        """Deactivate the plan now; its subscriptions and the plan are deleted by a job, in chunks"""
+        plan = self.get_object()
+        reassign_to = None
+        if 'reassign_to' in request.query_params:
+            value = request.query_params['reassign_to']
+            if value.isdigit():
+                reassign_to = SubscriptionPlan.objects.exclude(pk=plan.pk).filter(pk=value).first()
+            if reassign_to is None:
+                return Response({'reassign_to': ['Not another existing plan']}, status=status.HTTP_400_BAD_REQUEST)
+        return accepted(request, start_plan_deletion(plan, reassign_to))
     
     @action(detail=True, methods=['post'], permission_classes=[IsAdminUser])
     def enable_disable(self, request, pk=None):
@@ -75,12 +107,16 @@ class SubscriptionPlanViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class UserSubscriptionViewSet(viewsets.ModelViewSet):
+class UserSubscriptionViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing user subscriptions.
     
     - GET /api/user-subscriptions/ - Get current user's subscription (all users)
     - GET /api/admin/subscriptions/ - List all subscriptions (admin only)
+      ?active=true|false filters on is_active, ?expires_within=<days> lists
+      active subscriptions ending within that many days; ?archived=include
+      adds the archived subscriptions, ?archived=only lists just those
+    - GET /api/admin/subscriptions/{id}/ - Retrieve a current or archived subscription (admin only)
     - POST /api/admin/subscriptions/ - Create subscription (admin only)
     - PUT/PATCH /api/admin/subscriptions/{id}/ - Update subscription (admin only)
     - DELETE /api/admin/subscriptions/{id}/ - Delete subscription (admin only)
@@ -92,10 +128,36 @@ class UserSubscriptionViewSet(viewsets.ModelViewSet):
         """Filter subscriptions based on user permissions"""
         if self.request.user.is_staff:
             # Admin users can see all subscriptions
-            return UserSubscription.objects.all()
+            queryset = UserSubscription.objects.all()
+            if self.action == 'list':
+                queryset = self.filter_by_activity(queryset)
         else:
             # Regular users can only see their own subscription
-            return UserSubscription.objects.filter(user=self.request.user)
+            queryset = UserSubscription.objects.filter(user=self.request.user)
+        if self.request.method in permissions.SAFE_METHODS:
+            # Writes render the saved instance, whose end_date may have changed
+            queryset = queryset.with_remaining_days()
+        # Every serializer nests the plan (unless ?fields= leaves it out)
+        return self.sparse_queryset(queryset.select_related('plan'))
+    
+    def filter_by_activity(self, queryset):
+        """Apply ?active= and ?expires_within= in the database"""
+        params = self.request.query_params
+        now = timezone.now()
+        if 'active' in params:
+            active = self.parse_param('active', serializers.BooleanField())
+            queryset = queryset.active(now) if active else queryset.inactive(now)
+        if 'expires_within' in params:
+            days = self.parse_param('expires_within', serializers.IntegerField(min_value=0, max_value=3650))
+            queryset = queryset.expiring_within(days, now)
+        return queryset
+    
+    def parse_param(self, name, field):
+        """Parse a query parameter with a serializer field; invalid values answer 400"""
+        try:
+            return field.run_validation(self.request.query_params[name])
+        except serializers.ValidationError as exc:
+            raise serializers.ValidationError({name: exc.detail})
     
     def get_serializer_class(self):
         """Use different serializers based on user permissions"""
@@ -117,23 +179,60 @@ class UserSubscriptionViewSet(viewsets.ModelViewSet):
         """Override list to handle user's own subscription"""
         if not request.user.is_staff:
             # For regular users, return their current subscription
-            subscription = UserSubscription.objects.filter(
-                user=request.user, 
-                status='active'
-            ).first()
+            subscription = SUBSCRIPTION_READ.for_request(request).first(
+                UserSubscription.objects.filter(user=request.user, status='active')
+            )
             
             if subscription:
-                serializer = self.get_serializer(subscription)
-                return Response(serializer.data)
+                return Response(subscription)
             else:
                 return Response(
                     {'message': 'No active subscription found'}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
         
+        if 'archived' in request.query_params:
+            return self.list_with_archive(request)
+        
         # For admin users, return all subscriptions
         return super().list(request, *args, **kwargs)
     
+    def list_with_archive(self, request):
+        """List archived subscriptions, alone or with the current ones, newest first"""
+        mode = self.parse_param('archived', serializers.ChoiceField(['include', 'only']))
+        archived = ArchivedSubscription.objects.select_related('plan')
+        params = request.query_params
+        if 'expires_within' in params or ('active' in params and self.parse_param('active', serializers.BooleanField())):
+            # Archived subscriptions are never active
+            archived = archived.none()
+        if mode == 'only':
+            subscriptions = archived
+        else:
+            subscriptions = CombinedSubscriptions(self.get_queryset(), archived)
+        page = self.paginate_queryset(subscriptions)
+        if page is None:
+            return Response([self.represent(subscription) for subscription in subscriptions])
+        return self.get_paginated_response([self.represent(subscription) for subscription in page])
+    
+    def represent(self, subscription):
+        """Serialize a current or archived subscription, flagged with 'archived'"""
+        if isinstance(subscription, ArchivedSubscription):
+            serializer = ArchivedSubscriptionSerializer(subscription, context=self.get_serializer_context())
+            return dict(serializer.data, archived=True)
+        return dict(self.get_serializer(subscription).data, archived=False)
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Admins also retrieve archived subscriptions by id"""
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            archived = None
+            if request.user.is_staff and str(kwargs['pk']).isdigit():
+                archived = ArchivedSubscription.objects.select_related('plan').filter(pk=kwargs['pk']).first()
+            if archived is None:
+                raise
+        return Response(self.represent(archived))
+    
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def my_subscription(self, request):
         """
@@ -141,14 +240,16 @@ class UserSubscriptionViewSet(viewsets.ModelViewSet):
         
         GET /api/user-subscriptions/my_subscription/
         """
-        subscription = UserSubscription.objects.filter(
-            user=request.user, 
-            status='active'
-        ).first()
+        # Same output as UserSubscriptionReadSerializer, rendered from the
+        # entitlement snapshot so it is served while the database is down
+        projection = SUBSCRIPTION_READ.for_request(request)
+        try:
+            subscription = get_entitlement(request.user.pk)
+        except UNAVAILABLE:
+            raise DatabaseUnavailable()
         
         if subscription:
-            serializer = UserSubscriptionReadSerializer(subscription)
-            return Response(serializer.data)
+            return Response(projection.render(subscription))
         else:
             return Response(
                 {'message': 'No active subscription found'}, 
@@ -189,3 +290,125 @@ class UserSubscriptionViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(subscription)
         return Response(serializer.data)
+
+
+class UsageViewSet(viewsets.ViewSet):
+    """
+    Usage report for the current billing period.
+    
+    - GET /api/usage/ - Usage, limit and remaining allowance per metered
+      metric for the current user (admins may pass ?user=<id>)
+    """
+    
+    permission_classes = [IsAuthenticated]
+    
+    def list(self, request):
+        user_id = request.user.pk
+        if request.query_params.get('user'):
+            if not request.user.is_staff:
+                return Response({'error': 'Only admins can view the usage of other users'}, status=status.HTTP_403_FORBIDDEN)
+            try:
+                user_id = get_object_or_404(get_user_model(), pk=request.query_params['user']).pk
+            except DjangoValidationError:
+                return Response({'user': ['Not a valid user id']}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(usage_report(user_id))
+
+
+class AdminUsageViewSet(viewsets.ViewSet):
+    """
+    Usage totals across all users.
+    
+    - GET /api/admin/usage/?period=YYYY-MM - Totals and top users per metric (admin only)
+    """
+    
+    permission_classes = [IsAdminUser]
+    
+    def list(self, request):
+        period = current_period()
+        if request.query_params.get('period'):
+            try:
+                period = datetime.strptime(request.query_params['period'], '%Y-%m').date()
+            except ValueError:
+                return Response({'period': ['Use the YYYY-MM format']}, status=status.HTTP_400_BAD_REQUEST)
+        # Include this worker's unflushed counts
+        flush_usage()
+        records = UsageRecord.objects.filter(period=period)
+        metrics = {
+            row['metric']: {'total': row['total'], 'users': row['users']}
+            for row in records.values('metric').annotate(total=Sum('count'), users=Count('user')).order_by('metric')
+        }
+        top = records.select_related('user').order_by('-count')[:10]
+        return Response({
+            'period_start': period,
+            'metrics': metrics,
+            'top_users': [
+                {'user': record.user_id, 'email': record.user.email, 'metric': record.metric, 'count': record.count}
+                for record in top
+            ],
+        })
+
+
+def _parse_moment(value):
+    """Parse an ISO 8601 date-time query parameter as an aware datetime, or return None"""
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        return None
+    if moment is not None and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class AdminSubscriptionHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The append-only subscription history (admin only).
+    
+    - GET /api/admin/subscription-history/?user=&subscription=&at= - Intervals, optionally those in force at a time
+    - GET /api/admin/subscription-history/churn/?start=&end= - Users active at start without a subscription at end
+    """
+    
+    serializer_class = SubscriptionIntervalSerializer
+    permission_classes = [IsAdminUser]
+    
+    def get_queryset(self):
+        queryset = SubscriptionInterval.objects.order_by('-valid_from', '-id')
+        params = self.request.query_params
+        errors = {}
+        for param, field in (('user', 'user_id'), ('subscription', 'subscription_id')):
+            if params.get(param):
+                try:
+                    value = SubscriptionInterval._meta.get_field(field).to_python(params[param])
+                except DjangoValidationError:
+                    errors[param] = ['Not a valid id']
+                else:
+                    queryset = queryset.filter(**{field: value})
+        if params.get('at'):
+            moment = _parse_moment(params['at'])
+            if moment is None:
+                errors['at'] = ['Use an ISO 8601 date-time']
+            else:
+                queryset = queryset.at(moment)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return queryset
+    
+    @action(detail=False, methods=['get'])
+    def churn(self, request):
+        """Share of the users active at ``start`` (default: 30 days ago) with no active subscription at ``end`` (default: now)"""
+        end = timezone.now()
+        start = end - timedelta(days=30)
+        errors = {}
+        for name in ('start', 'end'):
+            if request.query_params.get(name):
+                moment = _parse_moment(request.query_params[name])
+                if moment is None:
+                    errors[name] = ['Use an ISO 8601 date-time']
+                elif name == 'start':
+                    start = moment
+                else:
+                    end = moment
+        if not errors and start >= end:
+            errors['start'] = ['Must be before end']
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(churn(start, end))